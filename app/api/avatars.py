@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+from data_source.api.avatar_cache import AvatarCache
+
+router = APIRouter(
+    prefix='/avatars',
+)
+
+# avatars rarely change, and a changed one gets fetched under the same hash only after it is evicted
+CACHE_CONTROL = 'private, max-age=86400'
+# the images come from third parties, so the browser must neither sniff them nor run anything in them
+SECURITY_HEADERS = {'Content-Security-Policy': "default-src 'none'; style-src 'unsafe-inline'",
+                    'X-Content-Type-Options': 'nosniff'}
+
+
+@router.get("/{avatar_hash}")
+def get_avatar(avatar_hash: str, request: Request):
+    cached = AvatarCache.get(avatar_hash)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+
+    path, content_type = cached
+    etag = f'"{avatar_hash}"'
+    headers = {'Cache-Control': CACHE_CONTROL, 'ETag': etag, **SECURITY_HEADERS}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type=content_type, headers=headers)
@@ -1,16 +1,250 @@
-from fastapi import APIRouter
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
 from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
 
-from search_logic import search_documents
+from inference import schedulers
+from search_logic import search_documents_async, search_documents_batch, search_documents_stream, find_answer, \
+    facet_counts, search_documents_page, FACET_SCOPES
+from searching.budget import SEARCH_PRESETS, StageCosts
+from searching.cache import SearchCache
+from indexing.suggestion_index import SuggestionIndex, SUGGESTION_KINDS
+from searching.filters import SearchFilter
+from searching.pagination import SearchCursors
+from searching.semantic_cache import SemanticQueryCache
+from searching.slow_query_log import SlowQueryLog
+from searching.trace import SearchTrace
 from telemetry import Posthog
 
 router = APIRouter(
     prefix='/search',
 )
 
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_QUERIES = 64
+
+
+class SearchFilterDto(BaseModel):
+    data_source: Optional[List[str]] = None
+    data_source_id: Optional[List[int]] = None
+    type: Optional[List[str]] = None
+    location: Optional[List[str]] = None
+    author: Optional[List[str]] = None
+    from_time: Optional[datetime] = None
+    to_time: Optional[datetime] = None
+    is_active: Optional[bool] = None
+
+    def to_search_filter(self) -> SearchFilter:
+        return SearchFilter(data_sources=self.data_source, data_source_ids=self.data_source_id, types=self.type,
+                            locations=self.location, authors=self.author, from_time=self.from_time,
+                            to_time=self.to_time, is_active=self.is_active)
+
+
+class BatchSearchDto(BaseModel):
+    queries: List[str]
+    top_k: int = 10
+    mode: Optional[str] = None
+    budget_ms: Optional[float] = None
+    lazy_answers: bool = False
+    filters: Optional[SearchFilterDto] = None
+    debug: bool = False
+
+
+def search_filter_params(data_source: Optional[List[str]] = Query(None),
+                         data_source_id: Optional[List[int]] = Query(None),
+                         type: Optional[List[str]] = Query(None), location: Optional[List[str]] = Query(None),
+                         author: Optional[List[str]] = Query(None), from_time: Optional[datetime] = None,
+                         to_time: Optional[datetime] = None, is_active: Optional[bool] = None) -> SearchFilter:
+    """
+    The filter query params, repeat a param to allow several values (e.g. ?data_source=jira&data_source=slack).
+    """
+    return SearchFilterDto(data_source=data_source, data_source_id=data_source_id, type=type, location=location,
+                           author=author, from_time=from_time, to_time=to_time,
+                           is_active=is_active).to_search_filter()
+
+
+def _validate_mode(mode: Optional[str]):
+    if mode is not None and mode not in SEARCH_PRESETS:
+        raise HTTPException(status_code=400, detail=f"mode should be one of {', '.join(SEARCH_PRESETS)}")
+
+
+def _add_trace_headers(response: Response, trace: SearchTrace):
+    response.headers['X-Search-Stages'] = ','.join(trace.stages)
+    response.headers['Server-Timing'] = ', '.join(f'{stage};dur={elapsed_ms:.2f}'
+                                                  for stage, elapsed_ms in trace.timings_ms.items())
+    if trace.skipped:
+        response.headers['X-Search-Skipped-Stages'] = ','.join(f'{stage}={reason}'
+                                                               for stage, reason in trace.skipped.items())
+
+
+def _with_debug(response: dict, trace: SearchTrace) -> dict:
+    response['debug'] = trace.to_dict()
+    return response
+
 
 @router.get("")
-async def search(request: Request, query: str, top_k: int = 10):
+async def search(request: Request, response: Response, query: str, top_k: int = 10, mode: Optional[str] = None,
+                 budget_ms: Optional[float] = None, lazy_answers: bool = False, debug: bool = False,
+                 search_filter: SearchFilter = Depends(search_filter_params)):
+    """
+    With debug, the results come wrapped as {results, debug} where debug holds the stages that ran,
+    their candidate counts and timings.
+    """
+    _validate_mode(mode)
     uuid_header = request.headers.get('uuid')
     Posthog.increase_search_count(uuid=uuid_header)
-    return search_documents(query, top_k)
+    trace = SearchTrace()
+    results = await search_documents_async(query, top_k, mode=mode, budget_ms=budget_ms, lazy_answers=lazy_answers,
+                                           trace=trace, search_filter=search_filter)
+    _add_trace_headers(response, trace)
+    SlowQueryLog.record(query, trace, 'search', mode=mode, top_k=top_k)
+    if debug:
+        return _with_debug({'results': results}, trace)
+    return results
+
+
+def _server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get("/stream")
+async def search_stream(request: Request, query: str, top_k: int = 10, mode: Optional[str] = None,
+                        budget_ms: Optional[float] = None, lazy_answers: bool = False,
+                        search_filter: SearchFilter = Depends(search_filter_params)):
+    """
+    Server-Sent Events version of the search: 'retrieval' hits first, a refined ordering after every rerank stage,
+    then 'results' and finally 'done' with the stages that ran.
+    """
+    _validate_mode(mode)
+    uuid_header = request.headers.get('uuid')
+    Posthog.increase_search_count(uuid=uuid_header)
+
+    async def events():
+        trace = SearchTrace()
+        try:
+            async for event, data in search_documents_stream(query, top_k, mode=mode, budget_ms=budget_ms,
+                                                             lazy_answers=lazy_answers, trace=trace,
+                                                             search_filter=search_filter):
+                yield _server_sent_event(event, data)
+            yield _server_sent_event('done', trace.to_dict())
+            SlowQueryLog.record(query, trace, 'stream', mode=mode, top_k=top_k)
+        except Exception:
+            logger.exception("Streaming search failed")
+            yield _server_sent_event('error', {'message': 'Oops. Server error...'})
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# a plain def, so FastAPI runs the (blocking) batch search in its thread pool
+@router.post("/batch")
+def search_batch(request: Request, response: Response, dto: BatchSearchDto):
+    if len(dto.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    _validate_mode(dto.mode)
+
+    uuid_header = request.headers.get('uuid')
+    for _ in dto.queries:
+        Posthog.increase_search_count(uuid=uuid_header)
+    trace = SearchTrace()
+    search_filter = dto.filters.to_search_filter() if dto.filters is not None else None
+    results = search_documents_batch(dto.queries, dto.top_k, mode=dto.mode, budget_ms=dto.budget_ms,
+                                     lazy_answers=dto.lazy_answers, trace=trace, search_filter=search_filter)
+    _add_trace_headers(response, trace)
+    SlowQueryLog.record('\n'.join(dto.queries), trace, 'batch', mode=dto.mode, top_k=dto.top_k)
+    if dto.debug:
+        return _with_debug({'results': results}, trace)
+    return results
+
+
+# a plain def, so FastAPI runs the (blocking) search in its thread pool
+@router.get("/paged")
+def search_paged(request: Request, response: Response, query: Optional[str] = None, page_size: int = 10,
+                 cursor: Optional[str] = None, mode: Optional[str] = None, budget_ms: Optional[float] = None,
+                 lazy_answers: bool = False, debug: bool = False,
+                 search_filter: SearchFilter = Depends(search_filter_params)):
+    """
+    The first page is searched with the query, the next ones are fetched with the returned next_cursor
+    (the other parameters are then taken from the first request).
+    """
+    if cursor is None and not query:
+        raise HTTPException(status_code=400, detail="Either query or cursor is required")
+    if page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size should be positive")
+    _validate_mode(mode)
+
+    if cursor is None:
+        Posthog.increase_search_count(uuid=request.headers.get('uuid'))
+    trace = SearchTrace()
+    try:
+        page = search_documents_page(query, page_size, cursor=cursor, mode=mode, budget_ms=budget_ms,
+                                     lazy_answers=lazy_answers, trace=trace, search_filter=search_filter)
+    except KeyError:
+        raise HTTPException(status_code=410, detail="The cursor has expired, search again")
+    _add_trace_headers(response, trace)
+    if query:
+        SlowQueryLog.record(query, trace, 'paged', mode=mode, top_k=page_size)
+    if debug:
+        return _with_debug(jsonable_encoder(page), trace)
+    return page
+
+
+@router.get("/suggest")
+async def suggest(prefix: str, limit: int = 10, kind: Optional[List[str]] = Query(None)):
+    """
+    Search-as-you-type suggestions: titles, locations and authors starting with the prefix
+    (or with a word starting with it), the popular and recent ones first.
+    """
+    if kind and any(value not in SUGGESTION_KINDS for value in kind):
+        raise HTTPException(status_code=400, detail=f"kind should be one of {', '.join(SUGGESTION_KINDS)}")
+    return SuggestionIndex.get().suggest(prefix, limit=min(limit, 50), kinds=kind)
+
+
+# a plain def, so FastAPI runs the QA model in its thread pool
+@router.get("/{paragraph_id}/answer")
+def answer(paragraph_id: int, query: str):
+    """
+    The answer span of a single result, for searches made with lazy_answers.
+    """
+    answer_span = find_answer(query, paragraph_id)
+    if answer_span is None:
+        raise HTTPException(status_code=404, detail=f"Paragraph {paragraph_id} not found")
+    return answer_span
+
+
+# a plain def, so FastAPI runs the retrieval in its thread pool
+@router.get("/facets")
+def facets(query: str, scope: str = 'candidates', limit: int = 20, mode: Optional[str] = None,
+           search_filter: SearchFilter = Depends(search_filter_params)):
+    """
+    Paragraph counts per data source, type, location and author, for drilling down into the results of the query.
+    """
+    if scope not in FACET_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope should be one of {', '.join(FACET_SCOPES)}")
+    _validate_mode(mode)
+    return facet_counts(query, search_filter, scope=scope, limit=limit, mode=mode)
+
+
+@router.get("/slow-queries")
+def slow_queries(limit: int = 20, since_hours: Optional[float] = None):
+    """
+    The slowest searches of the slow-query log (see SLOW_QUERY_THRESHOLD_MS), slowest first.
+    """
+    since = datetime.utcnow() - timedelta(hours=since_hours) if since_hours is not None else None
+    return SlowQueryLog.worst(limit=min(limit, 200), since=since)
+
+
+@router.get("/stats")
+async def search_stats():
+    return {'cache': SearchCache.stats(),
+            'semantic_cache': SemanticQueryCache.get_instance().stats(),
+            'cursors': SearchCursors.stats(),
+            'inference': schedulers.get_stats(),
+            'stage_costs_ms_per_candidate': StageCosts.get_stats()}
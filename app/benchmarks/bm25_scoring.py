@@ -0,0 +1,148 @@
+"""
+Compares the BM25 query latency of the pruned and the vectorized scorers (indexing.bm25_scoring) with scoring
+term at a time over dense per-paragraph arrays, and with rank_bm25's BM25Okapi on the corpus sizes it can still
+be built for, checking that all of them rank the same.
+Queries of mostly rare terms and queries of common terms only are measured separately.
+The corpora are synthetic: paragraphs of about 30 tokens drawn from a Zipf distribution, in segments of
+SEGMENT_SIZE paragraphs like the index builds them. 5M paragraphs need about 6 GB of memory.
+
+Usage (from the app directory): python -m benchmarks.bm25_scoring [--sizes 100000 1000000 5000000] [--queries 50]
+                                                         [--top-k 5]
+"""
+import argparse
+import statistics
+import time
+from typing import List, Tuple
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from indexing.bm25_scoring import B, K1, Bm25Stats, pruned_top_k, top_k
+from indexing.bm25_segment import Bm25Segment
+
+VOCABULARY_SIZE = 200_000
+AVERAGE_LENGTH = 30
+SEGMENT_SIZE = 1_000_000
+
+
+def _segment(rng: np.random.Generator, name: str, first_id: int, count: int) -> Bm25Segment:
+    lengths = rng.poisson(AVERAGE_LENGTH, count).astype(np.int32)
+    tokens = np.minimum(rng.zipf(1.2, int(lengths.sum())), VOCABULARY_SIZE) - 1
+    positions = np.repeat(np.arange(count, dtype=np.int64), lengths)
+    postings, frequencies = np.unique(positions * VOCABULARY_SIZE + tokens, return_counts=True)
+    return Bm25Segment.from_postings(name, np.arange(first_id, first_id + count, dtype=np.int64), lengths,
+                                     postings % VOCABULARY_SIZE, (postings // VOCABULARY_SIZE).astype(np.int32),
+                                     frequencies.astype(np.int32))
+
+
+def synthetic_corpus(size: int) -> Tuple[List[Bm25Segment], Bm25Stats]:
+    rng = np.random.default_rng(size)
+    segments = [_segment(rng, f'segment.{i}', start, min(SEGMENT_SIZE, size - start))
+                for i, start in enumerate(range(0, size, SEGMENT_SIZE))]
+    document_frequencies = np.zeros(VOCABULARY_SIZE, dtype=np.int64)
+    for segment in segments:
+        term_ids, counts = segment.document_frequencies()
+        document_frequencies[term_ids] += counts
+    return segments, Bm25Stats.of(size, sum(int(segment.lengths.sum()) for segment in segments),
+                                  document_frequencies)
+
+
+def _term_at_a_time(segments: List[Bm25Segment], stats: Bm25Stats, term_ids: List[int], k: int):
+    """
+    The previous scorer: a dense score array per segment, updated term by term, partitioned whole.
+    """
+    average_length = stats.total_length / stats.count
+    ids, scores = [], []
+    for segment in segments:
+        segment_scores = np.zeros(len(segment))
+        for term_id in term_ids:
+            positions, frequencies = segment.postings(term_id)
+            segment_scores[positions] += stats.idf(term_id) * (frequencies * (K1 + 1) / (
+                frequencies + K1 * (1 - B + B * segment.lengths[positions] / average_length)))
+        ids.append(segment.ids[segment.live])
+        scores.append(segment_scores[segment.live])
+    ids, scores = np.concatenate(ids), np.concatenate(scores)
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+def _rank_bm25(index: BM25Okapi, term_ids: List[int], k: int):
+    scores = index.get_scores(term_ids)
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(int(i), float(scores[i])) for i in top]
+
+
+def _measure(run, queries: List[List[int]]):
+    # the scorers cache per average length what they can, which the first queries after indexing compute
+    for query in queries:
+        run(query)
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(run(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], results
+
+
+def _same_ranking(expected, actual) -> bool:
+    # ties may come in any order, the scores at every rank have to match
+    return len(expected) == len(actual) and np.allclose([score for _, score in expected],
+                                                        [score for _, score in actual], rtol=1e-9, atol=1e-12)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5, help='BM_25_CANDIDATES without a GPU is 5, with one 100')
+    parser.add_argument('--rank-bm25-max-size', type=int, default=100_000,
+                        help='the largest corpus to build a BM25Okapi for, it keeps a dict per paragraph')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query_sets = {
+        # mostly rare terms with a common one now and then, like real queries
+        'mixed': [(np.minimum(rng.zipf(1.1, rng.integers(2, 5)), VOCABULARY_SIZE) - 1).tolist()
+                  for _ in range(args.queries)],
+        # the 100 most common terms, most of the corpus contains one of them
+        'common': [rng.integers(0, 100, rng.integers(2, 5)).tolist() for _ in range(args.queries)],
+    }
+    k = args.top_k
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        segments, stats = synthetic_corpus(size)
+        postings = sum(int(segment.indptr[-1]) for segment in segments)
+        print(f'{size:>9} paragraphs, {postings} postings in {len(segments)} segments '
+              f'(built in {time.perf_counter() - start:.1f}s), top {k}')
+
+        index = None
+        if size <= args.rank_bm25_max_size:
+            segment = segments[0]
+            corpus = [[] for _ in range(len(segment))]
+            for term_id, position, frequency in zip(segment.posting_terms(), *segment.decode()):
+                corpus[position] += [int(term_id)] * int(frequency)
+            index = BM25Okapi(corpus)
+
+        for name, queries in query_sets.items():
+            print(f'  {name} queries')
+            p50, p95, pruned = _measure(lambda query: pruned_top_k(segments, stats, query, k), queries)
+            print(f'{"    pruned":<20} p50 {p50:8.1f}ms p95 {p95:8.1f}ms')
+            p50, p95, vectorized = _measure(lambda query: top_k(segments, stats, query, k), queries)
+            same = sum(_same_ranking(expected, actual) for expected, actual in zip(vectorized, pruned))
+            print(f'{"    vectorized":<20} p50 {p50:8.1f}ms p95 {p95:8.1f}ms | same ranking {same}/{len(queries)}')
+            p50, p95, dense = _measure(lambda query: _term_at_a_time(segments, stats, query, k), queries)
+            same = sum(_same_ranking(expected, actual) for expected, actual in zip(dense, pruned))
+            print(f'{"    term at a time":<20} p50 {p50:8.1f}ms p95 {p95:8.1f}ms | same ranking {same}/{len(queries)}')
+            if index is not None:
+                p50, p95, reference = _measure(lambda query: _rank_bm25(index, query, k), queries)
+                same = sum(_same_ranking(expected, actual) for expected, actual in zip(reference, pruned))
+                print(f'{"    rank_bm25":<20} p50 {p50:8.1f}ms p95 {p95:8.1f}ms | '
+                      f'same ranking {same}/{len(queries)}')
+
+
+if __name__ == '__main__':
+    main()
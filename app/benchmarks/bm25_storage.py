@@ -0,0 +1,92 @@
+"""
+Compares the BM25 segment formats on a synthetic corpus (see benchmarks.bm25_scoring): the .npz files the segments
+used to be saved as, read whole when the index opens, and the memory-mapped directories with varint postings.
+Measures the size on disk, the time to open a segment and the memory it takes on the heap, then the latency of the
+first queries, which decode the postings of their terms, and of the same queries again.
+The page cache is warm for both formats, right after writing them.
+
+Usage (from the app directory): python -m benchmarks.bm25_storage [--size 1000000] [--queries 50]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.bm25_scoring import VOCABULARY_SIZE, synthetic_corpus
+from indexing.bm25_scoring import top_k
+from indexing.bm25_segment import Bm25Segment
+
+TOP_K = 5
+
+
+def _size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.iterdir()) if path.is_dir() else path.stat().st_size
+
+
+def _opened(load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, heap
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    segments, stats = synthetic_corpus(args.size)
+    rng = np.random.default_rng(0)
+    queries = [(np.minimum(rng.zipf(1.1, rng.integers(2, 5)), VOCABULARY_SIZE) - 1).tolist()
+               for _ in range(args.queries)]
+    print(f'{args.size} paragraphs, {sum(int(segment.indptr[-1]) for segment in segments)} postings')
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for segment in segments:
+            positions, frequencies = segment.decode()
+            with open(directory / f'{segment.name}.npz', 'wb') as f:
+                np.savez(f, ids=segment.ids, lengths=segment.lengths, term_ids=segment.term_ids,
+                         indptr=segment.indptr, positions=positions, frequencies=frequencies)
+            segment.save(directory / segment.name)
+
+        def load_npz():
+            loaded = []
+            for segment in segments:
+                with np.load(directory / f'{segment.name}.npz') as arrays:
+                    loaded.append({key: arrays[key] for key in arrays.files})
+            return loaded
+
+        def load_mapped():
+            return [Bm25Segment.load(segment.name, directory / segment.name) for segment in segments]
+
+        npz_size = sum(_size(directory / f'{segment.name}.npz') for segment in segments)
+        mapped_size = sum(_size(directory / segment.name) for segment in segments)
+        _, npz_time, npz_heap = _opened(load_npz)
+        mapped, mapped_time, mapped_heap = _opened(load_mapped)
+        print(f'{"  npz":<12} {npz_size / 2 ** 20:8.1f}MB on disk, opened in {npz_time * 1000:8.1f}ms, '
+              f'{npz_heap / 2 ** 20:8.1f}MB on the heap')
+        print(f'{"  mapped":<12} {mapped_size / 2 ** 20:8.1f}MB on disk, opened in {mapped_time * 1000:8.1f}ms, '
+              f'{mapped_heap / 2 ** 20:8.1f}MB on the heap')
+
+        for name in ('first', 'again'):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                top_k(mapped, stats, query, TOP_K)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            print(f'  {name + " queries":<14} p50 {statistics.median(latencies):8.1f}ms '
+                  f'p95 {latencies[int(len(latencies) * 0.95) - 1]:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
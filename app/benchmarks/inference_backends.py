@@ -0,0 +1,73 @@
+"""
+Compares the latency of the torch and the quantized ONNX Runtime models on the shapes the search path uses:
+a single query embedding, cross-encoder batches of query-paragraph pairs and QA batches of query-window pairs.
+
+Usage (from the app directory): python -m benchmarks.inference_backends [--repeats 20]
+"""
+import argparse
+import statistics
+import time
+
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from transformers import pipeline
+
+from inference.onnx_backend import OnnxBiEncoder, OnnxCrossEncoder, ONNX_INTRA_OP_THREADS, ONNX_QUANTIZATION, \
+    onnx_qa_pipeline
+
+QUERY = 'how do I rotate the staging database credentials?'
+PARAGRAPH = ('To rotate the staging database credentials, run the rotate-secrets job from the ops dashboard, '
+             'wait for it to finish and restart the api pods so they pick up the new secret. ') * 3
+
+
+def _measure(run, repeats: int):
+    run()  # warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def _report(name: str, torch_run, onnx_run, repeats: int):
+    torch_p50, torch_p95 = _measure(torch_run, repeats)
+    onnx_p50, onnx_p95 = _measure(onnx_run, repeats)
+    print(f'{name:<40} torch p50 {torch_p50:8.1f}ms p95 {torch_p95:8.1f}ms | '
+          f'onnx p50 {onnx_p50:8.1f}ms p95 {onnx_p95:8.1f}ms | speedup {torch_p50 / onnx_p50:4.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'onnx quantization: {ONNX_QUANTIZATION}, intra-op threads: {ONNX_INTRA_OP_THREADS}')
+
+    torch_bi_encoder = SentenceTransformer('multi-qa-MiniLM-L6-cos-v1')
+    onnx_bi_encoder = OnnxBiEncoder('sentence-transformers/multi-qa-MiniLM-L6-cos-v1')
+    _report('bi-encoder, 1 query',
+            lambda: torch_bi_encoder.encode(QUERY, convert_to_tensor=True),
+            lambda: onnx_bi_encoder.encode(QUERY, convert_to_tensor=True), args.repeats)
+
+    for model_name, batch_sizes in [('cross-encoder/ms-marco-TinyBERT-L-2-v2', [32, 64]),
+                                    ('cross-encoder/ms-marco-MiniLM-L-6-v2', [15, 32])]:
+        torch_cross_encoder = CrossEncoder(model_name)
+        onnx_cross_encoder = OnnxCrossEncoder(model_name)
+        for batch_size in batch_sizes:
+            pairs = [(QUERY, PARAGRAPH)] * batch_size
+            _report(f'{model_name.split("/")[-1]}, {batch_size} pairs',
+                    lambda: torch_cross_encoder.predict(pairs, batch_size=batch_size, show_progress_bar=False),
+                    lambda: onnx_cross_encoder.predict(pairs, batch_size=batch_size), args.repeats)
+
+    torch_qa_model = pipeline('question-answering', model='deepset/roberta-base-squad2')
+    onnx_qa_model = onnx_qa_pipeline('deepset/roberta-base-squad2')
+    for batch_size in [1, 10]:
+        questions, contexts = [QUERY] * batch_size, [PARAGRAPH] * batch_size
+        _report(f'roberta-base-squad2, {batch_size} pairs',
+                lambda: torch_qa_model(question=questions, context=contexts, batch_size=batch_size),
+                lambda: onnx_qa_model(question=questions, context=contexts, batch_size=batch_size), args.repeats)
+
+
+if __name__ == '__main__':
+    main()
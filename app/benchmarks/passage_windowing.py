@@ -0,0 +1,119 @@
+"""
+Compares reading whole paragraphs with reading only their best-matching window (see searching.windowing)
+in the large cross-encoder and the QA model: the latency of both, how often the relevant paragraph still
+ranks first, and how often QA still finds the expected answer.
+The paragraphs are long, with the relevant sentence somewhere in the middle of unrelated ones.
+
+Usage (from the app directory): python -m benchmarks.passage_windowing [--repeats 5] [--window-chars 600]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sentence_transformers import CrossEncoder
+from transformers import pipeline
+
+from searching.windowing import best_window
+
+# (query, the sentence answering it, the expected answer)
+FACTS = [
+    ('how do I rotate the staging database credentials?',
+     'To rotate the staging database credentials, run the rotate-secrets job from the ops dashboard.',
+     'run the rotate-secrets job'),
+    ('who owns the billing service?',
+     'The billing service is owned by the payments team, reach them in their channel.',
+     'the payments team'),
+    ('what port does the metrics exporter listen on?',
+     'The metrics exporter listens on port 9102 on every node.',
+     '9102'),
+    ('when is the weekly release cut?',
+     'The weekly release is cut every Tuesday at noon, after the regression suite passes.',
+     'every Tuesday at noon'),
+    ('where are the nightly backups stored?',
+     'Nightly backups are stored in the cold-storage bucket of the eu-west region.',
+     'the cold-storage bucket'),
+    ('how long are access logs retained?',
+     'Access logs are retained for ninety days and deleted afterwards.',
+     'ninety days'),
+]
+FILLER = [
+    'The team met on Monday to go over the roadmap for the next quarter.',
+    'Several dashboards were renamed to follow the new naming convention.',
+    'Remember to update the changelog whenever a user-facing change is merged.',
+    'The onboarding guide was moved to the new wiki space last month.',
+    'Most of the flaky tests were traced back to shared fixtures.',
+    'Design reviews happen asynchronously in the pull request itself.',
+    'The office will be closed during the public holiday next week.',
+    'Linting runs on every commit and blocks the merge when it fails.',
+    'The incident retro is scheduled for Thursday afternoon.',
+    'New hires get access to the sandbox environment on their first day.',
+]
+
+
+def _paragraph(rng: random.Random, sentence: str = None, length: int = 16) -> str:
+    sentences = [rng.choice(FILLER) for _ in range(length)]
+    if sentence is not None:
+        sentences.insert(rng.randrange(length // 4, length * 3 // 4), sentence)
+    return ' '.join(sentences)
+
+
+def _measure(run, repeats: int):
+    result = run()  # warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), result
+
+
+def _window(query: str, paragraph: str, window_chars: int) -> str:
+    start, end = best_window(paragraph, query, window_chars)
+    return paragraph[start:end]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--window-chars', type=int, default=600)
+    parser.add_argument('--distractors', type=int, default=9)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cases = []
+    for query, sentence, answer in FACTS:
+        candidates = [_paragraph(rng, sentence)] + [_paragraph(rng) for _ in range(args.distractors)]
+        cases.append((query, answer, candidates))
+    average_length = statistics.mean(len(candidate) for _, _, candidates in cases for candidate in candidates)
+    print(f'{len(cases)} queries, {args.distractors + 1} candidates each, '
+          f'{average_length:.0f} chars per paragraph, {args.window_chars} chars per window')
+
+    cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+    qa_model = pipeline('question-answering', model='deepset/roberta-base-squad2')
+
+    for name, window_chars in [('whole paragraphs', 0), ('windows', args.window_chars)]:
+        pairs = [(query, _window(query, candidate, window_chars)) for query, _, candidates in cases
+                 for candidate in candidates]
+        windowing_ms, _ = _measure(lambda: [_window(query, candidate, window_chars) for query, _, candidates in cases
+                                            for candidate in candidates], args.repeats)
+        cross_encoder_ms, scores = _measure(
+            lambda: cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False), args.repeats)
+        per_query = len(cases[0][2])
+        first = sum(1 for i in range(len(cases))
+                    if max(range(per_query), key=lambda j: scores[i * per_query + j]) == 0)
+
+        # QA reads the relevant paragraph of every query
+        qa_pairs = [pairs[i * per_query] for i in range(len(cases))]
+        qa_ms, answers = _measure(lambda: qa_model(question=[query for query, _ in qa_pairs],
+                                                   context=[context for _, context in qa_pairs],
+                                                   batch_size=len(qa_pairs)), args.repeats)
+        found = sum(1 for (_, answer, _), predicted in zip(cases, answers)
+                    if answer.lower() in predicted['answer'].lower() or predicted['answer'].lower() in answer.lower())
+
+        print(f'{name:<18} windowing {windowing_ms:7.1f}ms | cross-encoder {cross_encoder_ms:8.1f}ms, '
+              f'relevant first {first}/{len(cases)} | qa {qa_ms:8.1f}ms, answer found {found}/{len(cases)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures how long the server takes to start: importing the app, the startup steps, and the time until the models
+are warmed up (when /api/v1/ready starts returning 200).
+
+Usage (from the app directory): python -m benchmarks.startup [--repeats 3]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_SNIPPET = 'import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)'
+
+
+def _import_time() -> float:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def _timed(name: str, run):
+    start = time.perf_counter()
+    run()
+    print(f'{name:<45} {(time.perf_counter() - start) * 1000:10.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    import_times = [_import_time() for _ in range(args.repeats)]
+    print(f'{"import main (fresh interpreter, median)":<45} {statistics.median(import_times) * 1000:10.1f}ms')
+
+    start = time.perf_counter()
+    import models
+    from data_source.api.context import DataSourceContext
+    from data_source.api.dynamic_loader import DynamicLoader
+    from indexing.bm25_index import Bm25Index
+    from indexing.faiss_index import FaissIndex
+
+    models.warm_up()
+    _timed('FaissIndex.create', FaissIndex.create)
+    _timed('Bm25Index.create', Bm25Index.create)
+    _timed('DataSourceContext.init', DataSourceContext.init)
+
+    DynamicLoader._class_bases = None
+    _timed('connector discovery (from manifest)', DynamicLoader.find_data_sources)
+
+    models.wait_until_ready()
+    print(f'{"startup until models are ready":<45} {(time.perf_counter() - start) * 1000:10.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import requests
+
+from paths import AVATARS_PATH
+
+logger = logging.getLogger(__name__)
+
+AVATAR_CACHE_MAX_BYTES = int(os.environ.get('AVATAR_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+MAX_AVATAR_BYTES = 1024 * 1024
+AVATAR_FETCH_TIMEOUT = 5
+
+# no svg: it can carry scripts, and the images are served from the app's own origin
+CONTENT_TYPE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+EXTENSION_CONTENT_TYPES = {extension: content_type for content_type, extension in CONTENT_TYPE_EXTENSIONS.items()}
+
+
+class AvatarCache:
+    """
+    Author images on disk, keyed by a hash of their original url.
+    Connectors whose images need authentication fetch them while indexing (see fetch),
+    search results then point to /api/v1/avatars/{hash} instead of the original url.
+    The least recently used images are evicted once the cache grows over AVATAR_CACHE_MAX_BYTES.
+    """
+    _lock = threading.Lock()
+    # hash => (file name, size), least recently used first
+    _entries: Optional['OrderedDict[str, Tuple[str, int]]'] = None
+    _total_bytes = 0
+
+    @staticmethod
+    def avatar_hash(image_url: str) -> str:
+        return hashlib.sha256(image_url.encode('utf-8')).hexdigest()[:32]
+
+    @classmethod
+    def _load(cls):
+        if cls._entries is not None:
+            return
+
+        AVATARS_PATH.mkdir(parents=True, exist_ok=True)
+        files = sorted(AVATARS_PATH.iterdir(), key=lambda path: path.stat().st_mtime)
+        cls._entries = OrderedDict()
+        for path in files:
+            if path.suffix.lstrip('.') in EXTENSION_CONTENT_TYPES:
+                size = path.stat().st_size
+                cls._entries[path.stem] = (path.name, size)
+                cls._total_bytes += size
+
+    @classmethod
+    def url_for(cls, image_url: Optional[str]) -> Optional[str]:
+        """
+        The url to serve the image from, if it is cached.
+        """
+        if not image_url:
+            return None
+
+        with cls._lock:
+            cls._load()
+            avatar_hash = cls.avatar_hash(image_url)
+            if avatar_hash not in cls._entries:
+                return None
+        return f'/api/v1/avatars/{avatar_hash}'
+
+    @classmethod
+    def get(cls, avatar_hash: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the (file path, content type) of a cached image.
+        """
+        with cls._lock:
+            cls._load()
+            entry = cls._entries.get(avatar_hash)
+            if entry is None:
+                return None
+            cls._entries.move_to_end(avatar_hash)
+
+        file_name, _ = entry
+        path = AVATARS_PATH / file_name
+        try:
+            # the modification time orders the eviction after a restart
+            os.utime(path)
+        except OSError:
+            return None
+        return str(path), EXTENSION_CONTENT_TYPES[path.suffix.lstrip('.')]
+
+    @classmethod
+    def fetch(cls, image_url: Optional[str], session: Optional[requests.Session] = None,
+              download_url: Optional[str] = None) -> Optional[str]:
+        """
+        Downloads the image unless it is cached already, returns its hash (or None if it can't be fetched).
+        session carries the connector's authentication, download_url overrides where the image is fetched from.
+        """
+        if not image_url:
+            return None
+
+        avatar_hash = cls.avatar_hash(image_url)
+        with cls._lock:
+            cls._load()
+            if avatar_hash in cls._entries:
+                return avatar_hash
+
+        try:
+            response = (session or requests).get(download_url or image_url, timeout=AVATAR_FETCH_TIMEOUT)
+            response.raise_for_status()
+        except Exception:
+            logger.warning(f"Failed to fetch author image {image_url}")
+            return None
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type)
+        if extension is None or len(response.content) > MAX_AVATAR_BYTES:
+            logger.warning(f"Skipping author image {image_url} ({content_type}, {len(response.content)} bytes)")
+            return None
+
+        file_name = f'{avatar_hash}.{extension}'
+        tmp_path = AVATARS_PATH / f'{file_name}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, AVATARS_PATH / file_name)
+
+        with cls._lock:
+            if avatar_hash not in cls._entries:
+                cls._entries[avatar_hash] = (file_name, len(response.content))
+                cls._total_bytes += len(response.content)
+            cls._evict()
+        return avatar_hash
+
+    @classmethod
+    def _evict(cls):
+        while cls._total_bytes > AVATAR_CACHE_MAX_BYTES and len(cls._entries) > 1:
+            _, (file_name, size) = cls._entries.popitem(last=False)
+            cls._total_bytes -= size
+            try:
+                os.remove(AVATARS_PATH / file_name)
+            except OSError:
+                pass
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            cls._load()
+            return {'entries': len(cls._entries), 'bytes': cls._total_bytes, 'max_bytes': AVATAR_CACHE_MAX_BYTES}
@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from typing import Dict, List
 
 from pydantic import ValidationError
-from sqlalchemy import select
+from sqlalchemy import func, select
 
 from data_source.api.base_data_source import BaseDataSource
 from data_source.api.dynamic_loader import DynamicLoader, ClassInfo
@@ -109,6 +109,9 @@ class DataSourceContext:
 
         with Session() as session:
             data_sources: List[DataSource] = session.query(DataSource).all()
+            document_counts = dict(session.execute(
+                select(Document.data_source_id, func.count(Document.id)).group_by(Document.data_source_id)
+            ).all())
             for data_source in data_sources:
                 logger.info(f"Loading data source {data_source.id} ({data_source.type.name})")
                 data_source_cls = DynamicLoader.get_data_source_class(data_source.type.name)
@@ -120,7 +123,7 @@ class DataSourceContext:
                     logger.error(f"Error loading data source {data_source.id}: {e}")
                     return
 
-                cached_data_source = CachedDataSource(indexed_docs=len(data_source.documents),
+                cached_data_source = CachedDataSource(indexed_docs=document_counts.get(data_source.id, 0),
                                                       failed_tasks=0,
                                                       instance=data_source_instance)
                 cls._data_source_cache[data_source.id] = cached_data_source
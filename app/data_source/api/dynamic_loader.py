@@ -1,11 +1,16 @@
 import ast
+import json
+import logging
 import os
 import re
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, List, Optional
 import importlib
 
 from data_source.api.utils import snake_case_to_pascal_case
+from paths import CONNECTORS_MANIFEST_PATH
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -18,8 +23,14 @@ class DynamicLoader:
     """
     This class is used to dynamically load classes from files.
     Specifically, it is used to load data sources from the data_source/sources directory.
+    The classes found in each file are persisted to a manifest, so a file is only parsed again when it changes.
     """
     SOURCES_PATH = os.path.join('data_source', 'sources')
+    MANIFEST_VERSION = 1
+
+    # file path => {class name: base class names}
+    _class_bases: Optional[Dict[str, Dict[str, List[str]]]] = None
+    _loaded_classes: Dict[str, type] = {}
 
     @staticmethod
     def extract_classes(file_path: str):
@@ -31,6 +42,65 @@ class DynamicLoader:
                     classes[node.name] = {'node': node, 'file': file_path}
         return classes
 
+    @staticmethod
+    def extract_class_bases(file_path: str) -> Dict[str, List[str]]:
+        classes = DynamicLoader.extract_classes(file_path)
+        return {name: [base.id for base in info['node'].bases if isinstance(base, ast.Name)]
+                for name, info in classes.items()}
+
+    @staticmethod
+    def _load_manifest() -> Dict[str, dict]:
+        try:
+            with open(CONNECTORS_MANIFEST_PATH, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if manifest.get('version') != DynamicLoader.MANIFEST_VERSION:
+            return {}
+        return manifest.get('files', {})
+
+    @staticmethod
+    def _save_manifest(files: Dict[str, dict]):
+        try:
+            tmp_path = f'{CONNECTORS_MANIFEST_PATH}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': DynamicLoader.MANIFEST_VERSION, 'files': files}, f)
+            os.replace(tmp_path, CONNECTORS_MANIFEST_PATH)
+        except OSError as e:
+            logger.warning(f"Failed to save the connectors manifest: {e}")
+
+    @staticmethod
+    def get_class_bases() -> Dict[str, Dict[str, List[str]]]:
+        """
+        Returns {file path: {class name: base class names}} for every file under SOURCES_PATH.
+        """
+        if DynamicLoader._class_bases is not None:
+            return DynamicLoader._class_bases
+
+        manifest = DynamicLoader._load_manifest()
+        files = {}
+        changed = False
+        for root, dirs, file_names in os.walk(DynamicLoader.SOURCES_PATH):
+            for file in file_names:
+                if not file.endswith('.py'):
+                    continue
+
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                entry = manifest.get(file_path)
+                if entry is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                    entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                             'classes': DynamicLoader.extract_class_bases(file_path)}
+                    changed = True
+                files[file_path] = entry
+
+        if changed or files.keys() != manifest.keys():
+            DynamicLoader._save_manifest(files)
+
+        DynamicLoader._class_bases = {file_path: entry['classes'] for file_path, entry in files.items()}
+        return DynamicLoader._class_bases
+
     @staticmethod
     def get_data_source_class(data_source_name: str):
         class_name = f"{snake_case_to_pascal_case(data_source_name)}DataSource"
@@ -39,48 +109,45 @@ class DynamicLoader:
 
     @staticmethod
     def get_class(file_path: str, class_name: str):
+        cache_key = f'{file_path}:{class_name}'
+        if cache_key in DynamicLoader._loaded_classes:
+            return DynamicLoader._loaded_classes[cache_key]
+
         loader = importlib.machinery.SourceFileLoader(class_name, file_path)
         module = loader.load_module()
         try:
-            return getattr(module, class_name)
+            loaded_class = getattr(module, class_name)
         except AttributeError:
             raise AttributeError(f"Class {class_name} not found in module {module},"
                                  f"make sure you named the class correctly (it should be <Platform>DataSource)")
 
+        DynamicLoader._loaded_classes[cache_key] = loaded_class
+        return loaded_class
+
     @staticmethod
     def find_class_file(directory, class_name):
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.py'):
-                    file_path = os.path.join(root, file)
-                    classes = DynamicLoader.extract_classes(file_path)
-                    if class_name in classes:
-                        return file_path
+        for file_path, classes in DynamicLoader.get_class_bases().items():
+            if file_path.startswith(directory) and class_name in classes:
+                return file_path
         return None
 
     @staticmethod
     def find_data_sources() -> Dict[str, ClassInfo]:
         all_classes = {}
-        # First, extract all classes and their file paths
-        for root, dirs, files in os.walk(DynamicLoader.SOURCES_PATH):
-            for file in files:
-                if file.endswith('.py'):
-                    file_path = os.path.join(root, file)
-                    all_classes.update(DynamicLoader.extract_classes(file_path))
+        # First, collect all classes and their file paths
+        for file_path, classes in DynamicLoader.get_class_bases().items():
+            for class_name, bases in classes.items():
+                all_classes[class_name] = {'bases': bases, 'file': file_path}
 
         def is_base_data_source(class_name: str):
             if class_name not in all_classes:
                 return False
 
-            class_info = all_classes[class_name]
-            node = class_info['node']
-
-            for base in node.bases:
-                if isinstance(base, ast.Name):
-                    if base.id == 'BaseDataSource':
-                        return True
-                    elif is_base_data_source(base.id):
-                        return True
+            for base in all_classes[class_name]['bases']:
+                if base == 'BaseDataSource':
+                    return True
+                elif is_base_data_source(base):
+                    return True
 
             return False
 
@@ -1,11 +1,6 @@
-import base64
 import logging
 import concurrent.futures
-from functools import lru_cache
-from io import BytesIO
-from typing import Optional
 from datetime import datetime, timezone
-import requests
 
 logger = logging.getLogger(__name__)
 
@@ -43,19 +38,5 @@ def parse_with_workers(method_name: callable, items: list, **kwargs):
                 logging.exception("Worker failed", exc_info=e)
 
 
-@lru_cache(maxsize=512)
-def get_confluence_user_image(image_url: str, token: str) -> Optional[str]:
-    try:
-        if "anonymous.svg" in image_url:
-            image_url = image_url.replace(".svg", ".png")
-
-        response = requests.get(url=image_url, timeout=1, headers={'Accept': 'application/json',
-                                                                   "Authorization": f"Bearer {token}"})
-        image_bytes = BytesIO(response.content)
-        return f"data:image/jpeg;base64,{base64.b64encode(image_bytes.getvalue()).decode()}"
-    except:
-        logger.warning(f"Failed to get confluence user image {image_url}")
-
-
 def get_utc_time_now() -> datetime:
     return datetime.now(tz=timezone.utc)
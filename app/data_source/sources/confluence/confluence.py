@@ -7,6 +7,7 @@ from atlassian import Confluence
 from atlassian.errors import ApiError
 from requests import HTTPError
 
+from data_source.api.avatar_cache import AvatarCache
 from data_source.api.base_data_source import BaseDataSource, ConfigField, HTMLInputType, Location, BaseDataSourceConfig
 from data_source.api.basic_document import BasicDocument, DocumentType
 from data_source.api.exception import InvalidDataSourceConfig
@@ -123,6 +124,13 @@ class ConfluenceDataSource(BaseDataSource):
 
             start += limit
 
+    def _cache_author_image(self, author_image_url: str):
+        # the images require authentication, so they are served from the avatar cache
+        download_url = author_image_url
+        if "anonymous.svg" in author_image_url:
+            download_url = author_image_url.replace(".svg", ".png")
+        AvatarCache.fetch(author_image_url, session=self._confluence.session, download_url=download_url)
+
     def _feed_doc(self, raw_doc: Dict):
         last_modified = dateutil.parser.parse(raw_doc['lastModified'])
         doc_id = raw_doc['content']['id']
@@ -140,6 +148,7 @@ class ConfluenceDataSource(BaseDataSource):
         author = fetched_raw_page['history']['createdBy']['displayName']
         author_image = fetched_raw_page['history']['createdBy']['profilePicture']['path']
         author_image_url = fetched_raw_page['_links']['base'] + author_image
+        self._cache_author_image(author_image_url)
         html_content = fetched_raw_page['body']['storage']['value']
         plain_text = html_to_text(html_content)
 
@@ -2,6 +2,7 @@ from schemas import DataSourceType
 from schemas import DataSource
 from schemas import Document
 from schemas import Paragraph
+from schemas import SlowQuery
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -1,14 +1,52 @@
+import json
+import logging
 import os
 import pickle
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
 
 import nltk
 import numpy as np
-from rank_bm25 import BM25Okapi
+from sqlalchemy.orm import selectinload
 
 from db_engine import Session
-from paths import BM25_INDEX_PATH
-from schemas import Paragraph
+from indexing import bm25_scoring
+from indexing.bm25_scoring import EMPTY_STATS, Bm25Stats
+from indexing.bm25_segment import Bm25Segment
+from paths import BM25_INDEX_DIR, BM25_INDEX_PATH
+from schemas import DataSource, Document, Paragraph
+
+logger = logging.getLogger(__name__)
+
+# a background merge starts once there are more segments than this
+MAX_SEGMENTS = int(os.environ.get('BM25_MAX_SEGMENTS', 8))
+# segments with a larger fraction of removed paragraphs are rewritten without them
+MAX_DEAD_RATIO = float(os.environ.get('BM25_MAX_DEAD_RATIO', 0.3))
+REBUILD_BATCH_SIZE = 5000
+# score only the blocks of paragraphs that may make it into the top k (see bm25_scoring.pruned_top_k)
+PRUNED_SEARCH = os.environ.get('BM25_PRUNED_SEARCH', 'true').lower() in ('true', '1', 'yes')
+
+_punkt_available = None
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    nltk.word_tokenize, using the punkt models bundled in the image (see Dockerfile) - they are never fetched at runtime.
+    Without them, the text is tokenized without splitting it to sentences first.
+    """
+    global _punkt_available
+    if _punkt_available is None:
+        try:
+            nltk.word_tokenize('Punkt. Check.')
+            _punkt_available = True
+        except LookupError:
+            logger.warning('nltk punkt models are not installed, tokenizing without sentence splitting '
+                           '(run "python -m nltk.downloader punkt punkt_tab" to install them)')
+            _punkt_available = False
+    return nltk.word_tokenize(text, preserve_line=not _punkt_available)
 
 
 def _add_metadata_for_indexing(paragraph: Paragraph) -> str:
@@ -22,19 +60,37 @@ def _add_metadata_for_indexing(paragraph: Paragraph) -> str:
     return result
 
 
+@dataclass(frozen=True)
+class _IndexView:
+    """
+    The segments, the statistics and the vocabulary that go with them, swapped together so readers
+    always see a consistent state. The vocabulary only grows until the index is cleared.
+    """
+    segments: Tuple[Bm25Segment, ...]
+    stats: Bm25Stats
+    vocabulary: Dict[str, int]
+
+
 class Bm25Index:
+    """
+    A BM25 index made of immutable segments: every indexed batch of paragraphs becomes a small new segment,
+    removed paragraphs are marked dead in theirs, and a background merge compacts the segments.
+    The corpus statistics are updated along with the segments, so the scores are exactly those of BM25Okapi
+    over the live paragraphs, without ever re-tokenizing the corpus.
+    Segments are directories of memory-mapped arrays next to an append-only vocabulary, switched to through
+    manifest.json like the paragraph store, so opening the index reads little more than the vocabulary.
+    The Indexer keeps it in sync with the database.
+    """
     instance = None
 
+    _merge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bm25-merge')
+
     @staticmethod
     def create():
         if Bm25Index.instance is not None:
             raise RuntimeError("Index is already initialized")
 
-        if os.path.exists(BM25_INDEX_PATH):
-            with open(BM25_INDEX_PATH, 'rb') as f:
-                Bm25Index.instance = pickle.load(f)
-        else:
-            Bm25Index.instance = Bm25Index()
+        Bm25Index.instance = Bm25Index()
 
     @staticmethod
     def get() -> 'Bm25Index':
@@ -43,46 +99,305 @@ class Bm25Index:
         return Bm25Index.instance
 
     def __init__(self) -> None:
-        self.index = None
-        self.id_map = []
-
-    def _update(self, session):
-        all_paragraphs = session.query(Paragraph).all()
-        if len(all_paragraphs) == 0:
-            self.index = None
-            self.id_map = []
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._view = _IndexView((), EMPTY_STATS, {})
+        self._merging = False
+        BM25_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+        manifest_path = BM25_INDEX_DIR / 'manifest.json'
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                self._manifest = json.load(f)
+            self._open()
+        elif os.path.exists(BM25_INDEX_PATH):
+            self._migrate_pickle()
+        else:
+            # first start with segments, index what is already in the database
+            self.rebuild()
+
+    def __len__(self) -> int:
+        return self._view.stats.count
+
+    def add(self, paragraphs: List[Paragraph]):
+        """
+        Indexes committed paragraphs as a new segment, re-added paragraphs replace their old version.
+        """
+        if len(paragraphs) == 0:
             return
 
-        corpus = [nltk.word_tokenize(_add_metadata_for_indexing(paragraph)) for paragraph in all_paragraphs]
-        id_map = [paragraph.id for paragraph in all_paragraphs]
-        self.index = BM25Okapi(corpus)
-        self.id_map = id_map
+        paragraphs = list({paragraph.id: paragraph for paragraph in paragraphs}.values())
+        tokenized = [tokenize(_add_metadata_for_indexing(paragraph)) for paragraph in paragraphs]
+        ids = np.array([paragraph.id for paragraph in paragraphs], dtype=np.int64)
+        with self._lock:
+            segment = self._saved(Bm25Segment.build_from_tokens(self._new_segment_name(), ids, tokenized,
+                                                                self._view.vocabulary))
+            segments, changed, stats = self._without(self._view, ids)
+            self._commit(segments + [segment], self._with(stats, segment), changed)
+        self._schedule_merge()
 
-    def update(self, session=None):
-        if session is None:
-            with Session() as session:
-                self._update(session)
-        else:
-            self._update(session)
+    def remove(self, paragraph_ids: List[int]):
+        if len(paragraph_ids) == 0:
+            return
+
+        with self._lock:
+            segments, changed, stats = self._without(self._view, np.asarray(paragraph_ids, dtype=np.int64))
+            if not changed:
+                return
+            self._commit(segments, stats, changed)
+        self._schedule_merge()
+
+    def clear(self):
+        with self._lock:
+            self._commit([], EMPTY_STATS, vocabulary={})
+
+    def rebuild(self):
+        """
+        Rebuilds the index from the database.
+        """
+        logger.info('Building the BM25 index from the database...')
+        self.clear()
+        with Session() as session:
+            query = session.query(Paragraph).order_by(Paragraph.id).options(
+                selectinload(Paragraph.document).selectinload(Document.data_source).selectinload(DataSource.type))
+            offset = 0
+            while paragraphs := query.offset(offset).limit(REBUILD_BATCH_SIZE).all():
+                self.add(paragraphs)
+                offset += len(paragraphs)
+
+    def search(self, query: str, top_k: int, allowed_ids: Optional[np.ndarray] = None) -> List[int]:
+        """
+        allowed_ids, if given, restricts the search to those ids - only their documents are scored.
+        """
+        return [id for id, _ in self.search_with_scores(query, top_k, allowed_ids)]
+
+    def search_with_scores(self, query: str, top_k: int,
+                           allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        The top_k (id, BM25 score) pairs, best first.
+        """
+        view = self._view
+        term_ids = [view.vocabulary.get(term) for term in tokenize(query)]
+        search = bm25_scoring.pruned_top_k if PRUNED_SEARCH else bm25_scoring.top_k
+        return search(view.segments, view.stats, term_ids, top_k, allowed_ids)
 
-        self._save()
+    def match_ids(self, query: str) -> np.ndarray:
+        """
+        The ids of all paragraphs matching any of the query terms.
+        """
+        view = self._view
+        term_ids = [term_id for term_id in map(view.vocabulary.get, set(tokenize(query))) if term_id is not None]
+        ids = []
+        for segment in view.segments:
+            matches = np.zeros(len(segment), dtype=bool)
+            for term_id in term_ids:
+                matches[segment.postings(term_id)[0]] = True
+            ids.append(segment.ids[matches & segment.live])
+        return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
 
-    def search(self, query: str, top_k: int) -> List[int]:
-        if self.index is None:
+    @staticmethod
+    def _saved(segment: Bm25Segment) -> Bm25Segment:
+        """
+        Saves a segment built in memory and maps it back, so its arrays only take page cache.
+        """
+        segment.save(BM25_INDEX_DIR / segment.name)
+        return Bm25Segment.load(segment.name, BM25_INDEX_DIR / segment.name)
+
+    def _new_segment_name(self) -> str:
+        name = f"segment.{self._manifest['next_segment']}"
+        self._manifest['next_segment'] += 1
+        return name
+
+    @staticmethod
+    def _with(stats: Bm25Stats, segment: Bm25Segment) -> Bm25Stats:
+        """
+        The statistics with the live paragraphs of the segment added.
+        """
+        vocabulary_size = max(len(stats.document_frequencies), int(segment.term_ids.max(initial=-1)) + 1)
+        document_frequencies = np.zeros(vocabulary_size, dtype=np.int64)
+        document_frequencies[:len(stats.document_frequencies)] = stats.document_frequencies
+        term_ids, counts = segment.document_frequencies()
+        document_frequencies[term_ids] += counts
+        total_length = stats.total_length + int(segment.lengths[segment.live].sum())
+        return Bm25Stats.of(stats.count + segment.live_count, total_length, document_frequencies)
+
+    @staticmethod
+    def _without(view: _IndexView, ids: np.ndarray) -> Tuple[List[Bm25Segment], Set[str], Bm25Stats]:
+        """
+        Marks the live paragraphs with the ids dead, returns the segments (without the ones left empty),
+        the names of the ones that changed and the updated statistics.
+        """
+        stats = view.stats
+        document_frequencies = None
+        count, total_length = stats.count, stats.total_length
+        segments, changed = [], set()
+        for segment in view.segments:
+            positions = segment.live_positions_of(ids)
+            if len(positions):
+                if document_frequencies is None:
+                    document_frequencies = stats.document_frequencies.copy()
+                count -= len(positions)
+                total_length -= int(segment.lengths[positions].sum())
+                term_ids, before = segment.document_frequencies()
+                segment = segment.without(positions)
+                document_frequencies[term_ids] -= before - segment.document_frequencies()[1]
+                changed.add(segment.name)
+            if segment.live_count > 0:
+                segments.append(segment)
+        if document_frequencies is not None:
+            stats = Bm25Stats.of(count, total_length, document_frequencies)
+        return segments, changed, stats
+
+    def _schedule_merge(self):
+        with self._lock:
+            if self._merging or not self._merge_candidates(self._view.segments):
+                return
+            self._merging = True
+        self._merge_executor.submit(self._merge)
+
+    @staticmethod
+    def _merge_candidates(segments: Tuple[Bm25Segment, ...]) -> List[Bm25Segment]:
+        """
+        The segments to merge next: one with too many dead paragraphs, or the smallest ones once there are too many.
+        """
+        for segment in segments:
+            if len(segment) - segment.live_count > len(segment) * MAX_DEAD_RATIO:
+                return [segment]
+        if len(segments) <= MAX_SEGMENTS:
             return []
-        tokenized_query = nltk.word_tokenize(query)
-        bm25_scores = self.index.get_scores(tokenized_query)
-        top_k = min(top_k, len(bm25_scores))
-        top_n = np.argpartition(bm25_scores, -top_k)[-top_k:]
-        bm25_hits = [{'id': self.id_map[idx], 'score': bm25_scores[idx]} for idx in top_n]
-        bm25_hits = sorted(bm25_hits, key=lambda x: x['score'], reverse=True)
-        return [hit['id'] for hit in bm25_hits]
+        smallest = {segment.name for segment in sorted(segments, key=len)[:len(segments) - MAX_SEGMENTS // 2 + 1]}
+        return [segment for segment in segments if segment.name in smallest]
 
-    def clear(self):
-        self.index = None
-        self.id_map = []
-        self._save()
+    def _merge(self):
+        try:
+            while sources := self._merge_candidates(self._view.segments):
+                with self._lock:
+                    name = self._new_segment_name()
+                merged = self._saved(Bm25Segment.merge(name, sources))
+
+                with self._lock:
+                    view = self._view
+                    current = {segment.name: segment for segment in view.segments}
+                    if any(source.name not in current for source in sources):
+                        # cleared (or emptied) meanwhile
+                        Bm25Segment.delete(BM25_INDEX_DIR / merged.name)
+                        continue
+                    # paragraphs removed while merging
+                    removed = [source.ids[source.live & ~current[source.name].live] for source in sources]
+                    merged = merged.without(merged.live_positions_of(np.concatenate(removed)))
+                    segments = [merged if segment.name == sources[0].name else segment for segment in view.segments
+                                if segment.name not in {source.name for source in sources[1:]}]
+                    self._commit(segments, view.stats, {merged.name} if merged.live_count < len(merged) else set())
+                logger.info(f'Merged {len(sources)} BM25 segments into {merged.name} '
+                            f'({merged.live_count} paragraphs, {len(segments)} segments)')
+        except Exception:
+            logger.exception('Failed to merge BM25 segments')
+            with self._lock:
+                self._merging = False
+            return
+
+        with self._lock:
+            self._merging = False
+        # segments added after the last check above are merged by a new run
+        self._schedule_merge()
+
+    def _commit(self, segments: List[Bm25Segment], stats: Bm25Stats, changed: Set[str] = frozenset(),
+                vocabulary: Optional[Dict[str, int]] = None):
+        """
+        Writes the dead paragraphs of the changed segments and the new vocabulary terms,
+        then switches to the segments through a new manifest and deletes the files nothing refers to anymore.
+        A new vocabulary replaces the current one (which otherwise only gets new terms).
+        """
+        previous = self._manifest or {'version': -1, 'segments': [], 'next_segment': 0,
+                                      'vocabulary_size': 0, 'vocabulary_bytes': 0}
+        version = previous['version'] + 1
+        previous_entries = {entry['name']: entry for entry in previous['segments']}
+        entries = []
+        stale = []
+        for segment in segments:
+            entry = dict(previous_entries.get(segment.name, {'name': segment.name, 'dead': None}))
+            if segment.name in changed:
+                if entry['dead'] is not None:
+                    stale.append(entry['dead'])
+                entry['dead'] = f'{segment.name}.dead.{version}.npz'
+                segment.save_dead(BM25_INDEX_DIR / entry['dead'])
+            entries.append(entry)
+        names = {segment.name for segment in segments}
+        stale_segments = []
+        for entry in previous['segments']:
+            if entry['name'] not in names:
+                stale_segments.append(entry['name'])
+                if entry['dead'] is not None:
+                    stale.append(entry['dead'])
+
+        if vocabulary is None:
+            vocabulary = self._view.vocabulary
+            vocabulary_size, vocabulary_bytes = previous['vocabulary_size'], previous['vocabulary_bytes']
+        else:
+            vocabulary_size, vocabulary_bytes = 0, 0
+        with open(BM25_INDEX_DIR / 'vocabulary.txt', 'ab') as f:
+            f.seek(vocabulary_bytes)
+            f.truncate()
+            new_terms = list(islice(vocabulary, vocabulary_size, None))
+            if new_terms:
+                data = ('\n'.join(new_terms) + '\n').encode('utf-8')
+                f.write(data)
+                vocabulary_bytes += len(data)
+
+        manifest = {'version': version, 'segments': entries, 'next_segment': previous['next_segment'],
+                    'vocabulary_size': len(vocabulary), 'vocabulary_bytes': vocabulary_bytes}
+        tmp_path = BM25_INDEX_DIR / 'manifest.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, BM25_INDEX_DIR / 'manifest.json')
 
-    def _save(self):
-        with open(BM25_INDEX_PATH, 'wb') as f:
-            pickle.dump(self, f)
+        self._manifest = manifest
+        self._view = _IndexView(tuple(segments), stats, vocabulary)
+        for name in stale_segments:
+            Bm25Segment.delete(BM25_INDEX_DIR / name)
+        for file_name in stale:
+            try:
+                os.remove(BM25_INDEX_DIR / file_name)
+            except OSError:
+                pass
+
+    def _open(self):
+        manifest = self._manifest
+        with open(BM25_INDEX_DIR / 'vocabulary.txt', 'rb') as f:
+            terms = f.read(manifest['vocabulary_bytes']).decode('utf-8').split('\n')[:manifest['vocabulary_size']]
+        vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+
+        stats = EMPTY_STATS
+        segments = []
+        for entry in manifest['segments']:
+            dead_path = BM25_INDEX_DIR / entry['dead'] if entry['dead'] is not None else None
+            segment = Bm25Segment.load(entry['name'], BM25_INDEX_DIR / entry['name'], dead_path)
+            stats = self._with(stats, segment)
+            segments.append(segment)
+        self._view = _IndexView(tuple(segments), stats, vocabulary)
+        logger.info(f'Opened the BM25 index with {stats.count} paragraphs in {len(segments)} segments')
+        self._schedule_merge()
+
+    def _migrate_pickle(self):
+        """
+        Converts the pickled BM25Okapi index the previous versions saved, without re-tokenizing the corpus.
+        """
+        logger.info(f'Converting the BM25 index at {BM25_INDEX_PATH} to segments...')
+        try:
+            with open(BM25_INDEX_PATH, 'rb') as f:
+                legacy = pickle.load(f)
+        except Exception:
+            logger.exception('Failed to read the old BM25 index, rebuilding it from the database')
+            self.rebuild()
+        else:
+            self.clear()
+            if getattr(legacy, 'index', None) is not None:
+                with self._lock:
+                    vocabulary = self._view.vocabulary
+                    term_frequencies = [{vocabulary.setdefault(term, len(vocabulary)): frequency
+                                         for term, frequency in frequencies.items()}
+                                        for frequencies in legacy.index.doc_freqs]
+                    segment = self._saved(Bm25Segment.build(self._new_segment_name(), legacy.id_map,
+                                                            legacy.index.doc_len, term_frequencies))
+                    self._commit([segment], self._with(EMPTY_STATS, segment))
+        os.remove(BM25_INDEX_PATH)
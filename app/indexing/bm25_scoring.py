@@ -0,0 +1,338 @@
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from indexing.bm25_segment import Bm25Segment
+
+# the defaults of rank_bm25's BM25Okapi, which the index used to be, so the scores stay the same
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+# past this many postings per paragraph of a segment, the scores are summed into a dense array instead of
+# sorting the postings
+DENSE_POSTINGS_RATIO = 0.125
+# paragraphs (by position) per block of the block-max bounds
+BLOCK_SIZE = 64
+# the blocks pruned_top_k scores at first, doubled every round
+FIRST_ROUND_BLOCKS = 8
+# once this fraction of the blocks is scored without reaching the k best, the bounds hardly prune and the
+# query is handed to top_k
+EXHAUSTIVE_BLOCKS_RATIO = 0.1
+# the block bounds are computed for the average length rounded up to a power of this
+BOUND_LENGTH_STEP = 1.01
+# and raised by this, they are rounded differently than the scores
+BOUND_TOLERANCE = 1e-9
+
+
+@dataclass(frozen=True)
+class Bm25Stats:
+    """
+    The corpus statistics of the live paragraphs, which every score depends on.
+    """
+    count: int
+    total_length: int
+    # by term id
+    document_frequencies: np.ndarray
+    average_idf: float
+
+    @staticmethod
+    def of(count: int, total_length: int, document_frequencies: np.ndarray) -> 'Bm25Stats':
+        # like BM25Okapi, averaged over the terms of the corpus before the negative ones are floored
+        present = document_frequencies[document_frequencies > 0]
+        average_idf = float(np.mean(np.log(count - present + 0.5) - np.log(present + 0.5))) if len(present) else 0.0
+        return Bm25Stats(count=count, total_length=total_length, document_frequencies=document_frequencies,
+                         average_idf=average_idf)
+
+    def idf(self, term_id: Optional[int]) -> float:
+        if term_id is None or term_id >= len(self.document_frequencies):
+            return 0.0
+        frequency = int(self.document_frequencies[term_id])
+        if frequency == 0:
+            return 0.0
+        idf = math.log(self.count - frequency + 0.5) - math.log(frequency + 0.5)
+        return EPSILON * self.average_idf if idf < 0 else idf
+
+
+EMPTY_STATS = Bm25Stats.of(0, 0, np.zeros(0, dtype=np.int64))
+
+
+def _length_norms(segment: Bm25Segment, average_length: float) -> np.ndarray:
+    """
+    The length normalization of every paragraph of the segment, kept until the average length changes.
+    Dead paragraphs don't change it, so the segments marking them share it with the segment they replace.
+    """
+    length_norms = segment.length_norms.get(average_length)
+    if length_norms is None:
+        length_norms = K1 * (1 - B + B * segment.lengths / average_length)
+        segment.length_norms.clear()
+        segment.length_norms[average_length] = length_norms
+    return length_norms
+
+
+def _query(stats: Bm25Stats, term_ids: Sequence[Optional[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The ids and idfs of the query terms that change the scores, in query order.
+    """
+    query = [(term_id, stats.idf(term_id)) for term_id in term_ids if term_id is not None]
+    query = [(term_id, idf) for term_id, idf in query if idf != 0]
+    return np.array([term_id for term_id, _ in query], dtype=np.int64), np.array([idf for _, idf in query])
+
+
+def _rows(segment: Bm25Segment, term_ids: np.ndarray, idfs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The rows of the terms the segment has, with their idfs.
+    """
+    rows = np.searchsorted(segment.term_ids, term_ids)
+    found = rows < len(segment.term_ids)
+    found[found] = segment.term_ids[rows[found]] == term_ids[found]
+    return rows[found], idfs[found]
+
+
+def score_segment(segment: Bm25Segment, term_ids: np.ndarray, idfs: np.ndarray,
+                  average_length: float) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    The BM25 scores of the paragraphs of the segment (dead ones included): the query vector of idfs times
+    the rows of the terms in the term-paragraph matrix, summed in query order like BM25Okapi does.
+    A term repeated in term_ids counts again.
+    Returns the positions of the paragraphs containing any of the terms and their scores, or, when most of
+    the segment matches, None and the scores of all of its paragraphs (0 for the ones without the terms).
+    """
+    rows, idfs = _rows(segment, term_ids, idfs)
+    starts, ends = segment.indptr[rows], segment.indptr[rows + 1]
+    total = int((ends - starts).sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    postings = [segment.row_postings(row) for row in rows]
+    if total > len(segment) * DENSE_POSTINGS_RATIO:
+        length_norms = _length_norms(segment, average_length)
+        scores = np.zeros(len(segment))
+        for (positions, frequencies), idf in zip(postings, idfs):
+            scores[positions] += idf * (frequencies * (K1 + 1) / (frequencies + length_norms[positions]))
+        return None, scores
+
+    # only sort the postings of the query terms
+    positions = np.concatenate([positions for positions, _ in postings])
+    row_weights = np.concatenate([idf * (frequencies * (K1 + 1) / (
+        frequencies + K1 * (1 - B + B * segment.lengths[positions] / average_length)))
+        for (positions, frequencies), idf in zip(postings, idfs)])
+    matched, inverse = np.unique(positions, return_inverse=True)
+    return matched, np.bincount(inverse, row_weights, minlength=len(matched))
+
+
+def _partition(positions: Optional[np.ndarray], scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The positions (by default, the indices of the scores) and the scores of the k best.
+    """
+    if len(scores) <= k:
+        return (np.arange(len(scores)) if positions is None else positions), scores
+    top = np.argpartition(scores, -k)[-k:]
+    return (top if positions is None else positions[top]), scores[top]
+
+
+def top_k(segments: Sequence[Bm25Segment], stats: Bm25Stats, term_ids: Sequence[Optional[int]], k: int,
+          allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    The k best (id, score) pairs of the live paragraphs (with the allowed ids), best first.
+    Every segment only hands its own k best to the final partition. As in BM25Okapi, the paragraphs
+    without any of the terms score 0, segments scored sparsely only add them when there are not enough matches.
+    """
+    if stats.count == 0 or stats.total_length == 0 or k <= 0:
+        return []
+
+    query_term_ids, idfs = _query(stats, term_ids)
+    average_length = stats.total_length / stats.count
+    ids, scores, sparse = [], [], []
+    for segment in segments:
+        allowed = _allowed(segment, allowed_ids)
+        positions, segment_scores = score_segment(segment, query_term_ids, idfs, average_length)
+        if positions is None:
+            if allowed is not None:
+                segment_scores[~allowed] = -np.inf
+            positions, segment_scores = _partition(None, segment_scores, k)
+            if allowed is not None:
+                keep = segment_scores > -np.inf
+                positions, segment_scores = positions[keep], segment_scores[keep]
+        else:
+            sparse.append((segment, allowed, positions))
+            if allowed is not None:
+                keep = allowed[positions]
+                positions, segment_scores = positions[keep], segment_scores[keep]
+            positions, segment_scores = _partition(positions, segment_scores, k)
+        ids.append(segment.ids[positions])
+        scores.append(segment_scores)
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    scores = np.concatenate(scores) if scores else np.empty(0)
+
+    fill = _unmatched_ids(sparse, k - int((scores >= 0).sum()))
+    return _ranked(np.concatenate([ids, fill]), np.concatenate([scores, np.zeros(len(fill))]), k)
+
+
+def _allowed(segment: Bm25Segment, allowed_ids: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    The mask of the paragraphs of the segment that may be returned, None for all of them.
+    """
+    if allowed_ids is not None:
+        return segment.live & np.isin(segment.ids, allowed_ids)
+    return segment.live if segment.live_count < len(segment) else None
+
+
+def _unmatched_ids(scored: List[Tuple[Bm25Segment, Optional[np.ndarray], np.ndarray]], missing: int) -> np.ndarray:
+    """
+    Up to missing ids of allowed paragraphs (which score 0) outside the matched positions of the segments.
+    """
+    ids = []
+    for segment, allowed, matched in scored:
+        if missing <= 0:
+            break
+        unmatched = np.ones(len(segment), dtype=bool) if allowed is None else allowed.copy()
+        unmatched[matched] = False
+        ids.append(segment.ids[np.flatnonzero(unmatched)[:missing]])
+        missing -= len(ids[-1])
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+
+def _ranked(ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    k = min(k, len(scores))
+    if k == 0:
+        return []
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+def _block_maxima(segment: Bm25Segment, row: int, average_length: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The blocks the term occurs in and its highest score (without the idf) in each, kept until the rounded up
+    average length changes: scores only grow with the average length, so they stay upper bounds until then.
+    """
+    bound_length = BOUND_LENGTH_STEP ** math.ceil(math.log(average_length, BOUND_LENGTH_STEP))
+    block_maxima = segment.block_maxima.get(bound_length)
+    if block_maxima is None:
+        block_maxima = {}
+        segment.block_maxima.clear()
+        segment.block_maxima[bound_length] = block_maxima
+    maxima = block_maxima.get(row)
+    if maxima is None:
+        positions, frequencies = segment.row_postings(row)
+        scores = frequencies * (K1 + 1) / (
+            frequencies + K1 * (1 - B + B * segment.lengths[positions] / bound_length))
+        # the positions are sorted, the postings of a block are consecutive
+        blocks = positions // BLOCK_SIZE
+        starts = np.flatnonzero(np.diff(blocks, prepend=-1))
+        maxima = block_maxima[row] = blocks[starts], np.maximum.reduceat(scores, starts) * (1 + BOUND_TOLERANCE)
+    return maxima
+
+
+def _block_bounds(segment: Bm25Segment, rows: np.ndarray, idfs: np.ndarray, average_length: float) -> np.ndarray:
+    """
+    An upper bound of the score of the paragraphs of every block of the segment: the sum of the terms' highest
+    scores in the block.
+    """
+    bounds = np.zeros(-(-len(segment) // BLOCK_SIZE))
+    for row, idf in zip(rows, idfs):
+        blocks, maxima = _block_maxima(segment, row, average_length)
+        bounds[blocks] += idf * maxima
+    return bounds
+
+
+def _score_blocks(segment: Bm25Segment, rows: np.ndarray, idfs: np.ndarray, average_length: float,
+                  blocks: np.ndarray, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The positions and scores of the allowed paragraphs containing any of the terms in the blocks (sorted).
+    """
+    offsets, weights = [], []
+    for row, idf in zip(rows, idfs):
+        row_positions, row_frequencies = segment.row_postings(row)
+        # the postings of the term are sorted by position, those of a block are consecutive
+        # (searching with the positions' type, it would convert them all otherwise)
+        block_starts = (blocks * BLOCK_SIZE).astype(row_positions.dtype)
+        starts = np.searchsorted(row_positions, block_starts)
+        counts = np.searchsorted(row_positions, block_starts + BLOCK_SIZE) - starts
+        postings = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        positions, frequencies = row_positions[postings], row_frequencies[postings]
+        # where the paragraphs are in the blocks laid end to end
+        offsets.append(np.repeat(np.arange(len(blocks)) * BLOCK_SIZE, counts) + positions % BLOCK_SIZE)
+        weights.append(idf * (frequencies * (K1 + 1) / (
+            frequencies + K1 * (1 - B + B * segment.lengths[positions] / average_length))))
+    scores = np.bincount(np.concatenate(offsets), np.concatenate(weights), minlength=len(blocks) * BLOCK_SIZE)
+    # the idfs are positive, so are the scores of the paragraphs with any of the terms
+    matched = np.flatnonzero(scores)
+    positions = blocks[matched // BLOCK_SIZE] * BLOCK_SIZE + matched % BLOCK_SIZE
+    if allowed is not None:
+        keep = allowed[positions]
+        positions, matched = positions[keep], matched[keep]
+    return positions, scores[matched]
+
+
+def pruned_top_k(segments: Sequence[Bm25Segment], stats: Bm25Stats, term_ids: Sequence[Optional[int]], k: int,
+                 allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    top_k with block-max pruning: the blocks of all segments are scored in the order of their upper bounds,
+    in rounds, until the k-th best score is above the bounds of all the blocks left. With common terms that is
+    a few blocks instead of most of the index, so the cost follows k rather than the size of the corpus.
+    Queries the bounds can't prune (like several terms, each in many paragraphs, which few contain together)
+    are handed to top_k after some rounds.
+    The scores are those of top_k, paragraphs with the same score may come in another order.
+    """
+    if stats.count == 0 or stats.total_length == 0 or k <= 0:
+        return []
+
+    query_term_ids, idfs = _query(stats, term_ids)
+    if len(idfs) == 0 or (idfs < 0).any():
+        # every paragraph scores 0 without terms, and the bounds only hold for positive idfs
+        return top_k(segments, stats, term_ids, k, allowed_ids)
+
+    average_length = stats.total_length / stats.count
+    queries, allowed_masks, bounds, block_segments, block_numbers = [], [], [], [], []
+    for index, segment in enumerate(segments):
+        rows, row_idfs = _rows(segment, query_term_ids, idfs)
+        allowed = _allowed(segment, allowed_ids)
+        segment_bounds = _block_bounds(segment, rows, row_idfs, average_length)
+        if allowed is not None:
+            segment_bounds[~np.logical_or.reduceat(allowed, np.arange(0, len(segment), BLOCK_SIZE))] = 0
+        blocks = np.flatnonzero(segment_bounds)
+        queries.append((rows, row_idfs))
+        allowed_masks.append(allowed)
+        bounds.append(segment_bounds[blocks])
+        block_segments.append(np.full(len(blocks), index))
+        block_numbers.append(blocks)
+    bounds = np.concatenate(bounds) if bounds else np.empty(0)
+    block_segments = np.concatenate(block_segments) if block_segments else np.empty(0, dtype=np.int64)
+    block_numbers = np.concatenate(block_numbers) if block_numbers else np.empty(0, dtype=np.int64)
+    order = np.argsort(-bounds, kind='stable')
+    descending_bounds = bounds[order]
+
+    ids, scores = np.empty(0, dtype=np.int64), np.empty(0)
+    matched = [[] for _ in segments]
+    done, round_size = 0, FIRST_ROUND_BLOCKS
+    while done < len(order):
+        remaining = len(order) - done
+        if len(scores) == k:
+            # only the blocks bounded above the k-th score may still hold a better paragraph
+            remaining = int(np.searchsorted(-descending_bounds[done:], -scores.min(), side='left'))
+            if remaining == 0:
+                break
+        if done > len(order) * EXHAUSTIVE_BLOCKS_RATIO:
+            return top_k(segments, stats, term_ids, k, allowed_ids)
+        round_blocks = order[done:done + min(round_size, remaining)]
+        done += len(round_blocks)
+        round_size *= 2
+        for index in np.unique(block_segments[round_blocks]):
+            segment = segments[index]
+            blocks = np.sort(block_numbers[round_blocks[block_segments[round_blocks] == index]])
+            positions, segment_scores = _score_blocks(segment, *queries[index], average_length, blocks,
+                                                      allowed_masks[index])
+            matched[index].append(positions)
+            ids, scores = np.concatenate([ids, segment.ids[positions]]), np.concatenate([scores, segment_scores])
+        ids, scores = _partition(ids, scores, k)
+
+    if len(scores) < k:
+        # every block with any of the terms was scored, the other paragraphs score 0
+        fill = _unmatched_ids([(segment, allowed, np.concatenate(positions) if positions else np.empty(0, np.int64))
+                               for segment, allowed, positions in zip(segments, allowed_masks, matched)],
+                              k - len(scores))
+        ids, scores = np.concatenate([ids, fill]), np.concatenate([scores, np.zeros(len(fill))])
+    return _ranked(ids, scores, k)
@@ -0,0 +1,332 @@
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field, replace
+from itertools import count
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# the decoded postings of the terms queried most are kept up to this size
+DECODED_CACHE_MB = int(os.environ.get('BM25_DECODED_CACHE_MB', 256))
+# shorter posting lists are decoded every time, which is about as fast as looking them up
+DECODED_CACHE_MIN_POSTINGS = 1024
+
+# the arrays of a saved segment, each in a .npy file of its directory
+_ARRAYS = ('ids', 'lengths', 'term_ids', 'indptr', 'position_offsets', 'position_bytes', 'frequency_offsets',
+           'frequency_bytes', 'row_offsets', 'row_bytes')
+
+_cache_keys = count()
+
+
+def _encode_varints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes non-negative integers 7 bits per byte, low bits first, with the high bit set on all but the last
+    byte of each. Returns the bytes and where each value ends in them.
+    """
+    values = values.astype(np.uint64, copy=False)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for bits in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << bits)
+    ends = np.cumsum(sizes)
+    data = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    starts = ends - sizes
+    for byte in range(int(sizes.max(initial=0))):
+        has = sizes > byte
+        low_bits = ((values[has] >> np.uint64(7 * byte)) & np.uint64(0x7f)).astype(np.uint8)
+        data[starts[has] + byte] = low_bits | ((sizes[has] > byte + 1).astype(np.uint8) << np.uint8(7))
+    return data, ends
+
+
+def _decode_varints(data: np.ndarray) -> np.ndarray:
+    last = data < 0x80
+    if last.all():
+        return data.astype(np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    # how far every byte is into its value
+    shifts = (np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))) * 7
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def _delta_encode(values: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes runs of ascending values (counts gives the length of each run) as varint deltas from the previous
+    value of the run, the first value of a run as is. Returns the bytes and where each run starts in them.
+    """
+    ends = np.cumsum(counts)
+    starts = (ends - counts)[counts > 0]
+    deltas = values.astype(np.int64)
+    deltas[1:] -= values[:-1]
+    deltas[starts] = values[starts]
+    data, value_ends = _encode_varints(deltas)
+    return data, np.append(0, value_ends)[np.append(0, ends)]
+
+
+def _delta_decode(deltas: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    The values of runs encoded by _delta_encode, from their decoded deltas.
+    """
+    if len(deltas) == 0:
+        return np.empty(0, dtype=np.int32)
+    # the sums restart at the first value of every run
+    starts = np.cumsum(counts) - counts
+    sums = np.cumsum(deltas)
+    return (sums - np.repeat(sums[starts] - deltas[starts], counts)).astype(np.int32)
+
+
+class _DecodedPostings:
+    """
+    The decoded postings of the longest terms queried, the least recently used dropped past DECODED_CACHE_MB.
+    """
+    _entries: 'OrderedDict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]]' = OrderedDict()
+    _size = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, key: Tuple[int, int]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        with cls._lock:
+            postings = cls._entries.get(key)
+            if postings is not None:
+                cls._entries.move_to_end(key)
+            return postings
+
+    @classmethod
+    def put(cls, key: Tuple[int, int], postings: Tuple[np.ndarray, np.ndarray]):
+        size = sum(array.nbytes for array in postings)
+        with cls._lock:
+            if key in cls._entries or size > DECODED_CACHE_MB << 20:
+                return
+            cls._entries[key] = postings
+            cls._size += size
+            while cls._size > DECODED_CACHE_MB << 20:
+                _, evicted = cls._entries.popitem(last=False)
+                cls._size -= sum(array.nbytes for array in evicted)
+
+
+@dataclass(frozen=True, eq=False)
+class Bm25Segment:
+    """
+    An immutable inverted index over a batch of paragraphs: for every term (by its id in the index's vocabulary,
+    sorted), the positions of the paragraphs containing it and how often they do, CSR style.
+    Positions are stored as varint deltas from the previous one of the term and frequencies as varints,
+    decoded when a term is read. A saved segment is a directory of .npy files, memory-mapped when it is loaded.
+    Removed paragraphs are only marked dead in live (a new segment object, readers keep the one they got),
+    scoring skips them until a merge rewrites the segment without them. The term rows of every paragraph are
+    stored too (varint deltas, by position), so marking paragraphs dead only decodes the terms of those.
+    """
+    name: str
+    # paragraph ids and their lengths in tokens, by position
+    ids: np.ndarray
+    lengths: np.ndarray
+    # term ids (sorted) and the start of their postings
+    term_ids: np.ndarray
+    indptr: np.ndarray
+    # the encoded positions and frequencies, and where those of every term start in them
+    position_offsets: np.ndarray
+    position_bytes: np.ndarray
+    frequency_offsets: np.ndarray
+    frequency_bytes: np.ndarray
+    # the encoded term rows of the paragraphs, and where those of every paragraph start in them
+    row_offsets: np.ndarray
+    row_bytes: np.ndarray
+    live: np.ndarray
+    # how many of the dead paragraphs contain each term
+    dead_frequencies: np.ndarray
+    # identifies the postings in the decoded postings cache, segments marking paragraphs dead keep it
+    cache_key: int = field(default_factory=lambda: next(_cache_keys), repr=False)
+    # average paragraph length => the length normalization of every paragraph, see bm25_scoring
+    length_norms: Dict[float, np.ndarray] = field(default_factory=dict, repr=False)
+    # average paragraph length => term row => the blocks of the term and its highest score in each, see bm25_scoring
+    block_maxima: Dict[float, Dict[int, Tuple[np.ndarray, np.ndarray]]] = field(default_factory=dict, repr=False)
+
+    @staticmethod
+    def build(name: str, ids: Sequence[int], lengths: Sequence[int],
+              term_frequencies: Sequence[Dict[int, int]]) -> 'Bm25Segment':
+        """
+        term_frequencies holds, for every paragraph, how many times each term id occurs in it.
+        """
+        counts = np.fromiter((len(frequencies) for frequencies in term_frequencies), dtype=np.int64,
+                             count=len(term_frequencies))
+        total = int(counts.sum())
+        posting_terms = np.fromiter((term_id for paragraph in term_frequencies for term_id in paragraph.keys()),
+                                    dtype=np.int64, count=total)
+        frequencies = np.fromiter((frequency for paragraph in term_frequencies for frequency in paragraph.values()),
+                                  dtype=np.int32, count=total)
+        positions = np.repeat(np.arange(len(term_frequencies), dtype=np.int32), counts)
+        return Bm25Segment.from_postings(name, np.asarray(ids, dtype=np.int64), np.asarray(lengths, dtype=np.int32),
+                                         posting_terms, positions, frequencies)
+
+    @staticmethod
+    def build_from_tokens(name: str, ids: Sequence[int], tokenized: Sequence[List[str]],
+                          vocabulary: Dict[str, int]) -> 'Bm25Segment':
+        """
+        Builds a segment from tokenized paragraphs, adding their new terms to vocabulary (term => id, in id order).
+        """
+        term_frequencies = [{vocabulary.setdefault(term, len(vocabulary)): frequency
+                             for term, frequency in Counter(tokens).items()} for tokens in tokenized]
+        lengths = [len(tokens) for tokens in tokenized]
+        return Bm25Segment.build(name, ids, lengths, term_frequencies)
+
+    @staticmethod
+    def merge(name: str, segments: Sequence['Bm25Segment']) -> 'Bm25Segment':
+        """
+        One segment with the live paragraphs of all of the segments, in their order.
+        """
+        ids, lengths, posting_terms, positions, frequencies = [], [], [], [], []
+        offset = 0
+        for segment in segments:
+            new_positions = np.cumsum(segment.live, dtype=np.int64) - 1 + offset
+            segment_positions, segment_frequencies = segment.decode()
+            live_postings = segment.live[segment_positions]
+            ids.append(segment.ids[segment.live])
+            lengths.append(segment.lengths[segment.live])
+            posting_terms.append(segment.posting_terms()[live_postings])
+            positions.append(new_positions[segment_positions[live_postings]])
+            frequencies.append(segment_frequencies[live_postings])
+            offset += int(segment.live.sum())
+
+        def concatenate(arrays: List[np.ndarray], dtype) -> np.ndarray:
+            return np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.empty(0, dtype)
+
+        return Bm25Segment.from_postings(name, concatenate(ids, np.int64), concatenate(lengths, np.int32),
+                                         concatenate(posting_terms, np.int64), concatenate(positions, np.int32),
+                                         concatenate(frequencies, np.int32))
+
+    @staticmethod
+    def from_postings(name: str, ids: np.ndarray, lengths: np.ndarray, posting_terms: np.ndarray,
+                      positions: np.ndarray, frequencies: np.ndarray) -> 'Bm25Segment':
+        """
+        Builds a segment from its postings in any order: the term id, paragraph position and frequency of each.
+        """
+        # group the postings by term, keeping them sorted by position within a term
+        order = np.lexsort((positions, posting_terms))
+        posting_terms = posting_terms[order]
+        term_ids, starts = np.unique(posting_terms, return_index=True)
+        indptr = np.append(starts, len(posting_terms)).astype(np.int64)
+        positions, frequencies = positions[order], frequencies[order]
+        term_counts = np.diff(indptr)
+        position_bytes, position_offsets = _delta_encode(positions, term_counts)
+        frequency_bytes, frequency_ends = _encode_varints(frequencies)
+
+        # the same postings by paragraph: the rows of its terms, ascending
+        rows = np.repeat(np.arange(len(term_ids), dtype=np.int64), term_counts)
+        by_position = np.argsort(positions, kind='stable')
+        row_bytes, row_offsets = _delta_encode(rows[by_position], np.bincount(positions, minlength=len(ids)))
+        return Bm25Segment(name=name, ids=ids, lengths=lengths, term_ids=term_ids, indptr=indptr,
+                           position_offsets=position_offsets, position_bytes=position_bytes,
+                           frequency_offsets=np.append(0, frequency_ends)[indptr], frequency_bytes=frequency_bytes,
+                           row_offsets=row_offsets, row_bytes=row_bytes, live=np.ones(len(ids), dtype=bool),
+                           dead_frequencies=np.zeros(len(term_ids), dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def live_count(self) -> int:
+        return int(self.live.sum())
+
+    def posting_terms(self) -> np.ndarray:
+        """
+        The term id of every posting.
+        """
+        return np.repeat(self.term_ids, np.diff(self.indptr))
+
+    def row_postings(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The positions of the paragraphs containing the term of the row (dead ones included) and its frequencies
+        in them.
+        """
+        if self.indptr[row + 1] - self.indptr[row] < DECODED_CACHE_MIN_POSTINGS:
+            return self.decode(row, row + 1)
+        postings = _DecodedPostings.get((self.cache_key, row))
+        if postings is None:
+            postings = self.decode(row, row + 1)
+            _DecodedPostings.put((self.cache_key, row), postings)
+        return postings
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The positions of the paragraphs containing the term (dead ones included) and its frequencies in them.
+        """
+        row = int(np.searchsorted(self.term_ids, term_id))
+        if row == len(self.term_ids) or self.term_ids[row] != term_id:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return self.row_postings(row)
+
+    def decode(self, start_row: int = 0, end_row: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The positions and frequencies of the postings of the rows from start_row to end_row (all by default).
+        """
+        end_row = len(self.term_ids) if end_row is None else end_row
+        frequencies = _decode_varints(
+            self.frequency_bytes[self.frequency_offsets[start_row]:self.frequency_offsets[end_row]])
+        return self._decode_positions(start_row, end_row), frequencies.astype(np.int32)
+
+    def _decode_positions(self, start_row: int, end_row: int) -> np.ndarray:
+        deltas = _decode_varints(self.position_bytes[self.position_offsets[start_row]:self.position_offsets[end_row]])
+        return _delta_decode(deltas, np.diff(self.indptr[start_row:end_row + 1]))
+
+    def term_rows(self, positions: np.ndarray) -> np.ndarray:
+        """
+        The term rows of the paragraphs at the positions, concatenated.
+        """
+        starts = self.row_offsets[positions]
+        sizes = self.row_offsets[positions + 1] - starts
+        ends = np.cumsum(sizes)
+        # the bytes of all the paragraphs, one after the other
+        data = self.row_bytes[np.repeat(starts - (ends - sizes), sizes) + np.arange(int(ends[-1]) if len(ends) else 0)]
+        # every row ends with a byte below 0x80
+        row_ends = np.append(0, np.cumsum(data < 0x80))
+        return _delta_decode(_decode_varints(data), row_ends[ends] - row_ends[ends - sizes])
+
+    def document_frequencies(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The term ids and how many of the live paragraphs contain them.
+        """
+        return self.term_ids, np.diff(self.indptr) - self.dead_frequencies
+
+    def without(self, positions: np.ndarray) -> 'Bm25Segment':
+        live = self.live.copy()
+        live[positions] = False
+        dead = np.flatnonzero(self.live & ~live)
+        if len(dead) == 0:
+            return self
+        # only the terms of the newly dead paragraphs are decoded
+        dead_frequencies = self.dead_frequencies + np.bincount(self.term_rows(dead), minlength=len(self.term_ids))
+        return replace(self, live=live, dead_frequencies=dead_frequencies)
+
+    def live_positions_of(self, ids: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(self.live & np.isin(self.ids, ids))
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        for array in _ARRAYS:
+            np.save(directory / f'{array}.npy', getattr(self, array))
+
+    def save_dead(self, path: Path):
+        """
+        Saves the positions of the dead paragraphs, and their term counts so loading needn't decode the segment.
+        """
+        with open(path, 'wb') as f:
+            np.savez(f, positions=np.flatnonzero(~self.live), frequencies=self.dead_frequencies)
+
+    @staticmethod
+    def load(name: str, directory: Path, dead_path: Optional[Path] = None) -> 'Bm25Segment':
+        """
+        Maps the arrays of a saved segment, their pages are only read when they are used.
+        """
+        arrays = {array: np.load(directory / f'{array}.npy', mmap_mode='r') for array in _ARRAYS}
+        live = np.ones(len(arrays['ids']), dtype=bool)
+        dead_frequencies = np.zeros(len(arrays['term_ids']), dtype=np.int64)
+        if dead_path is not None:
+            with np.load(dead_path) as dead:
+                live[dead['positions']] = False
+                dead_frequencies = dead['frequencies']
+        return Bm25Segment(name=name, live=live, dead_frequencies=dead_frequencies, **arrays)
+
+    @staticmethod
+    def delete(directory: Path):
+        shutil.rmtree(directory, ignore_errors=True)
+
@@ -0,0 +1,100 @@
+import logging
+import threading
+from typing import Dict, Iterable, List
+
+import numpy as np
+from pyroaring import BitMap
+
+from indexing.metadata_index import MetadataIndex
+from schemas import Document
+
+logger = logging.getLogger(__name__)
+
+FACETS = ('data_source', 'type', 'location', 'author')
+# facets with more values are counted from the value codes of the paragraphs in the metadata index,
+# one lookup per paragraph instead of one bitmap intersection per value
+MAX_INTERSECTED_VALUES = 32
+
+
+class FacetIndex:
+    """
+    A compressed bitmap of paragraph ids per facet value (e.g. data_source=jira),
+    so counting the facets of a set of paragraphs is one bitmap intersection per value.
+    Facets with many values (authors, locations) are counted from the metadata index instead.
+    Built from the metadata index on startup and kept in sync by the Indexer.
+    """
+    instance = None
+
+    @staticmethod
+    def create():
+        if FacetIndex.instance is not None:
+            raise RuntimeError("Facet index is already initialized")
+
+        FacetIndex.instance = FacetIndex()
+
+    @staticmethod
+    def get() -> 'FacetIndex':
+        if FacetIndex.instance is None:
+            raise RuntimeError("Facet index is not initialized")
+        return FacetIndex.instance
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._bitmaps: Dict[str, Dict[str, BitMap]] = {facet: {} for facet in FACETS}
+        self.rebuild()
+
+    def rebuild(self):
+        metadata_index = MetadataIndex.get()
+        bitmaps = {facet: {value: BitMap(ids.tolist()) for value, ids in metadata_index.column_values(facet)}
+                   for facet in FACETS}
+        with self._lock:
+            self._bitmaps = bitmaps
+
+    def add_documents(self, documents: List[Document]):
+        with self._lock:
+            for document in documents:
+                paragraph_ids = [paragraph.id for paragraph in document.paragraphs]
+                if not paragraph_ids:
+                    continue
+
+                values = {'data_source': document.data_source.type.name if document.data_source is not None
+                          else None,
+                          'type': document.type, 'location': document.location, 'author': document.author}
+                for facet, value in values.items():
+                    if value is not None:
+                        self._bitmaps[facet].setdefault(value, BitMap()).update(paragraph_ids)
+
+    def remove_paragraphs(self, paragraph_ids: Iterable[int]):
+        removed = BitMap(paragraph_ids)
+        if not removed:
+            return
+
+        with self._lock:
+            for bitmaps in self._bitmaps.values():
+                for value in list(bitmaps):
+                    bitmaps[value] -= removed
+                    if not bitmaps[value]:
+                        del bitmaps[value]
+
+    def clear(self):
+        with self._lock:
+            self._bitmaps = {facet: {} for facet in FACETS}
+
+    def counts(self, paragraph_ids: Iterable[int], limit: int = 20) -> Dict[str, Dict[str, int]]:
+        """
+        The number of the given paragraphs per facet value, the top limit values of every facet.
+        """
+        paragraphs = BitMap(paragraph_ids)
+        ids = np.array(paragraphs, dtype=np.int64)
+        result = {}
+        with self._lock:
+            for facet, bitmaps in self._bitmaps.items():
+                if len(bitmaps) <= MAX_INTERSECTED_VALUES:
+                    counts = {value: bitmap.intersection_cardinality(paragraphs)
+                              for value, bitmap in bitmaps.items()}
+                else:
+                    counts = MetadataIndex.get().value_counts(facet, ids)
+                top = sorted(((value, count) for value, count in counts.items() if count > 0),
+                             key=lambda item: item[1], reverse=True)[:limit]
+                result[facet] = dict(top)
+        return result
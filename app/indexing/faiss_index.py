@@ -1,4 +1,7 @@
 import os
+from typing import Optional, Tuple
+
+import numpy as np
 import torch
 import faiss
 
@@ -33,7 +36,7 @@ class FaissIndex:
         self.index: faiss.IndexIDMap = index
 
     def update(self, ids: torch.LongTensor, embeddings: torch.FloatTensor):
-        self.index.add_with_ids(embeddings.cpu(), ids)
+        self.index.add_with_ids(embeddings.cpu(), np.asarray(ids, dtype=np.int64))
 
         faiss.write_index(self.index, FAISS_INDEX_PATH)
 
@@ -42,12 +45,25 @@ class FaissIndex:
 
         faiss.write_index(self.index, FAISS_INDEX_PATH)
 
-    def search(self, queries: torch.FloatTensor, top_k: int, *args, **kwargs):
+    def search(self, queries: torch.FloatTensor, top_k: int, *args, allowed_ids: Optional[np.ndarray] = None,
+               **kwargs):
+        """
+        allowed_ids, if given, restricts the search to those ids (applied inside the index with an ID selector).
+        """
+        _, ids = self.search_with_scores(queries, top_k, *args, allowed_ids=allowed_ids, **kwargs)
+        return ids
+
+    def search_with_scores(self, queries: torch.FloatTensor, top_k: int, *args,
+                           allowed_ids: Optional[np.ndarray] = None, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The (inner product) scores and the ids of the top_k hits of every query, padded with -1 ids.
+        """
         if queries.ndim == 1:
             queries = queries.unsqueeze(0)
-        _, ids = self.index.search(queries.cpu(), top_k, *args, **kwargs)
-        print(ids)
-        return ids
+        if allowed_ids is not None:
+            selector = faiss.IDSelectorBatch(np.ascontiguousarray(allowed_ids, dtype=np.int64))
+            kwargs['params'] = faiss.SearchParameters(sel=selector)
+        return self.index.search(queries.cpu().numpy(), top_k, *args, **kwargs)
 
     def clear(self):
         self.index.reset()
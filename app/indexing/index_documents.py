@@ -7,6 +7,12 @@ from data_source.api.basic_document import BasicDocument, FileType
 from db_engine import Session
 from indexing.bm25_index import Bm25Index
 from indexing.faiss_index import FaissIndex
+from indexing.facet_index import FacetIndex
+from indexing.index_generation import IndexGeneration
+from indexing.lookup_index import LookupIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore
+from indexing.suggestion_index import SuggestionIndex
 from models import bi_encoder
 from paths import IS_IN_DOCKER
 from schemas import Document, Paragraph
@@ -83,19 +89,27 @@ class Indexer:
             # Save the documents to the database
             session.add_all(db_documents)
             session.commit()
+            ParagraphStore.get().add_documents(db_documents)
+            MetadataIndex.get().add_documents(db_documents)
+            FacetIndex.get().add_documents(db_documents)
+            SuggestionIndex.get().add_documents(db_documents)
 
             # Create a list of all the paragraphs in the documents
             logger.info(f"Indexing {len(db_documents)} documents => {len(paragraphs)} paragraphs")
             paragraphs = [paragraph for document in db_documents for paragraph in document.paragraphs]
             if len(paragraphs) == 0:
                 logger.info(f"No paragraphs to index")
+                LookupIndex.get().add_documents(db_documents)
+                IndexGeneration.bump()
                 return
 
             paragraph_ids = [paragraph.id for paragraph in paragraphs]
             paragraph_contents = [Indexer._add_metadata_for_indexing(paragraph) for paragraph in paragraphs]
 
-        logger.info(f"Updating BM25 index...")
-        Bm25Index.get().update()
+            logger.info(f"Updating BM25 index...")
+            Bm25Index.get().add(paragraphs)
+            # the looked-up paragraphs are ranked by BM25, so they are added to it first
+            LookupIndex.get().add_documents(db_documents)
 
         if len(paragraph_contents) == 0:
             return
@@ -108,6 +122,7 @@ class Indexer:
         # Add the embeddings to the index
         logger.info(f"Updating vector index...")
         FaissIndex.get().update(paragraph_ids, embeddings)
+        IndexGeneration.bump()
 
         logger.info(f"Finished indexing {len(documents)} documents => {len(paragraphs)} paragraphs")
 
@@ -150,10 +165,23 @@ class Indexer:
         # Remove the paragraphs from the index
         paragraph_ids = [paragraph.id for paragraph in db_paragraphs]
 
+        document_ids = [document.id for document in documents]
+        ParagraphStore.get().remove_documents(document_ids)
+        removed_paragraph_ids = MetadataIndex.get().remove_documents(document_ids)
+        # the paragraphs of the children go with their parents
+        paragraph_ids = sorted(set(paragraph_ids) | set(removed_paragraph_ids.tolist()))
+
         logger.info(f"Removing documents from vector index...")
         FaissIndex.get().remove(paragraph_ids)
 
+        # the looked-up paragraphs are ranked by BM25, so they leave the lookups first
+        LookupIndex.get().remove_documents(document_ids)
+
         logger.info(f"Removing documents from BM25 index...")
-        Bm25Index.get().update(session=session)
+        Bm25Index.get().remove(paragraph_ids)
+
+        FacetIndex.get().remove_paragraphs(removed_paragraph_ids.tolist())
+        SuggestionIndex.get().remove_documents(document_ids)
+        IndexGeneration.bump()
 
         logger.info(f"Finished removing {len(documents)} documents => {len(db_paragraphs)} paragraphs")
@@ -0,0 +1,20 @@
+import threading
+
+
+class IndexGeneration:
+    """
+    A counter that is bumped every time the search indices change.
+    Anything derived from the indices (e.g. search caches) can compare generations to know it is stale.
+    """
+    _generation = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> int:
+        return cls._generation
+
+    @classmethod
+    def bump(cls) -> int:
+        with cls._lock:
+            cls._generation += 1
+            return cls._generation
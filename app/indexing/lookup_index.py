@@ -0,0 +1,133 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+from indexing.paragraph_store import ParagraphStore
+from schemas import Document
+from searching.query_router import extract_identifiers, normalize_url
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_title(title: str) -> str:
+    return ' '.join(title.lower().split())
+
+
+class LookupIndex:
+    """
+    Exact-match lookups from a document's id in its data source, url, title and the identifiers
+    it mentions (Jira keys, GitLab references) to the ids of its paragraphs.
+    Lets identifier queries skip the neural cascade entirely (see searching.query_router).
+    Built from the paragraph store on startup and kept in sync by the Indexer.
+    """
+    instance = None
+
+    @staticmethod
+    def create():
+        if LookupIndex.instance is not None:
+            raise RuntimeError("Lookup index is already initialized")
+
+        LookupIndex.instance = LookupIndex()
+
+    @staticmethod
+    def get() -> 'LookupIndex':
+        if LookupIndex.instance is None:
+            raise RuntimeError("Lookup index is not initialized")
+        return LookupIndex.instance
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # key => paragraph ids
+        self._paragraphs: Dict[str, Set[int]] = defaultdict(set)
+        # document id => (its keys, its paragraph ids)
+        self._documents: Dict[int, Tuple[List[str], List[int]]] = {}
+        self._children: Dict[int, Set[int]] = {}
+        self.rebuild()
+
+    @staticmethod
+    def _keys(document) -> List[str]:
+        keys = []
+        if document.id_in_data_source:
+            keys.append(str(document.id_in_data_source).lower())
+        if document.url:
+            keys.append(normalize_url(document.url))
+        if document.title:
+            keys.append(_normalize_title(document.title))
+        keys += extract_identifiers(document.title) + extract_identifiers(document.url)
+        return list(dict.fromkeys(keys))
+
+    def _add(self, document, paragraph_ids: List[int]):
+        self._remove(document.id)
+        if document.parent_id is not None:
+            self._children.setdefault(document.parent_id, set()).add(document.id)
+        if not paragraph_ids:
+            return
+
+        keys = self._keys(document)
+        for key in keys:
+            self._paragraphs[key].update(paragraph_ids)
+        self._documents[document.id] = (keys, paragraph_ids)
+
+    def _remove(self, document_id: int):
+        keys, paragraph_ids = self._documents.pop(document_id, ((), ()))
+        for key in keys:
+            paragraphs = self._paragraphs.get(key)
+            if paragraphs is None:
+                continue
+            paragraphs.difference_update(paragraph_ids)
+            if not paragraphs:
+                del self._paragraphs[key]
+
+    def rebuild(self):
+        """
+        Rebuilds the lookups from the paragraph store.
+        """
+        store = ParagraphStore.get()
+        paragraph_ids, document_ids = store.paragraph_document_ids()
+        paragraphs_by_document = defaultdict(list)
+        for paragraph_id, document_id in zip(paragraph_ids.tolist(), document_ids.tolist()):
+            paragraphs_by_document[document_id].append(paragraph_id)
+        with self._lock:
+            self._paragraphs = defaultdict(set)
+            self._documents = {}
+            self._children = {}
+            for document in store.all_documents():
+                self._add(document, paragraphs_by_document.get(document.id, []))
+        logger.info(f'Built the lookup index with {len(self._paragraphs)} keys')
+
+    def add_documents(self, documents: List[Document]):
+        with self._lock:
+            for document in documents:
+                self._add(document, [paragraph.id for paragraph in document.paragraphs])
+
+    def remove_documents(self, document_ids: Iterable[int]):
+        """
+        Removes the documents and their children.
+        """
+        with self._lock:
+            for document_id in document_ids:
+                for child_id in self._children.pop(document_id, set()):
+                    self._remove(child_id)
+                self._remove(document_id)
+
+    def clear(self):
+        with self._lock:
+            self._paragraphs = defaultdict(set)
+            self._documents = {}
+            self._children = {}
+
+    def lookup(self, keys: Iterable[str]) -> List[int]:
+        """
+        The ids of the paragraphs of the documents matching any of the keys, of the first key first.
+        Keys are matched regardless of case and whitespace.
+        """
+        ids = {}
+        with self._lock:
+            for key in keys:
+                for id in sorted(self._paragraphs.get(_normalize_title(key), ())):
+                    ids.setdefault(id, None)
+        return list(ids)
+
+    def __len__(self) -> int:
+        return len(self._paragraphs)
@@ -0,0 +1,197 @@
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from indexing.paragraph_store import NO_ID, NO_TIMESTAMP, ParagraphStore, to_microseconds
+from schemas import Document
+from searching.filters import SearchFilter
+
+logger = logging.getLogger(__name__)
+
+# dictionary-encoded text columns, a code of -1 stands for None
+CATEGORICAL_COLUMNS = ('data_source', 'type', 'location', 'author')
+
+ROW_DTYPE = np.dtype([('id', np.int64), ('document_id', np.int64), ('parent_id', np.int64),
+                      ('data_source_id', np.int64), ('timestamp', np.int64), ('is_active', np.int8)] +
+                     [(column, np.int32) for column in CATEGORICAL_COLUMNS])
+
+
+def _find(rows: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The positions of the ids in the rows (sorted by id), and which of the ids were found.
+    """
+    positions = np.searchsorted(rows['id'], ids)
+    found = positions < len(rows)
+    found[found] = rows['id'][positions[found]] == ids[found]
+    return positions, found
+
+
+class MetadataIndex:
+    """
+    In-memory columns of document metadata, one row per paragraph, sorted by paragraph id.
+    Evaluating a SearchFilter over them gives the ids of the eligible paragraphs.
+    Built from the paragraph store on startup and kept in sync by the Indexer.
+    Added rows are appended to pending batches, which are merged into the sorted rows on the next read.
+    """
+    instance = None
+
+    @staticmethod
+    def create():
+        if MetadataIndex.instance is not None:
+            raise RuntimeError("Metadata index is already initialized")
+
+        MetadataIndex.instance = MetadataIndex()
+
+    @staticmethod
+    def get() -> 'MetadataIndex':
+        if MetadataIndex.instance is None:
+            raise RuntimeError("Metadata index is not initialized")
+        return MetadataIndex.instance
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows = np.empty(0, ROW_DTYPE)
+        self._pending: List[np.ndarray] = []
+        self._codes: Dict[str, Dict[str, int]] = {column: {} for column in CATEGORICAL_COLUMNS}
+        self.rebuild()
+
+    def _code(self, column: str, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        codes = self._codes[column]
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+
+    def _document_row(self, document, data_source_name: Optional[str]) -> tuple:
+        return (document.parent_id if document.parent_id is not None else NO_ID,
+                document.data_source_id if document.data_source_id is not None else NO_ID,
+                to_microseconds(document.timestamp),
+                int(document.is_active) if document.is_active is not None else -1,
+                self._code('data_source', data_source_name),
+                self._code('type', document.type),
+                self._code('location', document.location),
+                self._code('author', document.author))
+
+    def rebuild(self):
+        """
+        Rebuilds the columns from the paragraph store.
+        """
+        store = ParagraphStore.get()
+        with self._lock:
+            document_rows = {document.id: self._document_row(document, document.data_source_name)
+                             for document in store.all_documents()}
+            paragraph_ids, document_ids = store.paragraph_document_ids()
+            rows = np.array([(id, document_id) + document_rows[document_id]
+                             for id, document_id in zip(paragraph_ids.tolist(), document_ids.tolist())
+                             if document_id in document_rows], ROW_DTYPE)
+            self._rows = rows
+            self._pending = []
+        logger.info(f'Built the metadata index for {len(rows)} paragraphs')
+
+    def add_documents(self, documents: List[Document]):
+        with self._lock:
+            new_rows = []
+            for document in documents:
+                data_source_name = document.data_source.type.name if document.data_source is not None else None
+                document_row = self._document_row(document, data_source_name)
+                new_rows.extend((paragraph.id, document.id) + document_row for paragraph in document.paragraphs)
+
+            self._pending.append(np.array(new_rows, ROW_DTYPE))
+
+    def _merged_rows(self) -> np.ndarray:
+        """
+        Merges the pending rows into the sorted rows, a re-added paragraph keeps its latest row.
+        Must be called with the lock held.
+        """
+        if not self._pending:
+            return self._rows
+
+        new_rows = np.concatenate(self._pending)
+        self._pending = []
+        # the last row of every id, in id order
+        new_rows = new_rows[::-1][np.argsort(new_rows['id'][::-1], kind='stable')]
+        new_rows = new_rows[np.r_[True, np.diff(new_rows['id']) != 0]]
+
+        positions, replaced = _find(self._rows, new_rows['id'])
+        rows = np.delete(self._rows, positions[replaced])
+        self._rows = np.insert(rows, np.searchsorted(rows['id'], new_rows['id']), new_rows)
+        return self._rows
+
+    def remove_documents(self, document_ids: List[int]) -> np.ndarray:
+        """
+        Removes the paragraphs of the documents and of their children, returns the removed paragraph ids.
+        """
+        with self._lock:
+            rows = self._merged_rows()
+            removed = np.isin(rows['document_id'], document_ids) | np.isin(rows['parent_id'], document_ids)
+            removed_ids = rows['id'][removed]
+            self._rows = rows[~removed]
+            return removed_ids
+
+    def clear(self):
+        with self._lock:
+            self._rows = np.empty(0, ROW_DTYPE)
+            self._pending = []
+
+    def column_values(self, column: str) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        Yields every value of a categorical column with the ids of the paragraphs that have it.
+        """
+        with self._lock:
+            rows = self._merged_rows()
+            values = {code: value for value, code in self._codes[column].items()}
+        if len(rows) == 0:
+            return
+
+        order = np.argsort(rows[column], kind='stable')
+        codes = rows[column][order]
+        starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+        for ids, code in zip(np.split(rows['id'][order], starts[1:]), codes[starts]):
+            if code >= 0:
+                yield values[int(code)], ids
+
+    def value_counts(self, column: str, ids: np.ndarray) -> Dict[str, int]:
+        """
+        The number of the given (distinct) paragraphs per value of a categorical column.
+        """
+        with self._lock:
+            rows = self._merged_rows()
+            # the codes are given out in insertion order
+            values = list(self._codes[column])
+        positions, found = _find(rows, ids)
+        codes = rows[column][positions[found]]
+        counts = np.bincount(codes[codes >= 0])
+        return {values[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+
+    def _codes_of(self, column: str, values: Iterable[str]) -> List[int]:
+        codes = self._codes[column]
+        return [codes[value] for value in values if value in codes]
+
+    def matching_ids(self, search_filter: SearchFilter) -> np.ndarray:
+        """
+        The sorted ids of the paragraphs the filter allows.
+        """
+        with self._lock:
+            rows = self._merged_rows()
+        mask = np.ones(len(rows), dtype=bool)
+        for column, values in (('data_source', search_filter.data_sources), ('type', search_filter.types),
+                               ('location', search_filter.locations), ('author', search_filter.authors)):
+            if values:
+                mask &= np.isin(rows[column], self._codes_of(column, values))
+        if search_filter.data_source_ids:
+            mask &= np.isin(rows['data_source_id'], search_filter.data_source_ids)
+        if search_filter.from_time is not None:
+            mask &= rows['timestamp'] >= to_microseconds(search_filter.from_time)
+        if search_filter.to_time is not None:
+            mask &= (rows['timestamp'] <= to_microseconds(search_filter.to_time)) & \
+                    (rows['timestamp'] != NO_TIMESTAMP)
+        if search_filter.is_active is not None:
+            mask &= rows['is_active'] == int(search_filter.is_active)
+        return rows['id'][mask]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._merged_rows())
@@ -0,0 +1,539 @@
+import datetime
+import json
+import logging
+import mmap
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import selectinload
+
+from db_engine import Session
+from paths import PARAGRAPH_STORE_PATH
+from schemas import DataSource, Document
+
+logger = logging.getLogger(__name__)
+
+# the text fields of a document, stored in the strings blob
+STRING_FIELDS = ('id_in_data_source', 'data_source_name', 'type', 'file_type', 'status', 'title', 'author',
+                 'author_image_url', 'url', 'location')
+
+PARAGRAPH_DTYPE = np.dtype([('id', np.int64), ('document_id', np.int64),
+                            ('content_offset', np.int64), ('content_length', np.int32)])
+DOCUMENT_DTYPE = np.dtype([('id', np.int64), ('parent_id', np.int64), ('data_source_id', np.int64),
+                           ('timestamp', np.int64), ('is_active', np.int8)] +
+                          [(f'{field}_offset', np.int64) for field in STRING_FIELDS] +
+                          [(f'{field}_length', np.int32) for field in STRING_FIELDS])
+
+NO_ID = -1
+NO_TIMESTAMP = np.iinfo(np.int64).min
+EPOCH = datetime.datetime(1970, 1, 1)
+# the strings blob is rewritten once more than this fraction of it belongs to removed documents
+COMPACTION_THRESHOLD = 0.5
+# the newest segments are merged while the segment before them is at most this many times their size,
+# which keeps the number of segments logarithmic and rewrites every record a logarithmic number of times
+MERGE_RATIO = 2
+REBUILD_BATCH_SIZE = 5000
+
+
+def to_microseconds(timestamp: Optional[datetime.datetime]) -> int:
+    if timestamp is None:
+        return NO_TIMESTAMP
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+@dataclass
+class StoredDocument:
+    """
+    The document fields search needs, with the same names as on the Document model.
+    """
+    id: int
+    id_in_data_source: Optional[str]
+    data_source_id: Optional[int]
+    data_source_name: Optional[str]
+    type: Optional[str]
+    file_type: Optional[str]
+    status: Optional[str]
+    is_active: Optional[bool]
+    title: Optional[str]
+    author: Optional[str]
+    author_image_url: Optional[str]
+    url: Optional[str]
+    location: Optional[str]
+    timestamp: Optional[datetime.datetime]
+    parent_id: Optional[int]
+    parent: Optional['StoredDocument'] = None
+
+
+@dataclass
+class StoredParagraph:
+    id: int
+    content: str
+    document: StoredDocument
+
+
+class _Segment:
+    """
+    One batch of changes: the records it added, sorted by id, and the ids of the documents it removed (sorted).
+    The records and removals of a segment shadow whatever older segments hold for the same documents.
+    """
+
+    def __init__(self, paragraphs: np.ndarray, documents: np.ndarray, removed: np.ndarray) -> None:
+        self.paragraphs = paragraphs
+        self.documents = documents
+        self.removed = removed
+        # searchsorted copies a strided field of the records on every call, the ids are searched in a copy instead
+        self.paragraph_ids = np.ascontiguousarray(paragraphs['id'])
+        self.document_ids = np.ascontiguousarray(documents['id'])
+
+    def __len__(self) -> int:
+        return len(self.paragraphs) + len(self.documents) + len(self.removed)
+
+
+def _row(ids: np.ndarray, id: int) -> Optional[int]:
+    row = int(np.searchsorted(ids, id))
+    if row < len(ids) and ids[row] == id:
+        return row
+    return None
+
+
+def _rows(ids: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Which of the keys are in the sorted ids, and their rows there (meaningless for the missing keys).
+    """
+    if len(ids) == 0:
+        return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.int64)
+    rows = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+    return ids[rows] == keys, rows
+
+
+def _live(segments: Sequence[_Segment]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    For every segment, which of its documents and paragraphs are not shadowed by a newer segment.
+    """
+    masks = []
+    decided = np.empty(0, np.int64)
+    for segment in reversed(segments):
+        live_documents = ~np.isin(segment.document_ids, decided)
+        live_paragraphs = np.isin(segment.paragraphs['document_id'], segment.document_ids[live_documents])
+        masks.append((live_documents, live_paragraphs))
+        decided = np.union1d(decided, np.union1d(segment.document_ids, segment.removed))
+    return masks[::-1]
+
+
+def _string_size(paragraphs: np.ndarray, documents: np.ndarray) -> int:
+    size = int(paragraphs['content_length'].sum())
+    for field in STRING_FIELDS:
+        size += int(np.maximum(documents[f'{field}_length'], 0).sum())
+    return size
+
+
+def _merge(segments: Sequence[_Segment], keep_removed: bool) -> _Segment:
+    """
+    Merges consecutive segments into one holding their live records, and the removals still needed to shadow
+    older segments unless there are none (keep_removed=False).
+    """
+    paragraphs, documents, removed = [], [], []
+    decided = np.empty(0, np.int64)
+    for segment, (live_documents, live_paragraphs) in zip(segments, _live(segments)):
+        paragraphs.append(segment.paragraphs[live_paragraphs])
+        documents.append(segment.documents[live_documents])
+    for segment in reversed(segments):
+        if keep_removed:
+            removed.append(segment.removed[~np.isin(segment.removed, decided)])
+        decided = np.union1d(decided, np.union1d(segment.document_ids, segment.removed))
+
+    paragraphs = np.concatenate(paragraphs) if paragraphs else np.empty(0, PARAGRAPH_DTYPE)
+    documents = np.concatenate(documents) if documents else np.empty(0, DOCUMENT_DTYPE)
+    removed = np.sort(np.concatenate(removed)) if removed else np.empty(0, np.int64)
+    return _Segment(paragraphs[np.argsort(paragraphs['id'], kind='stable')],
+                    documents[np.argsort(documents['id'], kind='stable')], removed)
+
+
+class _StoreView:
+    """
+    An immutable snapshot of the store: the segments (memory-mapped), oldest first, and the strings blob.
+    Readers keep using the snapshot they got while the indexer swaps in a new one.
+    """
+
+    def __init__(self, segments: Tuple[_Segment, ...], blob) -> None:
+        self.segments = segments
+        self.blob = blob
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if length < 0:
+            return None
+        return bytes(self.blob[offset:offset + length]).decode('utf-8')
+
+    def _find(self, id: int) -> Optional[Tuple[int, int]]:
+        """
+        The segment and row of the current record of the document, None if it was removed or never added.
+        """
+        for i in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[i]
+            if _row(segment.removed, id) is not None:
+                return None
+            row = _row(segment.document_ids, id)
+            if row is not None:
+                return i, row
+        return None
+
+    def string_size(self, document_ids: np.ndarray) -> int:
+        """
+        The size of the strings of the documents' current records and of their paragraphs.
+        """
+        size = 0
+        pending = np.ones(len(document_ids), dtype=bool)
+        for segment in reversed(self.segments):
+            if not pending.any():
+                break
+            pending &= ~_rows(segment.removed, document_ids)[0]
+            found, rows = _rows(segment.document_ids, document_ids)
+            found &= pending
+            if found.any():
+                documents = segment.documents[rows[found]]
+                paragraphs = segment.paragraphs[np.isin(segment.paragraphs['document_id'], documents['id'])]
+                size += _string_size(paragraphs, documents)
+                pending &= ~found
+        return size
+
+    def document(self, id: int, with_parent: bool = True) -> Optional[StoredDocument]:
+        found = self._find(id)
+        if found is None:
+            return None
+        return self._document(self.segments[found[0]].documents[found[1]], with_parent)
+
+    def _document(self, record, with_parent: bool = True) -> StoredDocument:
+        timestamp = int(record['timestamp'])
+        is_active = int(record['is_active'])
+        parent_id = int(record['parent_id'])
+        data_source_id = int(record['data_source_id'])
+        strings = {field: self._string(int(record[f'{field}_offset']), int(record[f'{field}_length']))
+                   for field in STRING_FIELDS}
+        document = StoredDocument(id=int(record['id']),
+                                  data_source_id=data_source_id if data_source_id != NO_ID else None,
+                                  is_active=bool(is_active) if is_active >= 0 else None,
+                                  timestamp=EPOCH + datetime.timedelta(microseconds=timestamp)
+                                  if timestamp != NO_TIMESTAMP else None,
+                                  parent_id=parent_id if parent_id != NO_ID else None,
+                                  **strings)
+        if with_parent and document.parent_id is not None:
+            document.parent = self.document(document.parent_id, with_parent=False)
+        return document
+
+    def paragraphs_by_id(self, ids: Iterable[int]) -> Dict[int, StoredParagraph]:
+        ids = np.fromiter(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return {}
+
+        # the newest record of every paragraph, kept if it belongs to the current record of its document
+        pending = np.ones(len(ids), dtype=bool)
+        found = []
+        for i in range(len(self.segments) - 1, -1, -1):
+            if not pending.any():
+                break
+            matched, rows = _rows(self.segments[i].paragraph_ids, ids)
+            matched &= pending
+            found.extend((i, row) for row in rows[matched].tolist())
+            pending &= ~matched
+
+        documents = {}
+        result = {}
+        for i, row in found:
+            record = self.segments[i].paragraphs[row]
+            document_id = int(record['document_id'])
+            if document_id not in documents:
+                location = self._find(document_id)
+                documents[document_id] = (None, None) if location is None else \
+                    (location[0], self._document(self.segments[location[0]].documents[location[1]]))
+            segment, document = documents[document_id]
+            if segment != i:
+                # the document was removed, or re-added without this paragraph
+                continue
+            content = self._string(int(record['content_offset']), int(record['content_length']))
+            result[int(record['id'])] = StoredParagraph(id=int(record['id']), content=content, document=document)
+        return result
+
+
+class ParagraphStore:
+    """
+    A read-optimized copy of the paragraphs and their documents, so search can hydrate candidates
+    without going through the database.
+    Fixed-size records live in memory-mapped .npy segments sorted by id, the texts in an append-only strings blob.
+    Every update appends a small segment with its records (or removals) and switches to it through manifest.json,
+    so a crash never leaves the store half-written and an update costs about the size of its batch:
+    the newest segments are merged as they grow (see MERGE_RATIO), and everything is rewritten only when
+    the strings of removed documents make up COMPACTION_THRESHOLD of the blob.
+    The Indexer keeps it in sync with the database.
+    """
+    instance = None
+
+    @staticmethod
+    def create():
+        if ParagraphStore.instance is not None:
+            raise RuntimeError("Paragraph store is already initialized")
+
+        ParagraphStore.instance = ParagraphStore()
+
+    @staticmethod
+    def get() -> 'ParagraphStore':
+        if ParagraphStore.instance is None:
+            raise RuntimeError("Paragraph store is not initialized")
+        return ParagraphStore.instance
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._view = _StoreView((), b'')
+        PARAGRAPH_STORE_PATH.mkdir(parents=True, exist_ok=True)
+
+        manifest_path = PARAGRAPH_STORE_PATH / 'manifest.json'
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                self._manifest = json.load(f)
+            self._open()
+        else:
+            # first start with the store, copy what is already indexed
+            self.rebuild()
+
+    def paragraphs_by_id(self, ids: Iterable[int]) -> Dict[int, StoredParagraph]:
+        return self._view.paragraphs_by_id(ids)
+
+    def get_paragraph(self, id: int) -> Optional[StoredParagraph]:
+        return self._view.paragraphs_by_id([id]).get(id)
+
+    def get_document(self, id: int) -> Optional[StoredDocument]:
+        return self._view.document(id)
+
+    def all_documents(self) -> Iterator[StoredDocument]:
+        view = self._view
+        for segment, (live_documents, _) in zip(view.segments, _live(view.segments)):
+            for record in segment.documents[live_documents]:
+                yield view._document(record, with_parent=False)
+
+    def paragraph_document_ids(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The ids of all paragraphs (sorted) and the ids of their documents.
+        """
+        view = self._view
+        paragraphs = [segment.paragraphs[live_paragraphs][['id', 'document_id']]
+                      for segment, (_, live_paragraphs) in zip(view.segments, _live(view.segments))]
+        paragraphs = np.concatenate(paragraphs) if paragraphs else np.empty(0, PARAGRAPH_DTYPE)
+        paragraphs = paragraphs[np.argsort(paragraphs['id'], kind='stable')]
+        return np.array(paragraphs['id']), np.array(paragraphs['document_id'])
+
+    def __len__(self) -> int:
+        view = self._view
+        return sum(int(live_paragraphs.sum()) for _, live_paragraphs in _live(view.segments))
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Adds committed documents (and their paragraphs) to the store, re-added documents replace their old records.
+        """
+        if len(documents) == 0:
+            return
+
+        with self._lock:
+            blob_path = PARAGRAPH_STORE_PATH / self._manifest['blob']
+            blob_size = self._manifest['blob_size']
+            new_documents = np.zeros(len(documents), DOCUMENT_DTYPE)
+            new_paragraphs = []
+
+            with open(blob_path, 'ab') as blob:
+                blob.seek(blob_size)
+                blob.truncate()
+
+                def append(text: Optional[str]):
+                    nonlocal blob_size
+                    if text is None:
+                        return 0, -1
+                    data = text.encode('utf-8')
+                    blob.write(data)
+                    blob_size += len(data)
+                    return blob_size - len(data), len(data)
+
+                for record, document in zip(new_documents, documents):
+                    record['id'] = document.id
+                    record['parent_id'] = document.parent_id if document.parent_id is not None else NO_ID
+                    record['data_source_id'] = document.data_source_id \
+                        if document.data_source_id is not None else NO_ID
+                    record['timestamp'] = to_microseconds(document.timestamp)
+                    record['is_active'] = int(document.is_active) if document.is_active is not None else -1
+                    for field in STRING_FIELDS:
+                        if field == 'data_source_name':
+                            value = document.data_source.type.name if document.data_source is not None else None
+                        else:
+                            value = getattr(document, field)
+                        record[f'{field}_offset'], record[f'{field}_length'] = append(value)
+
+                    for paragraph in document.paragraphs:
+                        offset, length = append(paragraph.content or '')
+                        new_paragraphs.append((paragraph.id, document.id, offset, length))
+
+            new_paragraphs = np.array(new_paragraphs, PARAGRAPH_DTYPE)
+            garbage_size = self._view.string_size(new_documents['id'])
+            self._append(_Segment(new_paragraphs[np.argsort(new_paragraphs['id'], kind='stable')],
+                                  new_documents[np.argsort(new_documents['id'], kind='stable')],
+                                  np.empty(0, np.int64)), blob_size, garbage_size)
+
+    def remove_documents(self, document_ids: List[int]):
+        """
+        Removes the documents, their children and all of their paragraphs.
+        """
+        if len(document_ids) == 0:
+            return
+
+        with self._lock:
+            view = self._view
+            document_ids = np.unique(np.array(document_ids, dtype=np.int64))
+            children = np.concatenate([np.empty(0, np.int64)] + [
+                segment.document_ids[np.isin(segment.documents['parent_id'], document_ids)]
+                for segment in view.segments])
+            # older records of a child may have had another parent, only the current one counts
+            removed = [id for id in document_ids.tolist() if view._find(id) is not None]
+            for child_id in np.unique(children).tolist():
+                found = view._find(child_id)
+                if found is not None and \
+                        _row(document_ids, view.segments[found[0]].documents[found[1]]['parent_id']) is not None:
+                    removed.append(child_id)
+            if len(removed) == 0:
+                return
+
+            self._append(_Segment(np.empty(0, PARAGRAPH_DTYPE), np.empty(0, DOCUMENT_DTYPE),
+                                  np.unique(np.array(removed, dtype=np.int64))), self._manifest['blob_size'],
+                         view.string_size(np.array(removed, dtype=np.int64)))
+
+    def clear(self):
+        with self._lock:
+            self._compact([])
+
+    def rebuild(self):
+        """
+        Rebuilds the store from the database.
+        """
+        logger.info('Building the paragraph store from the database...')
+        with self._lock:
+            self._compact([])
+
+        with Session() as session:
+            query = session.query(Document).order_by(Document.id).options(
+                selectinload(Document.paragraphs), selectinload(Document.data_source).selectinload(DataSource.type))
+            offset = 0
+            while documents := query.offset(offset).limit(REBUILD_BATCH_SIZE).all():
+                self.add_documents(documents)
+                offset += len(documents)
+
+    def _append(self, segment: _Segment, blob_size: int, garbage_size: int):
+        """
+        Adds the segment after the existing ones, merging it with the newest segments that are not much bigger.
+        garbage_size is the size of the strings of the records it replaces or removes.
+        """
+        segments = list(self._view.segments) + [segment]
+        merged_size = len(segment)
+        start = len(segments) - 1
+        while start > 0 and len(segments[start - 1]) <= MERGE_RATIO * merged_size:
+            start -= 1
+            merged_size += len(segments[start])
+
+        garbage_size += self._manifest['garbage_size']
+        if garbage_size > blob_size * COMPACTION_THRESHOLD:
+            self._compact(segments, blob_size)
+            return
+
+        if start < len(segments) - 1:
+            segment = _merge(segments[start:], keep_removed=start > 0)
+        self._write(self._manifest['segments'][:start], segment, self._manifest['blob'], blob_size, garbage_size)
+
+    def _compact(self, segments: List[_Segment], source_size: Optional[int] = None):
+        """
+        Merges the segments into one and copies its strings to a new blob.
+        source_size is the size of the current blob, if strings were appended to it since it was mapped.
+        """
+        version = (self._manifest['version'] + 1) if self._manifest else 0
+        blob_name = f'strings.{version}.bin'
+        source = self._view.blob if source_size is None else self._map_blob(self._manifest['blob'], source_size)
+        segment = _merge(segments, keep_removed=False)
+        paragraphs, documents = segment.paragraphs, segment.documents
+        blob_size = 0
+
+        with open(PARAGRAPH_STORE_PATH / blob_name, 'wb') as blob:
+            def copy(offsets: np.ndarray, lengths: np.ndarray):
+                nonlocal blob_size
+                for i in range(len(offsets)):
+                    if lengths[i] < 0:
+                        continue
+                    blob.write(source[offsets[i]:offsets[i] + lengths[i]])
+                    offsets[i] = blob_size
+                    blob_size += int(lengths[i])
+
+            copy(paragraphs['content_offset'], paragraphs['content_length'])
+            for field in STRING_FIELDS:
+                copy(documents[f'{field}_offset'], documents[f'{field}_length'])
+
+        self._write([], segment, blob_name, blob_size, 0)
+
+    def _write(self, kept: List[Dict[str, str]], segment: _Segment, blob_name: str, blob_size: int,
+               garbage_size: int):
+        """
+        Saves the segment and switches to it, after the kept segments of the current manifest.
+        """
+        previous = self._manifest
+        version = (previous['version'] + 1) if previous else 0
+        entry = {'paragraphs': f'paragraphs.{version}.npy', 'documents': f'documents.{version}.npy',
+                 'removed': f'removed.{version}.npy'}
+        np.save(PARAGRAPH_STORE_PATH / entry['paragraphs'], segment.paragraphs)
+        np.save(PARAGRAPH_STORE_PATH / entry['documents'], segment.documents)
+        np.save(PARAGRAPH_STORE_PATH / entry['removed'], segment.removed)
+        manifest = {'version': version, 'segments': kept + [entry], 'blob': blob_name, 'blob_size': blob_size,
+                    'garbage_size': garbage_size}
+        tmp_path = PARAGRAPH_STORE_PATH / 'manifest.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, PARAGRAPH_STORE_PATH / 'manifest.json')
+
+        # the segments that were kept are already mapped
+        loaded = {entry['paragraphs']: segment for entry, segment in zip(previous['segments'], self._view.segments)} \
+            if previous is not None else {}
+        self._manifest = manifest
+        self._open(loaded)
+
+        if previous is not None:
+            stale = {file_name for entry in previous['segments'] for file_name in entry.values()} - \
+                {file_name for entry in manifest['segments'] for file_name in entry.values()}
+            if previous['blob'] != blob_name:
+                stale.add(previous['blob'])
+            for file_name in stale:
+                try:
+                    os.remove(PARAGRAPH_STORE_PATH / file_name)
+                except OSError:
+                    # still mapped by a reader (on Windows), it is left behind
+                    pass
+
+    @staticmethod
+    def _map_blob(blob_name: str, blob_size: int):
+        if blob_size == 0:
+            return b''
+        with open(PARAGRAPH_STORE_PATH / blob_name, 'rb') as f:
+            return mmap.mmap(f.fileno(), blob_size, access=mmap.ACCESS_READ)
+
+    def _open(self, loaded: Optional[Dict[str, _Segment]] = None):
+        manifest = self._manifest
+        if 'segments' not in manifest:
+            # written before the store had segments: a single one with everything
+            manifest['segments'] = [{'paragraphs': manifest.pop('paragraphs'),
+                                     'documents': manifest.pop('documents')}]
+
+        segments = []
+        for entry in manifest['segments']:
+            if loaded and entry['paragraphs'] in loaded:
+                segments.append(loaded[entry['paragraphs']])
+                continue
+            removed = np.load(PARAGRAPH_STORE_PATH / entry['removed'], mmap_mode='r') if 'removed' in entry \
+                else np.empty(0, np.int64)
+            segments.append(_Segment(np.load(PARAGRAPH_STORE_PATH / entry['paragraphs'], mmap_mode='r'),
+                                     np.load(PARAGRAPH_STORE_PATH / entry['documents'], mmap_mode='r'), removed))
+        self._view = _StoreView(tuple(segments), self._map_blob(manifest['blob'], manifest['blob_size']))
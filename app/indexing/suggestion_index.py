@@ -0,0 +1,228 @@
+import bisect
+import datetime
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from indexing.paragraph_store import NO_TIMESTAMP, ParagraphStore, to_microseconds
+from schemas import Document
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_KINDS = ('title', 'location', 'author')
+# suggestions older than this lose half of their recency score
+RECENCY_HALF_LIFE_DAYS = float(os.environ.get('SUGGEST_RECENCY_HALF_LIFE_DAYS', 30))
+# bounds the work of very short prefixes, which match a large part of the keys
+MAX_SCANNED_KEYS = int(os.environ.get('SUGGEST_MAX_SCANNED_KEYS', 1000))
+# the results of prefixes this short are cached until the next index update
+CACHED_PREFIX_LENGTH = 2
+MAX_TEXT_LENGTH = 200
+
+_WORD_START = re.compile(r'(?:^|(?<=[\s\-_/.:#(\[]))\w', re.UNICODE)
+_RECENCY_DECAY = math.log(2) / (RECENCY_HALF_LIFE_DAYS * 24 * 60 * 60 * 1_000_000)
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+@dataclass
+class Suggestion:
+    kind: str
+    text: str
+    # document id => (timestamp in microseconds, url, data source name)
+    documents: Dict[int, Tuple[int, Optional[str], Optional[str]]] = field(default_factory=dict)
+    latest_id: Optional[int] = None
+    # kept up to date by add and remove, so scoring is cheap
+    popularity: float = 0.0
+    latest_timestamp: int = NO_TIMESTAMP
+
+    def add(self, document_id: int, timestamp: int, url: Optional[str], data_source: Optional[str]):
+        self.documents[document_id] = (timestamp, url, data_source)
+        if self.latest_id is None or timestamp >= self.documents[self.latest_id][0]:
+            self.latest_id = document_id
+        self._update()
+
+    def remove(self, document_id: int):
+        self.documents.pop(document_id, None)
+        if document_id == self.latest_id:
+            self.latest_id = max(self.documents, key=lambda id: self.documents[id][0]) if self.documents else None
+        self._update()
+
+    def _update(self):
+        # how many documents share the value, in [0, 1)
+        self.popularity = 1 - 1 / (1 + math.log1p(len(self.documents)))
+        self.latest_timestamp = self.documents[self.latest_id][0] if self.latest_id is not None else NO_TIMESTAMP
+
+    def score(self, now: int) -> float:
+        """
+        Popularity plus the recency of the latest document, each at most 1.
+        """
+        if self.latest_timestamp == NO_TIMESTAMP:
+            return self.popularity
+        return self.popularity + math.exp(min(0, self.latest_timestamp - now) * _RECENCY_DECAY)
+
+    def to_dict(self) -> dict:
+        _, url, data_source = self.documents[self.latest_id]
+        result = {'kind': self.kind, 'text': self.text, 'documents': len(self.documents)}
+        if self.kind == 'title':
+            result['url'] = url
+            result['data_source'] = data_source
+        return result
+
+
+class SuggestionIndex:
+    """
+    Search-as-you-type suggestions over the titles, locations and authors of the documents.
+    Every word start of a value is a key into one sorted list, so a prefix (of the value or of any of its words)
+    is a binary search followed by a scan over the matching keys, ranked by popularity and recency.
+    Built from the paragraph store on startup and kept in sync by the Indexer, no model is involved.
+    """
+    instance = None
+
+    @staticmethod
+    def create():
+        if SuggestionIndex.instance is not None:
+            raise RuntimeError("Suggestion index is already initialized")
+
+        SuggestionIndex.instance = SuggestionIndex()
+
+    @staticmethod
+    def get() -> 'SuggestionIndex':
+        if SuggestionIndex.instance is None:
+            raise RuntimeError("Suggestion index is not initialized")
+        return SuggestionIndex.instance
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clear()
+        self.rebuild()
+
+    def _clear(self):
+        # sorted (key, kind, normalized value)
+        self._keys: List[Tuple[str, str, str]] = []
+        self._suggestions: Dict[Tuple[str, str], Suggestion] = {}
+        # document id => the suggestions it contributes to
+        self._document_values: Dict[int, List[Tuple[str, str]]] = {}
+        self._children: Dict[int, Set[int]] = {}
+        self._short_prefixes: Dict[Tuple[str, int, Tuple[str, ...]], List[dict]] = {}
+
+    @staticmethod
+    def _values(document) -> List[Tuple[str, str]]:
+        values = []
+        # comments repeat the title of what they comment on
+        if document.parent_id is None and document.title:
+            values.append(('title', document.title))
+        if document.location:
+            values.append(('location', document.location))
+        if document.author:
+            values.append(('author', document.author))
+        return [(kind, text.strip()[:MAX_TEXT_LENGTH]) for kind, text in values if text.strip()]
+
+    @staticmethod
+    def _word_keys(normalized: str) -> List[str]:
+        starts = {0} | {match.start() for match in _WORD_START.finditer(normalized)}
+        return [normalized[start:] for start in sorted(starts)]
+
+    def _add(self, document, data_source_name: Optional[str], sort_keys: bool):
+        self._remove(document.id)
+        self._short_prefixes.clear()
+        if document.parent_id is not None:
+            self._children.setdefault(document.parent_id, set()).add(document.id)
+
+        timestamp = to_microseconds(document.timestamp)
+        contributed = []
+        for kind, text in self._values(document):
+            normalized = normalize(text)
+            suggestion = self._suggestions.get((kind, normalized))
+            if suggestion is None:
+                suggestion = self._suggestions[(kind, normalized)] = Suggestion(kind=kind, text=text)
+                for key in self._word_keys(normalized):
+                    if sort_keys:
+                        bisect.insort(self._keys, (key, kind, normalized))
+                    else:
+                        self._keys.append((key, kind, normalized))
+            suggestion.add(document.id, timestamp, document.url, data_source_name)
+            contributed.append((kind, normalized))
+        self._document_values[document.id] = contributed
+
+    def _remove(self, document_id: int):
+        self._short_prefixes.clear()
+        for kind, normalized in self._document_values.pop(document_id, []):
+            suggestion = self._suggestions.get((kind, normalized))
+            if suggestion is None:
+                continue
+            suggestion.remove(document_id)
+            if not suggestion.documents:
+                del self._suggestions[(kind, normalized)]
+                for key in self._word_keys(normalized):
+                    i = bisect.bisect_left(self._keys, (key, kind, normalized))
+                    if i < len(self._keys) and self._keys[i] == (key, kind, normalized):
+                        del self._keys[i]
+
+    def rebuild(self):
+        """
+        Rebuilds the suggestions from the paragraph store.
+        """
+        with self._lock:
+            self._clear()
+            for document in ParagraphStore.get().all_documents():
+                self._add(document, document.data_source_name, sort_keys=False)
+            self._keys.sort()
+        logger.info(f'Built the suggestion index with {len(self._suggestions)} suggestions')
+
+    def add_documents(self, documents: List[Document]):
+        with self._lock:
+            for document in documents:
+                data_source_name = document.data_source.type.name if document.data_source is not None else None
+                self._add(document, data_source_name, sort_keys=True)
+
+    def remove_documents(self, document_ids: List[int]):
+        """
+        Removes the documents and their children.
+        """
+        with self._lock:
+            for document_id in document_ids:
+                for child_id in self._children.pop(document_id, set()):
+                    self._remove(child_id)
+                self._remove(document_id)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def suggest(self, prefix: str, limit: int = 10, kinds: Optional[List[str]] = None) -> List[dict]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        cache_key = (prefix, limit, tuple(sorted(kinds or ())))
+        now = to_microseconds(datetime.datetime.utcnow())
+        # (kind, normalized value) => whether the prefix matches the start of the value
+        matches: Dict[Tuple[str, str], bool] = {}
+        with self._lock:
+            if cache_key in self._short_prefixes:
+                return list(self._short_prefixes[cache_key])
+
+            start = bisect.bisect_left(self._keys, (prefix,))
+            for key, kind, normalized in self._keys[start:start + MAX_SCANNED_KEYS]:
+                if not key.startswith(prefix):
+                    break
+                if not kinds or kind in kinds:
+                    matches[(kind, normalized)] = matches.get((kind, normalized), False) or key == normalized
+
+            # matching the start of the value beats matching one of its words
+            top = heapq.nlargest(limit, matches.items(),
+                                 key=lambda item: self._suggestions[item[0]].score(now) + item[1])
+            results = [self._suggestions[suggestion_key].to_dict() for suggestion_key, _ in top]
+            if len(prefix) <= CACHED_PREFIX_LENGTH:
+                self._short_prefixes[cache_key] = results
+            return results
+
+    def __len__(self) -> int:
+        return len(self._suggestions)
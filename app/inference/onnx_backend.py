@@ -0,0 +1,148 @@
+"""
+ONNX Runtime inference backend, enabled with INFERENCE_BACKEND=onnx (see models.py).
+On first use every model is exported to ONNX, dynamically quantized to int8 and saved under ONNX_MODELS_PATH,
+the wrappers below mimic the parts of the sentence-transformers / transformers APIs the search code uses.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import List, Tuple, Type, Union
+
+import numpy as np
+import onnxruntime
+import torch
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForQuestionAnswering, \
+    ORTModelForSequenceClassification, ORTQuantizer, ORTModel
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer, pipeline
+
+from paths import ONNX_MODELS_PATH
+
+logger = logging.getLogger(__name__)
+
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', os.cpu_count() or 1))
+# one of avx2, avx512, avx512_vnni, arm64 (the instruction set to quantize for), or none to skip quantization
+ONNX_QUANTIZATION = os.environ.get('ONNX_QUANTIZATION', 'avx2')
+QUANTIZED_FILE_NAME = 'model_quantized.onnx'
+
+
+def _session_options() -> onnxruntime.SessionOptions:
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    # parallelism comes from the intra-op threads, concurrent requests are batched by the inference schedulers
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def _export(model_name: str, model_class: Type[ORTModel]) -> Tuple[Path, str]:
+    """
+    Exports (and quantizes) the model once, returns the directory and the file name of the ONNX model.
+    """
+    export_path = ONNX_MODELS_PATH / model_name.replace('/', '__')
+    quantized_path = export_path / 'quantized'
+
+    if ONNX_QUANTIZATION == 'none':
+        if not (export_path / 'model.onnx').exists():
+            logger.info(f'Exporting {model_name} to ONNX...')
+            model_class.from_pretrained(model_name, export=True).save_pretrained(export_path)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_path)
+        return export_path, 'model.onnx'
+
+    if not (quantized_path / QUANTIZED_FILE_NAME).exists():
+        if not (export_path / 'model.onnx').exists():
+            logger.info(f'Exporting {model_name} to ONNX...')
+            model_class.from_pretrained(model_name, export=True).save_pretrained(export_path)
+        logger.info(f'Quantizing {model_name} for {ONNX_QUANTIZATION}...')
+        quantization_config = getattr(AutoQuantizationConfig, ONNX_QUANTIZATION)(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(export_path).quantize(save_dir=quantized_path,
+                                                           quantization_config=quantization_config)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(quantized_path)
+    return quantized_path, QUANTIZED_FILE_NAME
+
+
+def _load(model_name: str, model_class: Type[ORTModel]):
+    path, file_name = _export(model_name, model_class)
+    model = model_class.from_pretrained(path, file_name=file_name, session_options=_session_options(),
+                                        provider='CPUExecutionProvider')
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    return model, tokenizer
+
+
+class OnnxBiEncoder:
+    """
+    Drop-in for SentenceTransformer.encode of a mean-pooled, normalized model (like multi-qa-MiniLM-L6-cos-v1).
+    """
+
+    def __init__(self, model_name: str, max_seq_length: int = 512) -> None:
+        self.model, self.tokenizer = _load(model_name, ORTModelForFeatureExtraction)
+        self.config = self.model.config
+        self.max_seq_length = max_seq_length
+
+    def _encode_batch(self, sentences: List[str]) -> torch.Tensor:
+        features = self.tokenizer(sentences, padding=True, truncation=True, max_length=self.max_seq_length,
+                                  return_tensors='pt')
+        token_embeddings = self.model(**features).last_hidden_state
+        mask = features['attention_mask'].unsqueeze(-1).to(token_embeddings.dtype)
+        embeddings = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(embeddings, p=2, dim=1)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_tensor: bool = False,
+               show_progress_bar: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # sort by length, so every batch pads to a similar length
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            for i, embedding in zip(batch, self._encode_batch([sentences[i] for i in batch])):
+                embeddings[i] = embedding
+
+        result = torch.stack(embeddings) if embeddings else torch.empty(0, self.config.hidden_size)
+        if single:
+            result = result[0]
+        return result if convert_to_tensor else result.numpy()
+
+
+class OnnxCrossEncoder:
+    """
+    Drop-in for sentence_transformers.CrossEncoder.predict.
+    """
+
+    def __init__(self, model_name: str) -> None:
+        self.model, self.tokenizer = _load(model_name, ORTModelForSequenceClassification)
+        self.config = self.model.config
+        # same default as CrossEncoder: a sigmoid for single-label models, unless the model config says otherwise
+        activation = getattr(self.config, 'sbert_ce_default_activation_function', None)
+        if activation is not None:
+            self._apply_sigmoid = activation.endswith('Sigmoid')
+        else:
+            self._apply_sigmoid = self.config.num_labels == 1
+
+    def predict(self, sentences: List[Tuple[str, str]], batch_size: int = 32, show_progress_bar: bool = False,
+                **kwargs) -> np.ndarray:
+        scores = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            features = self.tokenizer([query for query, _ in batch], [text for _, text in batch], padding=True,
+                                      truncation='longest_first', return_tensors='pt')
+            logits = self.model(**features).logits
+            if self._apply_sigmoid:
+                logits = torch.sigmoid(logits)
+            scores.append(logits[:, 0] if self.config.num_labels == 1 else logits)
+
+        if not scores:
+            return np.array([], dtype=np.float32)
+        return torch.cat(scores).detach().numpy()
+
+
+def onnx_qa_pipeline(model_name: str):
+    """
+    A transformers question-answering pipeline running on the ONNX model, so pre/post-processing stays the same.
+    """
+    model, tokenizer = _load(model_name, ORTModelForQuestionAnswering)
+    return pipeline('question-answering', model=model, tokenizer=tokenizer)
@@ -0,0 +1,132 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _InferenceRequest:
+    items: list
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching for a model shared by concurrent searches.
+    Requests are collected for up to max_wait_ms (or until max_batch_size items are pending),
+    then all their items are sorted by length, run as padded batches of up to max_batch_size,
+    and every caller gets back the outputs of its own items, in order.
+    """
+
+    def __init__(self, name: str, predict: Callable[[list], list], length: Callable[[Any], int],
+                 max_batch_size: int, max_wait_ms: float) -> None:
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._predict = predict
+        self._length = length
+        self._queue: 'queue.Queue[_InferenceRequest]' = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._pending_items = 0
+        self._requests = 0
+        self._batches = 0
+        self._items = 0
+        self._total_wait_ms = 0.0
+
+    def submit(self, items: list) -> Future:
+        request = _InferenceRequest(items=items)
+        if len(items) == 0:
+            request.future.set_result([])
+            return request.future
+
+        self._ensure_started()
+        with self._stats_lock:
+            self._pending_items += len(items)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, items: list) -> list:
+        return self.submit(items).result()
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'inference-{self.name}', daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_InferenceRequest]:
+        requests = [self._queue.get()]
+        count = len(requests[0].items)
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            count += len(request.items)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            try:
+                self._process(requests)
+            except Exception as e:
+                logger.exception(f'Inference scheduler {self.name} failed')
+                for request in requests:
+                    if not request.future.done():
+                        with self._stats_lock:
+                            self._pending_items -= len(request.items)
+                        request.future.set_exception(e)
+
+    def _process(self, requests: List[_InferenceRequest]):
+        started_at = time.monotonic()
+        # (request index, item index) of every item, sorted by length so each batch pads to a similar length
+        positions = [(request_index, item_index)
+                     for request_index, request in enumerate(requests)
+                     for item_index in range(len(request.items))]
+        positions.sort(key=lambda position: self._length(requests[position[0]].items[position[1]]))
+
+        outputs = [[None] * len(request.items) for request in requests]
+        for start in range(0, len(positions), self.max_batch_size):
+            batch = positions[start:start + self.max_batch_size]
+            batch_outputs = self._predict([requests[r].items[i] for r, i in batch])
+            for (r, i), output in zip(batch, batch_outputs):
+                outputs[r][i] = output
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+
+        for request, request_outputs in zip(requests, outputs):
+            with self._stats_lock:
+                self._pending_items -= len(request.items)
+                self._requests += 1
+                self._total_wait_ms += (started_at - request.enqueued_at) * 1000
+            request.future.set_result(request_outputs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_depth': self._queue.qsize(),
+                'pending_items': self._pending_items,
+                'requests': self._requests,
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch_fill': self._items / (self._batches * self.max_batch_size) if self._batches else 0.0,
+                'avg_wait_ms': self._total_wait_ms / self._requests if self._requests else 0.0
+            }
@@ -0,0 +1,49 @@
+import os
+from typing import Any, Dict, Tuple
+
+from inference.scheduler import InferenceScheduler
+from models import cross_encoder_small, cross_encoder_large, qa_model
+
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+CROSS_ENCODER_BATCH_SIZE = int(os.environ.get('CROSS_ENCODER_BATCH_SIZE', 32))
+QA_BATCH_SIZE = int(os.environ.get('QA_BATCH_SIZE', 16))
+
+
+def _pair_length(pair: Tuple[str, str]) -> int:
+    return len(pair[0]) + len(pair[1])
+
+
+def _cross_encoder_predict(cross_encoder):
+    def predict(pairs: list) -> list:
+        scores = cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return [score.item() for score in scores]
+
+    return predict
+
+
+def _qa_predict(pairs: list) -> list:
+    answers = qa_model(question=[question for question, _ in pairs], context=[context for _, context in pairs],
+                       batch_size=len(pairs))
+    if type(answers) == dict:
+        answers = [answers]
+    return answers
+
+
+cross_encoder_small_scheduler = InferenceScheduler('cross_encoder_small', _cross_encoder_predict(cross_encoder_small),
+                                                   length=_pair_length, max_batch_size=CROSS_ENCODER_BATCH_SIZE,
+                                                   max_wait_ms=INFERENCE_MAX_WAIT_MS)
+cross_encoder_large_scheduler = InferenceScheduler('cross_encoder_large', _cross_encoder_predict(cross_encoder_large),
+                                                   length=_pair_length, max_batch_size=CROSS_ENCODER_BATCH_SIZE,
+                                                   max_wait_ms=INFERENCE_MAX_WAIT_MS)
+qa_scheduler = InferenceScheduler('qa_model', _qa_predict, length=_pair_length, max_batch_size=QA_BATCH_SIZE,
+                                  max_wait_ms=INFERENCE_MAX_WAIT_MS)
+
+CROSS_ENCODER_SCHEDULERS = {
+    cross_encoder_small: cross_encoder_small_scheduler,
+    cross_encoder_large: cross_encoder_large_scheduler
+}
+
+
+def get_stats() -> Dict[str, Any]:
+    return {scheduler.name: scheduler.stats()
+            for scheduler in [cross_encoder_small_scheduler, cross_encoder_large_scheduler, qa_scheduler]}
@@ -8,6 +8,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_restful.tasks import repeat_every
 from starlette.responses import Response, FileResponse
 
+from api.avatars import router as avatars_router
 from api.data_source import router as data_source_router
 from api.search import router as search_router
 from data_source.api.exception import KnownException
@@ -17,10 +18,18 @@ from db_engine import Session
 from indexing.background_indexer import BackgroundIndexer
 from indexing.bm25_index import Bm25Index
 from indexing.faiss_index import FaissIndex
+from indexing.facet_index import FacetIndex
+from indexing.index_generation import IndexGeneration
+from indexing.lookup_index import LookupIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore
+from indexing.suggestion_index import SuggestionIndex
+import models
 from queues.index_queue import IndexQueue
 from paths import UI_PATH
 from queues.task_queue import TaskQueue
 from schemas import DataSource
+from searching.pagination import SearchCursors
 from schemas.document import Document
 from schemas.paragraph import Paragraph
 from workers import Workers
@@ -57,6 +66,7 @@ app.add_middleware(
 )
 app.include_router(search_router, prefix="/api/v1")
 app.include_router(data_source_router, prefix="/api/v1")
+app.include_router(avatars_router, prefix="/api/v1")
 
 
 def _check_for_new_documents(force=False):
@@ -112,8 +122,15 @@ def send_daily_telemetry():
 async def startup_event():
     if not torch.cuda.is_available():
         logger.warning("CUDA is not available, using CPU. This will make indexing and search very slow!!!")
+    # the models load in the background, /api/v1/ready reports when they are done
+    models.warm_up()
     FaissIndex.create()
     Bm25Index.create()
+    ParagraphStore.create()
+    MetadataIndex.create()
+    FacetIndex.create()
+    SuggestionIndex.create()
+    LookupIndex.create()
     DataSourceContext.init()
     BackgroundIndexer.start()
     Workers.start()
@@ -138,10 +155,28 @@ def status():
                   docs_indexed=BackgroundIndexer.get_indexed_count())
 
 
+@app.get("/api/v1/ready")
+def ready(response: Response):
+    indexes = (FaissIndex, Bm25Index, ParagraphStore, MetadataIndex, FacetIndex, SuggestionIndex,
+               LookupIndex)
+    indexes_loaded = all(index.instance is not None for index in indexes)
+    is_ready = indexes_loaded and models.is_ready()
+    if not is_ready:
+        response.status_code = 503
+    return {'ready': is_ready, 'indexes_loaded': indexes_loaded, 'models': models.get_status()}
+
+
 @app.post("/clear-index")
 async def clear_index():
     FaissIndex.get().clear()
     Bm25Index.get().clear()
+    ParagraphStore.get().clear()
+    MetadataIndex.get().clear()
+    FacetIndex.get().clear()
+    SuggestionIndex.get().clear()
+    LookupIndex.get().clear()
+    SearchCursors.clear()
+    IndexGeneration.bump()
     with Session() as session:
         session.query(Document).delete()
         session.query(Paragraph).delete()
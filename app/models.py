@@ -1,11 +1,131 @@
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from transformers import pipeline
-import torch
+"""
+The models are loaded lazily: importing this module is cheap, each model is loaded on first use,
+and warm_up() loads all of them in a background thread right after the server starts.
+Model weights are read through safetensors where the checkpoint provides them, which memory-maps the files.
 
+Keep this module free of app imports at the top level - the Dockerfile runs it standalone to cache the models.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List
 
-bi_encoder = SentenceTransformer('multi-qa-MiniLM-L6-cos-v1')
+logger = logging.getLogger(__name__)
 
-cross_encoder_small = CrossEncoder('cross-encoder/ms-marco-TinyBERT-L-2-v2')
-cross_encoder_large = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+# torch or onnx (quantized ONNX Runtime models, see inference/onnx_backend.py)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
 
-qa_model = pipeline('question-answering', model='deepset/roberta-base-squad2')
+
+class LazyModel:
+    """
+    Stands in for the model: attribute access and calls are forwarded to it, loading it on first use.
+    """
+
+    def __init__(self, name: str, load: Callable) -> None:
+        self.name = name
+        self._load = load
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = self._load()
+                    logger.info(f'Loaded {self.name} in {time.perf_counter() - start:.1f}s')
+        return self._model
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+        return getattr(self.get(), item)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+def _load_bi_encoder():
+    if INFERENCE_BACKEND == 'onnx':
+        from inference.onnx_backend import OnnxBiEncoder
+        return OnnxBiEncoder('sentence-transformers/multi-qa-MiniLM-L6-cos-v1')
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('multi-qa-MiniLM-L6-cos-v1')
+
+
+def _load_cross_encoder(model_name: str):
+    if INFERENCE_BACKEND == 'onnx':
+        from inference.onnx_backend import OnnxCrossEncoder
+        return OnnxCrossEncoder(model_name)
+
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name)
+
+
+def _load_qa_model():
+    if INFERENCE_BACKEND == 'onnx':
+        from inference.onnx_backend import onnx_qa_pipeline
+        return onnx_qa_pipeline('deepset/roberta-base-squad2')
+
+    from transformers import pipeline
+    return pipeline('question-answering', model='deepset/roberta-base-squad2')
+
+
+bi_encoder = LazyModel('bi_encoder', _load_bi_encoder)
+
+cross_encoder_small = LazyModel('cross_encoder_small',
+                                lambda: _load_cross_encoder('cross-encoder/ms-marco-TinyBERT-L-2-v2'))
+cross_encoder_large = LazyModel('cross_encoder_large',
+                                lambda: _load_cross_encoder('cross-encoder/ms-marco-MiniLM-L-6-v2'))
+
+qa_model = LazyModel('qa_model', _load_qa_model)
+
+# in warm up order: the bi-encoder is needed by both indexing and search, the QA model only by the last stage
+ALL_MODELS: List[LazyModel] = [bi_encoder, cross_encoder_small, cross_encoder_large, qa_model]
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def _load_all():
+    for model in ALL_MODELS:
+        try:
+            model.get()
+        except Exception:
+            logger.exception(f'Failed to load {model.name}')
+            return
+    _ready.set()
+
+
+def warm_up():
+    """
+    Starts loading the models in the background, returns immediately.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_load_all, name='models-warm-up', daemon=True)
+            _warm_up_thread.start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def wait_until_ready(timeout: float = None) -> bool:
+    return _ready.wait(timeout)
+
+
+def get_status() -> Dict[str, bool]:
+    return {model.name: model.loaded for model in ALL_MODELS}
+
+
+if __name__ == '__main__':
+    _load_all()
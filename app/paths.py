@@ -16,5 +16,11 @@ SQLITE_DB_PATH = STORAGE_PATH / 'db.sqlite3'
 SQLITE_TASKS_PATH = STORAGE_PATH / 'tasks.sqlite3'
 SQLITE_INDEXING_PATH = STORAGE_PATH / 'indexing.sqlite3'
 FAISS_INDEX_PATH = str(STORAGE_PATH / 'faiss_index.bin')
+# the pickled index of previous versions, converted to BM25_INDEX_DIR on startup
 BM25_INDEX_PATH = str(STORAGE_PATH / 'bm25_index.bin')
+BM25_INDEX_DIR = STORAGE_PATH / 'bm25'
 UUID_PATH = str(STORAGE_PATH / '.uuid')
+ONNX_MODELS_PATH = STORAGE_PATH / 'onnx'
+CONNECTORS_MANIFEST_PATH = STORAGE_PATH / 'connectors_manifest.json'
+PARAGRAPH_STORE_PATH = STORAGE_PATH / 'paragraph_store'
+AVATARS_PATH = STORAGE_PATH / 'avatars'
@@ -2,3 +2,4 @@ from schemas.data_source_type import DataSourceType
 from schemas.data_source import DataSource
 from schemas.document import Document
 from schemas.paragraph import Paragraph
+from schemas.slow_query import SlowQuery
@@ -0,0 +1,23 @@
+from typing import Optional
+
+from sqlalchemy import String, DateTime, Float, Integer, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from schemas.base import Base
+
+
+class SlowQuery(Base):
+    __tablename__ = 'slow_query'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    query: Mapped[str] = mapped_column(String(512))
+    endpoint: Mapped[str] = mapped_column(String(32))
+    mode: Mapped[Optional[str]] = mapped_column(String(32))
+    top_k: Mapped[Optional[int]] = mapped_column(Integer())
+    elapsed_ms: Mapped[float] = mapped_column(Float(), index=True)
+    budget_ms: Mapped[Optional[float]] = mapped_column(Float())
+    # JSON objects of stage => candidates / milliseconds / skip reason
+    candidates: Mapped[str] = mapped_column(Text())
+    timings_ms: Mapped[str] = mapped_column(Text())
+    skipped: Mapped[str] = mapped_column(Text())
+    created_at: Mapped[DateTime] = mapped_column(DateTime(), index=True)
@@ -1,33 +1,71 @@
+import asyncio
 import datetime
-import json
+import os
 import logging
 import re
+import time
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Tuple
 
-import nltk
+import numpy as np
 import torch
-from sentence_transformers import CrossEncoder
 
 from data_source.api.basic_document import DocumentType, FileType, DocumentStatus
-from data_source.api.utils import get_confluence_user_image
-from db_engine import Session
+from data_source.api.avatar_cache import AvatarCache
 from indexing.bm25_index import Bm25Index
+from indexing.facet_index import FacetIndex
 from indexing.faiss_index import FaissIndex
-from models import bi_encoder, cross_encoder_small, cross_encoder_large, qa_model
-from schemas import Paragraph, Document
+from indexing.lookup_index import LookupIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore, StoredDocument, StoredParagraph
+from inference.schedulers import CROSS_ENCODER_SCHEDULERS, qa_scheduler
+from models import LazyModel, bi_encoder, cross_encoder_small, cross_encoder_large
+from searching.budget import SearchPreset, StageCosts, SETTLED_SCORE_GAP, get_preset
+from searching.cache import SearchCache
+from searching.collapse import collapse
+from searching import fusion
+from searching.filters import SearchFilter
+from searching.pagination import CursorEntry, SearchCursors
+from searching.query_router import QueryRoute, RoutedQuery, route_query
+from searching.semantic_cache import SemanticQueryCache
+from searching.trace import SearchTrace
+from searching.windowing import PASSAGE_WINDOWING, PASSAGE_WINDOW_CHARS, best_window
 from util import threaded_method
 
 BM_25_CANDIDATES = 100 if torch.cuda.is_available() else 5   #  20
 BI_ENCODER_CANDIDATES = 60 if torch.cuda.is_available() else 5     # 20
 SMALL_CROSS_ENCODER_CANDIDATES = 30 if torch.cuda.is_available() else 5
+# used when no search mode is given
+DEFAULT_PRESET = SearchPreset(name='default', bm25_candidates=BM_25_CANDIDATES,
+                              bi_encoder_candidates=BI_ENCODER_CANDIDATES,
+                              small_cross_encoder_candidates=SMALL_CROSS_ENCODER_CANDIDATES)
+# routed queries are scored on the cross-encoder scale: exact lookups in
+# [LOOKUP_SCORE, LOOKUP_SCORE + LEXICAL_SCORE_RANGE], BM25 hits right below them
+LOOKUP_SCORE = 10.0
+LEXICAL_SCORE_RANGE = 2.0
+# how many reranked candidates a paginated search keeps for its later pages
+PAGINATION_DEPTH = int(os.environ.get('SEARCH_PAGINATION_DEPTH', 50))
+
+# the async search path runs its inference calls here, so they never block the event loop.
+# the cross-encoder and QA forward passes themselves happen on the inference schedulers' threads.
+INFERENCE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get('INFERENCE_WORKERS', 8)),
+                                        thread_name_prefix='inference')
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get('RETRIEVAL_WORKERS', 8)),
+                                        thread_name_prefix='retrieval')
 
-nltk.download('punkt')
 logger = logging.getLogger(__name__)
 
+# (stage, candidates of every query) => None
+StageCallback = Callable[[str, List[List['Candidate']]], None]
+
 
 @dataclass
 class TextPart:
@@ -50,18 +88,30 @@ class SearchResult:
     status: str
     is_active: bool
     author_image_url: Optional[str]
-    author_image_data: Optional[str]
     child: Optional['SearchResult'] = None
+    # lets the UI fetch the answer span later (see find_answer), when searching with lazy answers
+    paragraph_id: Optional[int] = None
+
+
+@dataclass
+class AnswerSpan:
+    paragraph_id: int
+    content: List[TextPart]
+    url: str
 
 
 @dataclass
 class Candidate:
     content: str
     score: float = 0.0
-    document: Document = None
+    document: StoredDocument = None
+    paragraph_id: int = None
     answer_start: int = -1
     answer_end: int = -1
     parent: 'Candidate' = None
+    # the part of the content the large cross-encoder and QA read (see searching.windowing), -1 until assigned
+    window_start: int = 0
+    window_end: int = -1
 
     def _text_anchor(self, url, text) -> str:
         if '#' not in url:
@@ -78,6 +128,21 @@ class Candidate:
             url += urllib.parse.quote(text).replace('-', '%2D')
         return url
 
+    def _content_parts(self) -> List[TextPart]:
+        answer = TextPart(self.content[self.answer_start: self.answer_end], True)
+        content = [answer]
+
+        if self.answer_end < len(self.content) - 1:
+            words = self.content[self.answer_end:].split()
+            suffix = ' '.join(words[:20])
+            content.append(TextPart(suffix, False))
+        return content
+
+    def to_answer_span(self) -> AnswerSpan:
+        content = self._content_parts()
+        return AnswerSpan(paragraph_id=self.paragraph_id, content=content,
+                          url=self._text_anchor(self.document.url, content[0].content))
+
     @threaded_method
     def to_search_result(self) -> SearchResult:
         parent_result = None
@@ -88,33 +153,26 @@ class Candidate:
         elif self.document.parent_id is not None:
             parent_result = Candidate(content="", score=self.score, document=self.document.parent).to_search_result()
 
-        answer = TextPart(self.content[self.answer_start: self.answer_end], True)
-        content = [answer]
+        content = self._content_parts()
+        answer = content[0]
 
-        if self.answer_end < len(self.content) - 1:
-            words = self.content[self.answer_end:].split()
-            suffix = ' '.join(words[:20])
-            content.append(TextPart(suffix, False))
-
-        data_uri = None
-        if self.document.data_source.type.name == 'confluence':
-            config = json.loads(self.document.data_source.config)
-            data_uri = get_confluence_user_image(self.document.author_image_url, config['token'])
+        # images the connector cached while indexing are served by the avatars endpoint
+        author_image_url = AvatarCache.url_for(self.document.author_image_url) or self.document.author_image_url
 
         result = SearchResult(score=(self.score + 12) / 24 * 100,
                               content=content,
                               author=self.document.author,
-                              author_image_url=self.document.author_image_url,
-                              author_image_data=data_uri,
+                              author_image_url=author_image_url,
                               title=self.document.title,
                               url=self._text_anchor(self.document.url, answer.content),
                               time=self.document.timestamp,
                               location=self.document.location,
-                              data_source=self.document.data_source.type.name,
+                              data_source=self.document.data_source_name,
                               type=self.document.type,
                               file_type=self.document.file_type,
                               status=self.document.status,
-                              is_active=self.document.is_active)
+                              is_active=self.document.is_active,
+                              paragraph_id=self.paragraph_id)
 
         if parent_result is not None:
             parent_result.child = result
@@ -123,33 +181,94 @@ class Candidate:
             return result
 
 
+def _candidate_text(candidate: Candidate, use_answer: bool, use_titles: bool, use_window: bool = False) -> str:
+    if use_answer:
+        content = candidate.content[candidate.answer_start:candidate.answer_end]
+    elif use_window and candidate.window_end >= 0:
+        content = candidate.content[candidate.window_start:candidate.window_end]
+    else:
+        content = candidate.content
+
+    if use_titles:
+        content = content + ' [SEP] ' + candidate.document.title
+    return content
+
+
+def _predict_packed(cross_encoder: LazyModel, pairs: List[Tuple[str, str]]) -> List[float]:
+    """
+    Scores the pairs through the model's inference scheduler, which packs them with the pairs of
+    concurrent searches into length-sorted padded batches and returns the scores in the original order.
+    """
+    return CROSS_ENCODER_SCHEDULERS[cross_encoder].predict(pairs)
+
+
+def _cross_encode_batch(
+        cross_encoder: LazyModel,
+        queries: List[str],
+        candidate_lists: List[List[Candidate]],
+        top_k: int,
+        use_answer: bool = False,
+        use_titles: bool = False,
+        use_window: bool = False) -> List[List[Candidate]]:
+    generation = SearchCache.generation()
+    mode = f'{cross_encoder.config.name_or_path}:answer={use_answer}:titles={use_titles}'
+    if use_window:
+        mode += f':window={PASSAGE_WINDOW_CHARS}'
+
+    # only score the pairs that are not cached yet
+    missing_keys = []
+    missing_pairs = []
+    for query, candidates in zip(queries, candidate_lists):
+        normalized_query = SearchCache.normalize_query(query)
+        for candidate in candidates:
+            key = (generation, normalized_query, candidate.paragraph_id, mode)
+            cached_score = SearchCache.scores.get(key) if candidate.paragraph_id is not None else None
+            if cached_score is not None:
+                candidate.score = cached_score
+            else:
+                missing_keys.append((key, candidate))
+                missing_pairs.append((query, _candidate_text(candidate, use_answer, use_titles, use_window)))
+
+    for (key, candidate), score in zip(missing_keys, _predict_packed(cross_encoder, missing_pairs)):
+        candidate.score = score
+        if candidate.paragraph_id is not None:
+            SearchCache.scores.put(key, score)
+
+    results = []
+    for candidates in candidate_lists:
+        candidates.sort(key=lambda c: c.score, reverse=True)
+        results.append(candidates[:top_k])
+    return results
+
+
 def _cross_encode(
-        cross_encoder: CrossEncoder,
+        cross_encoder: LazyModel,
         query: str,
         candidates: List[Candidate],
         top_k: int,
         use_answer: bool = False,
         use_titles: bool = False) -> List[Candidate]:
-    if use_answer:
-        contents = [candidate.content[candidate.answer_start:candidate.answer_end] for candidate in candidates]
-    else:
-        contents = [candidate.content for candidate in candidates]
+    return _cross_encode_batch(cross_encoder, [query], [candidates], top_k,
+                               use_answer=use_answer, use_titles=use_titles)[0]
 
-    if use_titles:
-        contents = [
-            content + ' [SEP] ' + candidate.document.title
-            for content, candidate in zip(contents, candidates)
-        ]
 
-    scores = cross_encoder.predict([(query, content) for content in contents], show_progress_bar=False)
-    for candidate, score in zip(candidates, scores):
-        candidate.score = score.item()
-    candidates.sort(key=lambda c: c.score, reverse=True)
-    return candidates[:top_k]
+def _assign_windows(queries: List[str], candidate_lists: List[List[Candidate]]):
+    """
+    Picks the window of each candidate that matches its query best, unless it already has one.
+    """
+    for query, candidates in zip(queries, candidate_lists):
+        for candidate in candidates:
+            if candidate.window_end < 0:
+                if PASSAGE_WINDOWING:
+                    candidate.window_start, candidate.window_end = best_window(candidate.content, query)
+                else:
+                    candidate.window_start, candidate.window_end = 0, len(candidate.content)
 
 
 def _assign_answer_sentence(candidate: Candidate, answer: str):
-    paragraph_sentences = re.split(r'([\.\!\?\:\-] |[\"“\(\)])', candidate.content)
+    # the answer was found in the window, look for it there first
+    window_start = max(candidate.window_start, 0)
+    paragraph_sentences = re.split(r'([\.\!\?\:\-] |[\"“\(\)])', candidate.content[window_start:])
     sentence = None
     for i, paragraph_sentence in enumerate(paragraph_sentences):
         if answer in paragraph_sentence:
@@ -157,70 +276,687 @@ def _assign_answer_sentence(candidate: Candidate, answer: str):
             break
     else:
         sentence = answer
-    start = candidate.content.find(sentence)
+    start = candidate.content.find(sentence, window_start)
+    if start == -1:
+        start = candidate.content.find(sentence)
     end = start + len(sentence)
     candidate.answer_start = start
     candidate.answer_end = end
 
 
-def _find_answers_in_candidates(candidates: List[Candidate], query: str) -> List[Candidate]:
-    contexts = [candidate.content for candidate in candidates]
-    answers = qa_model(question=[query] * len(contexts), context=contexts)
+def _find_answers_in_candidates_batch(queries: List[str],
+                                     candidate_lists: List[List[Candidate]]) -> List[List[Candidate]]:
+    pairs = [(query, candidate) for query, candidates in zip(queries, candidate_lists) for candidate in candidates]
+    if len(pairs) == 0:
+        return candidate_lists
 
-    if type(answers) == dict:
-        answers = [answers]
+    _assign_windows(queries, candidate_lists)
+    answers = qa_scheduler.predict([(query, candidate.content[candidate.window_start:candidate.window_end])
+                                    for query, candidate in pairs])
 
-    for candidate, answer in zip(candidates, answers):
+    for (_, candidate), answer in zip(pairs, answers):
         _assign_answer_sentence(candidate, answer['answer'])
 
+    return candidate_lists
+
+
+def _find_answers_in_candidates(candidates: List[Candidate], query: str) -> List[Candidate]:
+    return _find_answers_in_candidates_batch([query], [candidates])[0]
+
+
+def _encode_queries(queries: List[str]) -> torch.Tensor:
+    normalized_queries = [SearchCache.normalize_query(query) for query in queries]
+    embeddings = [SearchCache.embeddings.get(query) for query in normalized_queries]
+
+    # Encode all the queries that are not cached as one matrix
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        new_embeddings = bi_encoder.encode([queries[i] for i in missing], convert_to_tensor=True,
+                                           show_progress_bar=False)
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+            SearchCache.embeddings.put(normalized_queries[i], embedding)
+
+    return torch.stack(embeddings)
+
+
+def _fuse_retrieved(vector_scores: np.ndarray, vector_ids: np.ndarray, bm25_hits: List[Tuple[int, float]],
+                    preset: SearchPreset) -> Tuple[List[int], int]:
+    """
+    Fuses the bi-encoder and BM25 hits of a query, returns the ids worth reranking and how many unique ids
+    there were before the cut.
+    """
+    vector_hits = [(int(id), float(score)) for id, score in zip(vector_ids, vector_scores)
+                   if id != -1]  # filter out empty results
+    # BM25 fills up top_k with paragraphs sharing no term with the query
+    bm25_hits = [(id, score) for id, score in bm25_hits if score > 0]
+    fused = fusion.fuse(vector_hits, bm25_hits)
+    kept = fusion.cut(fused, preset.small_cross_encoder_candidates,
+                      preset.bi_encoder_candidates + preset.bm25_candidates)
+    return [id for id, _ in kept], len(fused)
+
+
+def _allowed_ids(search_filter: Optional[SearchFilter]) -> Optional[np.ndarray]:
+    """
+    The paragraph ids the filter allows, None when there's nothing to filter.
+    """
+    if search_filter is None or search_filter.is_empty:
+        return None
+    return MetadataIndex.get().matching_ids(search_filter)
+
+
+def _retrieve_batch(queries: List[str], preset: SearchPreset, allowed_ids: Optional[np.ndarray] = None,
+                    trace: Optional[SearchTrace] = None) -> List[List[int]]:
+    """
+    The fused first-stage candidates of every query, records the 'retrieval' and 'fusion' stages in trace.
+    """
+    trace = trace or SearchTrace()
+    with trace.timed('query_encoding'):
+        query_embeddings = _encode_queries(queries)
+
+    # Search the index for candidates of every query at once
+    with trace.timed('faiss'):
+        scores, rows = FaissIndex.get().search_with_scores(query_embeddings, preset.bi_encoder_candidates,
+                                                           allowed_ids=allowed_ids)
+
+    bm25_index = Bm25Index.get()
+    with trace.timed('bm25'):
+        bm25_rows = [bm25_index.search_with_scores(query, preset.bm25_candidates, allowed_ids) for query in queries]
+
+    with trace.timed('fusion'):
+        fused = [_fuse_retrieved(row_scores, row, bm25_hits, preset)
+                 for row_scores, row, bm25_hits in zip(scores, rows, bm25_rows)]
+    trace.ran('retrieval', sum(retrieved for _, retrieved in fused))
+    trace.ran('fusion', sum(len(ids) for ids, _ in fused))
+    return [ids for ids, _ in fused]
+
+
+def _attach_parents(candidates: List[Candidate]) -> List[Candidate]:
+    for possible_child in candidates:
+        if possible_child.document.parent_id is not None:
+            for possible_parent in candidates:
+                if possible_parent.document.id == possible_child.document.parent_id:
+                    possible_child.parent = possible_parent
+                    candidates.remove(possible_parent)
+                    break
+    return candidates
+
+
+def _count(candidate_lists: List[List[Candidate]]) -> int:
+    return sum(len(candidates) for candidates in candidate_lists)
+
+
+def _is_settled(candidates: List[Candidate], top_k: int) -> bool:
+    """
+    Whether the order of the top_k candidates can no longer change, because every consecutive score gap
+    among them (and to the first candidate after them) is bigger than SETTLED_SCORE_GAP.
+    """
+    scores = [candidate.score for candidate in candidates[:top_k + 1]]
+    return all(higher - lower >= SETTLED_SCORE_GAP for higher, lower in zip(scores, scores[1:]))
+
+
+def _assign_lexical_answer(candidate: Candidate, query: str):
+    """
+    A cheap stand-in for answer extraction: highlights the sentence sharing the most words with the query.
+    """
+    query_words = {word for word in re.findall(r'\w+', query.lower()) if len(word) > 2}
+    best_sentence, best_overlap = None, 0
+    for sentence in re.split(r'([\.\!\?\:\-] |[\"“\(\)])', candidate.content):
+        if len(sentence.strip()) < 2:
+            continue
+        if best_sentence is None:
+            best_sentence = sentence
+        overlap = len(query_words & set(re.findall(r'\w+', sentence.lower())))
+        if overlap > best_overlap:
+            best_sentence, best_overlap = sentence, overlap
+
+    if best_sentence is None:
+        candidate.answer_start, candidate.answer_end = 0, len(candidate.content)
+        return
+    candidate.answer_start = candidate.content.find(best_sentence)
+    candidate.answer_end = candidate.answer_start + len(best_sentence)
+
+
+def _run_stage(trace: SearchTrace, stage: str, candidate_lists: List[List[Candidate]], run,
+               on_stage: Optional[StageCallback] = None) -> List[List[Candidate]]:
+    items = _count(candidate_lists)
+    started_at = trace.elapsed_ms()
+    candidate_lists = run(candidate_lists)
+    elapsed_ms = trace.elapsed_ms() - started_at
+    StageCosts.record(stage, items, elapsed_ms)
+    trace.ran(stage, items, elapsed_ms)
+    if on_stage is not None:
+        on_stage(stage, candidate_lists)
+    return candidate_lists
+
+
+def _rerank_batch(queries: List[str], candidate_lists: List[List[Candidate]], top_k: int,
+                  preset: SearchPreset, trace: SearchTrace, on_stage: Optional[StageCallback] = None,
+                  lazy_answers: bool = False) -> List[List[Candidate]]:
+    """
+    on_stage, if given, is called with the candidates after every stage that ran (e.g. to stream them).
+    With lazy_answers the QA stages are skipped and the answers are highlighted lexically,
+    the real answer spans can be computed later with find_answer for the results that are actually shown.
+    """
+    logger.info(f'Found {_count(candidate_lists)} candidates for {len(queries)} queries, filtering...')
+
+    # calculate small cross-encoder scores to order all the candidates
+    all_candidates = max(len(candidates) for candidates in candidate_lists)
+    candidate_lists = _run_stage(trace, 'small_cross_encoder', candidate_lists, lambda lists: _cross_encode_batch(
+        cross_encoder_small, queries, lists, all_candidates, use_titles=True), on_stage)
+
+    # leave just a few candidates, at most a couple of paragraphs per document and documents per thread
+    candidate_lists = _run_stage(trace, 'collapse', candidate_lists, lambda lists: [
+        collapse(candidates)[:preset.small_cross_encoder_candidates] for candidates in lists])
+
+    # calculate large cross-encoder scores to leave just top_k candidates
+    if preset.early_exit and all(_is_settled(candidates, top_k) for candidates in candidate_lists):
+        candidate_lists = [candidates[:top_k] for candidates in candidate_lists]
+        trace.skip('large_cross_encoder', 'settled')
+    else:
+        affordable = StageCosts.affordable_items('large_cross_encoder', trace)
+        if affordable is not None and affordable < top_k * len(candidate_lists):
+            candidate_lists = [candidates[:top_k] for candidates in candidate_lists]
+            trace.skip('large_cross_encoder', 'budget')
+        else:
+            if affordable is not None and affordable < _count(candidate_lists):
+                # shrink the stage to what the budget allows, still leaving top_k candidates per query
+                keep = max(top_k, affordable // len(candidate_lists))
+                candidate_lists = [candidates[:keep] for candidates in candidate_lists]
+                trace.skip('large_cross_encoder_tail', 'budget')
+            with trace.timed('windowing'):
+                _assign_windows(queries, candidate_lists)
+            candidate_lists = _run_stage(trace, 'large_cross_encoder', candidate_lists,
+                                         lambda lists: _cross_encode_batch(cross_encoder_large, queries, lists, top_k,
+                                                                           use_titles=True, use_window=True), on_stage)
+
+    if lazy_answers:
+        for query, candidates in zip(queries, candidate_lists):
+            for candidate in candidates:
+                _assign_lexical_answer(candidate, query)
+        trace.skip('answer_extraction', 'lazy')
+        trace.skip('answer_rescore', 'lazy')
+        return [_attach_parents(candidates[:top_k]) for candidates in candidate_lists]
+
+    # extract the answers, for as many candidates as the budget allows
+    affordable = StageCosts.affordable_items('answer_extraction', trace)
+    answered = candidate_lists
+    if affordable is not None and affordable < _count(candidate_lists):
+        keep = affordable // len(candidate_lists)
+        answered = [candidates[:keep] for candidates in candidate_lists]
+        for query, candidates in zip(queries, candidate_lists):
+            for candidate in candidates[keep:]:
+                _assign_lexical_answer(candidate, query)
+        trace.skip('answer_extraction' if keep == 0 else 'answer_extraction_tail', 'budget')
+    if _count(answered) > 0:
+        _run_stage(trace, 'answer_extraction', answered,
+                   lambda lists: _find_answers_in_candidates_batch(queries, lists), on_stage)
+
+    # re-score with the answers, unless the ranking is already settled or there's no time left
+    affordable = StageCosts.affordable_items('answer_rescore', trace)
+    if 'answer_extraction' not in trace.stages or 'answer_extraction_tail' in trace.skipped:
+        trace.skip('answer_rescore', 'budget')
+    elif preset.early_exit and all(_is_settled(candidates, top_k) for candidates in candidate_lists):
+        trace.skip('answer_rescore', 'settled')
+    elif affordable is not None and affordable < _count(candidate_lists):
+        trace.skip('answer_rescore', 'budget')
+    else:
+        candidate_lists = _run_stage(trace, 'answer_rescore', candidate_lists, lambda lists: _cross_encode_batch(
+            cross_encoder_large, queries, lists, top_k, use_answer=True, use_titles=True), on_stage)
+
+    return [_attach_parents(candidates[:top_k]) for candidates in candidate_lists]
+
+
+def _to_search_results(candidate_lists: List[List[Candidate]]) -> List[List[SearchResult]]:
+    logger.info(f'Parsing {_count(candidate_lists)} candidates to search results...')
+
+    results = []
+    for candidates in candidate_lists:
+        result = [candidate.to_search_result() for candidate in candidates]
+        result.sort(key=lambda r: r.score, reverse=True)
+        results.append(result)
+    return results
+
+
+def _cache_variant(preset: SearchPreset, lazy_answers: bool, search_filter: Optional[SearchFilter]) -> str:
+    variant = preset.name + (':lazy' if lazy_answers else '')
+    if search_filter is not None and not search_filter.is_empty:
+        variant += ':' + search_filter.cache_key()
+    return variant
+
+
+def search_documents_batch(queries: List[str], top_k: int, mode: Optional[str] = None,
+                           budget_ms: Optional[float] = None, lazy_answers: bool = False,
+                           trace: Optional[SearchTrace] = None,
+                           search_filter: Optional[SearchFilter] = None) -> List[List[SearchResult]]:
+    """
+    Runs all queries through the search cascade together: one bi-encoder pass, one multi-row index search
+    and shared cross-encoder/QA batches for all (query, candidate) pairs.
+    mode picks a preset (fast, balanced, accurate) and budget_ms a latency budget, the stages that ran
+    are recorded in trace. lazy_answers skips answer extraction (see find_answer).
+    search_filter restricts the results to matching documents.
+    """
+    if len(queries) == 0:
+        return []
+
+    preset = get_preset(mode, DEFAULT_PRESET, budget_ms)
+    variant = _cache_variant(preset, lazy_answers, search_filter)
+    trace = trace or SearchTrace()
+    trace.budget_ms = preset.budget_ms
+
+    generation = SearchCache.generation()
+    result_keys = [(generation, SearchCache.normalize_cased_query(query), top_k, variant) for query in queries]
+    with trace.timed('cache'):
+        results = [SearchCache.results.get(key) for key in result_keys]
+    # blank queries match nothing
+    results = [[] if result is None and not query.strip() else result for query, result in zip(queries, results)]
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    allowed_ids = None
+    if missing:
+        with trace.timed('filter'):
+            allowed_ids = _allowed_ids(search_filter)
+
+    # identifier and keyword queries are answered lexically, without any model
+    routed = 0
+    for i in missing:
+        results[i] = _search_lexical(queries[i], top_k, allowed_ids, trace)
+        routed += results[i] is not None
+    missing = [i for i in missing if results[i] is None]
+
+    # near-duplicates of recent queries reuse their results
+    semantic_cache = SemanticQueryCache.get_instance()
+    embeddings = {}
+    if missing and semantic_cache.enabled:
+        with trace.timed('query_encoding'):
+            missing_embeddings = _encode_queries([queries[i] for i in missing])
+        with trace.timed('cache'):
+            for i, embedding in zip(missing, missing_embeddings):
+                embeddings[i] = embedding
+                results[i] = semantic_cache.lookup(embedding, top_k, variant)
+        missing = [i for i in missing if results[i] is None]
+
+    if not missing:
+        if routed < len(queries):
+            trace.ran('cache', len(queries) - routed)
+    else:
+        # a query repeated within the batch is searched once
+        first = {}
+        for i in missing:
+            first.setdefault(result_keys[i], i)
+        unique = list(first.values())
+        computed = _search_documents_batch([queries[i] for i in unique], top_k, preset, trace, lazy_answers,
+                                           allowed_ids)
+        for i, result in zip(unique, computed):
+            results[i] = result
+            # results cut short by the budget are not worth keeping around
+            if not trace.degraded:
+                SearchCache.results.put(result_keys[i], result)
+                if i in embeddings:
+                    semantic_cache.store(queries[i], embeddings[i], top_k, result, generation, variant)
+        for i in missing:
+            results[i] = results[first[result_keys[i]]]
+
+    return [list(result) for result in results]
+
+
+def _lexical_candidates(routed: RoutedQuery, depth: int, allowed_ids: Optional[np.ndarray],
+                        trace: SearchTrace) -> List[Candidate]:
+    """
+    Ranks the candidates of a routed query without any model: the exact lookups first, then the BM25 hits.
+    Both are ordered by BM25 and scored on the cross-encoder scale, so they mix with regular results.
+    """
+    bm25_index = Bm25Index.get()
+    scores = {}
+
+    # keywords and phrases may be an exact id or title too
+    with trace.timed('lookup'):
+        looked_up = LookupIndex.get().lookup(routed.identifiers or [routed.query])
+    if allowed_ids is not None:
+        looked_up = np.intersect1d(looked_up, allowed_ids).tolist()
+    if looked_up:
+        with trace.timed('bm25'):
+            hits = bm25_index.search_with_scores(routed.query, len(looked_up), np.array(looked_up, dtype=np.int64))
+        # the looked-up paragraphs may not have reached BM25 yet (or have just left it)
+        best = max((score for _, score in hits), default=0.0) or 1.0
+        for id, score in hits:
+            scores[id] = LOOKUP_SCORE + LEXICAL_SCORE_RANGE * max(score, 0.0) / best
+
+    if len(scores) < depth:
+        with trace.timed('bm25'):
+            hits = [(id, score) for id, score in bm25_index.search_with_scores(routed.query, depth, allowed_ids)
+                    if score > 0 and id not in scores]
+        if hits:
+            best = hits[0][1]
+            for id, score in hits:
+                scores[id] = LOOKUP_SCORE - LEXICAL_SCORE_RANGE + LEXICAL_SCORE_RANGE * score / best
+
+    ids = sorted(scores, key=scores.get, reverse=True)
+    with trace.timed('hydration'):
+        candidates = _to_candidates(ids, ParagraphStore.get().paragraphs_by_id(ids))
+
+    # BM25 matches any of the tokens, the phrase or identifier itself has to be there
+    if routed.route != QueryRoute.KEYWORD:
+        required = [routed.phrase] if routed.phrase is not None else routed.identifiers + [routed.query]
+        required = [' '.join(text.lower().split()) for text in required]
+        looked_up = set(looked_up)
+
+        def matches(candidate: Candidate) -> bool:
+            text = ' '.join(f'{candidate.document.title or ""} {candidate.content}'.lower().split())
+            return any(part in text for part in required)
+
+        candidates = [candidate for candidate in candidates
+                      if candidate.paragraph_id in looked_up or matches(candidate)]
+
+    # a looked up document brings all of its paragraphs
+    candidates = collapse(candidates)[:depth]
+    for candidate in candidates:
+        candidate.score = scores[candidate.paragraph_id]
+        _assign_lexical_answer(candidate, routed.query)
     return candidates
 
 
-def search_documents(query: str, top_k: int) -> List[SearchResult]:
-    # Encode the query
-    query_embedding = bi_encoder.encode(query, convert_to_tensor=True, show_progress_bar=False)
-
-    # Search the index for 100 candidates
-    index = FaissIndex.get()
-
-    print('calling pinecone')
-    print('#'*100)
-
-    results = index.search(query_embedding, BI_ENCODER_CANDIDATES)
-    results = results[0]
-    results = [int(id) for id in results if id != -1]  # filter out empty results
-
-    results += Bm25Index.get().search(query, BM_25_CANDIDATES)
-    print('#'*100)
-    print(len(results))
-
-    # Get the paragraphs from the database
-    with Session() as session:
-        paragraphs = session.query(Paragraph).filter(Paragraph.id.in_(results)).all()
-        if len(paragraphs) == 0:
-            return []
-        candidates = [Candidate(content=paragraph.content, document=paragraph.document, score=0.0)
-                      for paragraph in paragraphs]
-
-        # calculate small cross-encoder scores to leave just a few candidates
-        logger.info(f'Found {len(candidates)} candidates, filtering...')
-        candidates = _cross_encode(cross_encoder_small, query, candidates, BI_ENCODER_CANDIDATES, use_titles=True)
-        # calculate large cross-encoder scores to leave just top_k candidates
-        candidates = _cross_encode(cross_encoder_large, query, candidates, top_k, use_titles=True)
-        candidates = _find_answers_in_candidates(candidates, query)
-        candidates = _cross_encode(cross_encoder_large, query, candidates, top_k, use_answer=True, use_titles=True)
-
-        logger.info(f'Parsing {len(candidates)} candidates to search results...')
-
-        for possible_child in candidates:
-            if possible_child.document.parent_id is not None:
-                for possible_parent in candidates:
-                    if possible_parent.document.id == possible_child.document.parent_id:
-                        possible_child.parent = possible_parent
-                        candidates.remove(possible_parent)
-                        break
-
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            result = list(executor.map(lambda c: c.to_search_result(), candidates))
-            result.sort(key=lambda r: r.score, reverse=True)
-            return result
+def _routed_candidates(query: str, depth: int, allowed_ids: Optional[np.ndarray],
+                       trace: SearchTrace) -> Optional[List[Candidate]]:
+    """
+    The candidates of identifier, phrase and keyword queries (see route_query).
+    None for natural-language queries, and when the lexical route finds nothing, so the cascade gets its chance.
+    """
+    routed = route_query(query)
+    if routed.route == QueryRoute.NEURAL or (allowed_ids is not None and len(allowed_ids) == 0):
+        return None
+
+    started_at = trace.elapsed_ms()
+    candidates = _lexical_candidates(routed, depth, allowed_ids, trace)
+    trace.ran(f'{routed.route.value}_route', len(candidates), trace.elapsed_ms() - started_at)
+    return _attach_parents(candidates) if candidates else None
+
+
+def _search_lexical(query: str, top_k: int, allowed_ids: Optional[np.ndarray],
+                    trace: SearchTrace) -> Optional[List[SearchResult]]:
+    candidates = _routed_candidates(query, top_k, allowed_ids, trace)
+    if candidates is None:
+        return None
+
+    with trace.timed('search_results'):
+        return _to_search_results([candidates])[0]
+
+
+def _search_documents_batch(queries: List[str], top_k: int, preset: SearchPreset, trace: SearchTrace,
+                            lazy_answers: bool, allowed_ids: Optional[np.ndarray]) -> List[List[SearchResult]]:
+    if allowed_ids is not None and len(allowed_ids) == 0:
+        return [[] for _ in queries]
+
+    retrieved = _retrieve_batch(queries, preset, allowed_ids, trace)
+    all_ids = {id for ids in retrieved for id in ids}
+
+    # Hydrate the candidates of all the queries from the paragraph store at once
+    with trace.timed('hydration'):
+        paragraphs_by_id = ParagraphStore.get().paragraphs_by_id(all_ids)
+        candidate_lists = [_to_candidates(ids, paragraphs_by_id) for ids in retrieved]
+
+    candidate_lists = _rerank_batch(queries, candidate_lists, top_k, preset, trace, lazy_answers=lazy_answers)
+    with trace.timed('search_results'):
+        return _to_search_results(candidate_lists)
+
+
+def search_documents(query: str, top_k: int, mode: Optional[str] = None, budget_ms: Optional[float] = None,
+                     lazy_answers: bool = False, trace: Optional[SearchTrace] = None,
+                     search_filter: Optional[SearchFilter] = None) -> List[SearchResult]:
+    return search_documents_batch([query], top_k, mode=mode, budget_ms=budget_ms, lazy_answers=lazy_answers,
+                                  trace=trace, search_filter=search_filter)[0]
+
+
+@dataclass
+class SearchPage:
+    results: List[SearchResult]
+    # None once there are no more results
+    next_cursor: Optional[str]
+    total: int
+
+
+def search_documents_page(query: str, page_size: int, cursor: Optional[str] = None, mode: Optional[str] = None,
+                          budget_ms: Optional[float] = None, lazy_answers: bool = False,
+                          trace: Optional[SearchTrace] = None,
+                          search_filter: Optional[SearchFilter] = None) -> SearchPage:
+    """
+    Without a cursor, runs the search and keeps up to PAGINATION_DEPTH reranked candidates server-side.
+    With a cursor, the page is sliced from the kept candidates, so only its answers are extracted and
+    only its results are hydrated. Raises KeyError for an unknown or expired cursor.
+    """
+    trace = trace or SearchTrace()
+    if cursor is None:
+        preset = get_preset(mode, DEFAULT_PRESET, budget_ms)
+        trace.budget_ms = preset.budget_ms
+        candidates, lexical = _rank_for_pagination(query, preset, trace, search_filter)
+        # routed queries keep their lexical answers
+        entry = CursorEntry(query=query, lazy_answers=lazy_answers or lexical, candidates=candidates,
+                            created_at=time.time())
+        entry_id, offset = SearchCursors.put(entry), 0
+    else:
+        decoded = SearchCursors.decode_cursor(cursor)
+        entry = SearchCursors.get(decoded[0]) if decoded is not None else None
+        if entry is None:
+            raise KeyError(cursor)
+        entry_id, offset = decoded
+        trace.ran('cursor', len(entry.candidates))
+
+    key = (offset, page_size)
+    results = entry.pages.get(key)
+    if results is None:
+        page = entry.candidates[offset:offset + page_size]
+        if not entry.lazy_answers and page:
+            _run_stage(trace, 'answer_extraction', [page],
+                       lambda lists: _find_answers_in_candidates_batch([entry.query], lists))
+        with trace.timed('search_results'):
+            results = _to_search_results([page])[0]
+        entry.pages[key] = results
+
+    next_offset = offset + page_size
+    next_cursor = SearchCursors.encode_cursor(entry_id, next_offset) if next_offset < len(entry.candidates) else None
+    return SearchPage(results=list(results), next_cursor=next_cursor, total=len(entry.candidates))
+
+
+def _rank_for_pagination(query: str, preset: SearchPreset, trace: SearchTrace,
+                         search_filter: Optional[SearchFilter]) -> Tuple[List[Candidate], bool]:
+    """
+    The candidates to paginate over, and whether they were ranked lexically (see route_query).
+    """
+    with trace.timed('filter'):
+        allowed_ids = _allowed_ids(search_filter)
+    if allowed_ids is not None and len(allowed_ids) == 0:
+        return [], False
+
+    candidates = _routed_candidates(query, PAGINATION_DEPTH, allowed_ids, trace)
+    if candidates is not None:
+        return candidates, True
+
+    retrieved = _retrieve_batch([query], preset, allowed_ids, trace)[0]
+    with trace.timed('hydration'):
+        candidates = _to_candidates(retrieved, ParagraphStore.get().paragraphs_by_id(retrieved))
+
+    # rerank deep enough for every page, the answers are left for the pages that are actually requested
+    preset = replace(preset, small_cross_encoder_candidates=max(PAGINATION_DEPTH,
+                                                                preset.small_cross_encoder_candidates))
+    return _rerank_batch([query], [candidates], PAGINATION_DEPTH, preset, trace, lazy_answers=True)[0], False
+
+
+def find_answer(query: str, paragraph_id: int) -> Optional[AnswerSpan]:
+    """
+    Extracts the answer span for a single (query, paragraph), e.g. for a result of a lazy-answers search
+    the UI is about to show. Spans are cached per (query, paragraph).
+    """
+    key = (SearchCache.generation(), SearchCache.normalize_cased_query(query), paragraph_id)
+    answer = SearchCache.answers.get(key)
+    if answer is not None:
+        return answer
+
+    paragraph = ParagraphStore.get().get_paragraph(paragraph_id)
+    if paragraph is None:
+        return None
+
+    candidate = Candidate(content=paragraph.content, document=paragraph.document, paragraph_id=paragraph_id)
+    _find_answers_in_candidates_batch([query], [[candidate]])
+    answer = candidate.to_answer_span()
+
+    SearchCache.answers.put(key, answer)
+    return answer
+
+
+FACET_SCOPES = ('candidates', 'matches')
+
+
+def facet_counts(query: str, search_filter: Optional[SearchFilter] = None, scope: str = 'candidates',
+                 limit: int = 20, mode: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """
+    The number of paragraphs per facet value (data source, type, location, author) for the query.
+    scope 'candidates' counts the first-stage retrieval candidates (what the cross-encoders would see),
+    'matches' counts every paragraph matching a query term.
+    """
+    allowed_ids = _allowed_ids(search_filter)
+    if allowed_ids is not None and len(allowed_ids) == 0:
+        ids = []
+    elif scope == 'matches':
+        ids = Bm25Index.get().match_ids(query)
+        if allowed_ids is not None:
+            ids = np.intersect1d(ids, allowed_ids)
+        ids = ids.tolist()
+    else:
+        ids = _retrieve_batch([query], get_preset(mode, DEFAULT_PRESET), allowed_ids)[0]
+    return FacetIndex.get().counts(ids, limit)
+
+
+def _to_candidates(ids: List[int], paragraphs_by_id: Dict[int, StoredParagraph]) -> List[Candidate]:
+    return [Candidate(content=paragraphs_by_id[id].content, document=paragraphs_by_id[id].document, score=0.0,
+                      paragraph_id=id)
+            for id in ids if id in paragraphs_by_id]
+
+
+def _candidate_hits(candidates: List[Candidate]) -> List[dict]:
+    """
+    A lightweight view of the candidates, cheap enough to send before the final results are ready.
+    """
+    hits = []
+    for candidate in candidates:
+        hit = {'paragraph_id': candidate.paragraph_id, 'title': candidate.document.title,
+               'url': candidate.document.url, 'score': candidate.score}
+        if candidate.answer_end > candidate.answer_start >= 0:
+            hit['answer'] = candidate.content[candidate.answer_start:candidate.answer_end]
+        hits.append(hit)
+    return hits
+
+
+async def search_documents_stream(query: str, top_k: int, mode: Optional[str] = None,
+                                  budget_ms: Optional[float] = None, lazy_answers: bool = False,
+                                  trace: Optional[SearchTrace] = None,
+                                  search_filter: Optional[SearchFilter] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Runs the cascade without blocking the event loop, yielding (event, data) as soon as each stage is done:
+    'retrieval' with the first-stage hits, then the refined ordering after every rerank stage,
+    then 'results' with the final search results.
+    Model inference runs on the inference executor, BM25 runs alongside the vector retrieval,
+    and the candidates are hydrated from the paragraph store.
+    """
+    loop = asyncio.get_running_loop()
+    preset = get_preset(mode, DEFAULT_PRESET, budget_ms)
+    variant = _cache_variant(preset, lazy_answers, search_filter)
+    trace = trace or SearchTrace()
+    trace.budget_ms = preset.budget_ms
+
+    generation = SearchCache.generation()
+    result_key = (generation, SearchCache.normalize_cased_query(query), top_k, variant)
+    with trace.timed('cache'):
+        cached = SearchCache.results.get(result_key)
+    if cached is not None:
+        trace.ran('cache', 1)
+        yield 'results', list(cached)
+        return
+    if not query.strip():
+        yield 'results', []
+        return
+
+    with trace.timed('filter'):
+        allowed_ids = _allowed_ids(search_filter)
+    if allowed_ids is not None and len(allowed_ids) == 0:
+        yield 'results', []
+        return
+
+    # identifier and keyword queries are answered lexically, without any model
+    routed_results = await loop.run_in_executor(RETRIEVAL_EXECUTOR, _search_lexical, query, top_k, allowed_ids,
+                                                trace)
+    if routed_results is not None:
+        yield 'results', routed_results
+        return
+
+    def timed(stage: str, run, *args, **kwargs):
+        with trace.timed(stage):
+            return run(*args, **kwargs)
+
+    bm25_future = loop.run_in_executor(RETRIEVAL_EXECUTOR, timed, 'bm25', Bm25Index.get().search_with_scores,
+                                       query, preset.bm25_candidates, allowed_ids)
+    query_embedding = (await loop.run_in_executor(INFERENCE_EXECUTOR, timed, 'query_encoding', _encode_queries,
+                                                  [query]))[0]
+
+    semantic_cache = SemanticQueryCache.get_instance()
+    with trace.timed('cache'):
+        cached = semantic_cache.lookup(query_embedding, top_k, variant)
+    if cached is not None:
+        # the BM25 hits are not needed anymore, a search still queued won't run
+        bm25_future.cancel()
+        trace.ran('cache', 1)
+        yield 'results', list(cached)
+        return
+
+    vector_scores, vector_ids = await loop.run_in_executor(
+        RETRIEVAL_EXECUTOR, lambda: timed('faiss', FaissIndex.get().search_with_scores, query_embedding,
+                                          preset.bi_encoder_candidates, allowed_ids=allowed_ids))
+    bm25_hits = await bm25_future
+    with trace.timed('fusion'):
+        ids, retrieved = _fuse_retrieved(vector_scores[0], vector_ids[0], bm25_hits, preset)
+    trace.ran('retrieval', retrieved)
+    trace.ran('fusion', len(ids))
+
+    with trace.timed('hydration'):
+        candidates = _to_candidates(ids, ParagraphStore.get().paragraphs_by_id(ids))
+    yield 'retrieval', _candidate_hits(candidates)
+
+    # the rerank stages run on the inference executor and report back through the queue
+    stages = asyncio.Queue()
+
+    def on_stage(stage: str, candidate_lists: List[List[Candidate]]):
+        loop.call_soon_threadsafe(stages.put_nowait, (stage, _candidate_hits(candidate_lists[0][:top_k])))
+
+    def rerank() -> List[List[Candidate]]:
+        try:
+            return _rerank_batch([query], [candidates], top_k, preset, trace, on_stage, lazy_answers)
+        finally:
+            loop.call_soon_threadsafe(stages.put_nowait, None)
+
+    rerank_future = loop.run_in_executor(INFERENCE_EXECUTOR, rerank)
+    while (stage_hits := await stages.get()) is not None:
+        yield stage_hits
+    candidate_lists = await rerank_future
+
+    with trace.timed('search_results'):
+        result = _to_search_results(candidate_lists)[0]
+
+    if not trace.degraded:
+        SearchCache.results.put(result_key, result)
+        semantic_cache.store(query, query_embedding, top_k, result, generation, variant)
+    yield 'results', list(result)
+
+
+async def search_documents_async(query: str, top_k: int, mode: Optional[str] = None,
+                                 budget_ms: Optional[float] = None, lazy_answers: bool = False,
+                                 trace: Optional[SearchTrace] = None,
+                                 search_filter: Optional[SearchFilter] = None) -> List[SearchResult]:
+    """
+    Same cascade as search_documents, without blocking the event loop (see search_documents_stream).
+    """
+    results = []
+    async for event, data in search_documents_stream(query, top_k, mode=mode, budget_ms=budget_ms,
+                                                     lazy_answers=lazy_answers, trace=trace,
+                                                     search_filter=search_filter):
+        if event == 'results':
+            results = data
+    return results
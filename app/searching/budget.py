@@ -0,0 +1,84 @@
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+from searching.trace import SearchTrace
+
+
+@dataclass
+class SearchPreset:
+    name: str
+    bm25_candidates: int
+    bi_encoder_candidates: int
+    small_cross_encoder_candidates: int
+    budget_ms: Optional[float] = None
+    # skip/shrink later stages when the score gap between the top candidates already settles the ranking
+    early_exit: bool = False
+
+
+SEARCH_PRESETS: Dict[str, SearchPreset] = {
+    'fast': SearchPreset(name='fast', bm25_candidates=20, bi_encoder_candidates=20,
+                         small_cross_encoder_candidates=10, budget_ms=400, early_exit=True),
+    'balanced': SearchPreset(name='balanced', bm25_candidates=50, bi_encoder_candidates=30,
+                             small_cross_encoder_candidates=15, budget_ms=1500, early_exit=True),
+    'accurate': SearchPreset(name='accurate', bm25_candidates=100, bi_encoder_candidates=60,
+                             small_cross_encoder_candidates=30),
+}
+
+# a score gap (in cross-encoder logits) that is big enough to consider two candidates' order settled
+SETTLED_SCORE_GAP = 3.0
+
+
+class StageCosts:
+    """
+    Keeps an exponential moving average of how long each stage takes per candidate,
+    so the cascade can tell in advance whether a stage still fits in the remaining budget.
+    """
+    SMOOTHING = 0.2
+    # rough CPU numbers, used until a stage has been measured
+    _ms_per_item: Dict[str, float] = {
+        'small_cross_encoder': 2.0,
+        'large_cross_encoder': 10.0,
+        'answer_extraction': 40.0,
+        'answer_rescore': 5.0,
+    }
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, stage: str, items: int, elapsed_ms: float):
+        if items == 0:
+            return
+        with cls._lock:
+            per_item = elapsed_ms / items
+            previous = cls._ms_per_item.get(stage)
+            cls._ms_per_item[stage] = per_item if previous is None else \
+                previous + cls.SMOOTHING * (per_item - previous)
+
+    @classmethod
+    def affordable_items(cls, stage: str, trace: SearchTrace) -> Optional[int]:
+        """
+        How many candidates the stage can process in the remaining budget, None if there's no budget.
+        """
+        remaining_ms = trace.remaining_ms()
+        if remaining_ms is None:
+            return None
+        if remaining_ms <= 0:
+            return 0
+        return int(remaining_ms / cls._ms_per_item.get(stage, 1.0))
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, float]:
+        return dict(cls._ms_per_item)
+
+
+def get_preset(mode: Optional[str], default: SearchPreset, budget_ms: Optional[float] = None) -> SearchPreset:
+    if mode is None:
+        preset = default
+    elif mode in SEARCH_PRESETS:
+        preset = SEARCH_PRESETS[mode]
+    else:
+        raise ValueError(f'Unknown search mode {mode}, expected one of {", ".join(SEARCH_PRESETS)}')
+
+    if budget_ms is not None:
+        preset = replace(preset, budget_ms=budget_ms)
+    return preset
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+from indexing.index_generation import IndexGeneration
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache with a size limit and hit/miss counters.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._items.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class SearchCache:
+    """
+    Caches the search cascade at three levels:
+    1. normalized query => bi-encoder embedding
+    2. (normalized query, paragraph id, mode) => cross-encoder score
+    3. (cased query, top_k) => final search results
+    plus (cased query, paragraph id) => answer span, for answers extracted on demand.
+    All but the embeddings depend on the indexed paragraphs, so their keys include the index generation.
+    Entries from older generations are dropped as soon as a newer generation is seen.
+    """
+    EMBEDDINGS_MAX_SIZE = 4096
+    SCORES_MAX_SIZE = 100_000
+    RESULTS_MAX_SIZE = 1024
+    ANSWERS_MAX_SIZE = 4096
+
+    embeddings = LRUCache(EMBEDDINGS_MAX_SIZE)
+    scores = LRUCache(SCORES_MAX_SIZE)
+    results = LRUCache(RESULTS_MAX_SIZE)
+    answers = LRUCache(ANSWERS_MAX_SIZE)
+    _generation = IndexGeneration.get()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        # the bi-encoder and the cross-encoders are uncased, so case and whitespace don't change their outputs
+        return ' '.join(query.lower().split())
+
+    @staticmethod
+    def normalize_cased_query(query: str) -> str:
+        # the QA model is cased, so keys of anything holding answers only ignore whitespace
+        return ' '.join(query.split())
+
+    @classmethod
+    def generation(cls) -> int:
+        generation = IndexGeneration.get()
+        if generation != cls._generation:
+            cls._generation = generation
+            cls.scores.clear()
+            cls.results.clear()
+            cls.answers.clear()
+        return generation
+
+    @classmethod
+    def clear(cls):
+        cls.embeddings.clear()
+        cls.scores.clear()
+        cls.results.clear()
+        cls.answers.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        return {
+            'generation': cls._generation,
+            'embeddings': cls.embeddings.stats(),
+            'scores': cls.scores.stats(),
+            'results': cls.results.stats(),
+            'answers': cls.answers.stats()
+        }
@@ -0,0 +1,34 @@
+import os
+from typing import Dict, List, Set
+
+# how many paragraphs of one document may reach the large cross-encoder (0 disables collapsing)
+PARAGRAPHS_PER_DOCUMENT = int(os.environ.get('SEARCH_PARAGRAPHS_PER_DOCUMENT', 1))
+# how many documents of one thread (a parent and its children, e.g. a Slack thread or a Jira issue
+# with its comments) may reach it (0 for no limit)
+DOCUMENTS_PER_THREAD = int(os.environ.get('SEARCH_DOCUMENTS_PER_THREAD', 2))
+
+
+def collapse(candidates: List, paragraphs_per_document: int = PARAGRAPHS_PER_DOCUMENT,
+             documents_per_thread: int = DOCUMENTS_PER_THREAD) -> List:
+    """
+    Drops the sibling paragraphs of documents and threads that are already represented, from candidates
+    ordered best first, so the expensive stages spend their time on different documents.
+    The parent and children of a thread end up grouped into one result later anyway (see _attach_parents).
+    """
+    if paragraphs_per_document <= 0:
+        return candidates
+
+    paragraphs: Dict[int, int] = {}
+    threads: Dict[int, Set[int]] = {}
+    kept = []
+    for candidate in candidates:
+        document = candidate.document
+        thread = threads.setdefault(document.parent_id if document.parent_id is not None else document.id, set())
+        if paragraphs.get(document.id, 0) >= paragraphs_per_document:
+            continue
+        if document.id not in thread and 0 < documents_per_thread <= len(thread):
+            continue
+        paragraphs[document.id] = paragraphs.get(document.id, 0) + 1
+        thread.add(document.id)
+        kept.append(candidate)
+    return kept
@@ -0,0 +1,39 @@
+import datetime
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Restricts a search to the paragraphs of matching documents, every given field must match.
+    The filter is evaluated against the metadata index and pushed down into the FAISS and BM25 searches,
+    so only eligible paragraphs reach the cross-encoders.
+    """
+    data_sources: Optional[List[str]] = None
+    data_source_ids: Optional[List[int]] = None
+    types: Optional[List[str]] = None
+    locations: Optional[List[str]] = None
+    authors: Optional[List[str]] = None
+    from_time: Optional[datetime.datetime] = None
+    to_time: Optional[datetime.datetime] = None
+    is_active: Optional[bool] = None
+
+    @property
+    def is_empty(self) -> bool:
+        return self.cache_key() == ''
+
+    def cache_key(self) -> str:
+        """
+        A canonical representation, equal for filters that select the same paragraphs.
+        """
+        parts = []
+        for name in ('data_sources', 'data_source_ids', 'types', 'locations', 'authors'):
+            values = getattr(self, name)
+            if values:
+                parts.append(f'{name}={",".join(sorted(str(value) for value in values))}')
+        for name in ('from_time', 'to_time', 'is_active'):
+            value = getattr(self, name)
+            if value is not None:
+                parts.append(f'{name}={value.isoformat() if isinstance(value, datetime.datetime) else value}')
+        return ';'.join(parts)
@@ -0,0 +1,58 @@
+import os
+from typing import Dict, List, Tuple
+
+# 'blend' mixes the normalized scores, 'rrf' only looks at the ranks (reciprocal rank fusion)
+FUSION_METHOD = os.environ.get('FUSION_METHOD', 'blend')
+FUSION_VECTOR_WEIGHT = float(os.environ.get('FUSION_VECTOR_WEIGHT', 0.5))
+RRF_K = int(os.environ.get('FUSION_RRF_K', 60))
+# candidates scoring below this fraction of the best fused score don't reach the cross-encoders
+FUSION_MIN_RELATIVE_SCORE = float(os.environ.get('FUSION_MIN_RELATIVE_SCORE', 0.35))
+
+# (id, score), best first
+Hits = List[Tuple[int, float]]
+
+
+def _normalized(hits: Hits, floor: float = None) -> Dict[int, float]:
+    """
+    Min-max normalizes the scores into [0, 1], floor overrides the minimum (e.g. 0 for BM25).
+    """
+    if not hits:
+        return {}
+    top = max(score for _, score in hits)
+    bottom = min(score for _, score in hits) if floor is None else floor
+    if top <= bottom:
+        return {id: 1.0 for id, _ in hits}
+    return {id: (score - bottom) / (top - bottom) for id, score in hits}
+
+
+def fuse(vector_hits: Hits, bm25_hits: Hits, method: str = FUSION_METHOD) -> Hits:
+    """
+    Merges the bi-encoder and BM25 hits into one ranking without duplicates.
+    A paragraph found by both gets credit from both.
+    """
+    fused: Dict[int, float] = {}
+    if method == 'rrf':
+        for hits in (vector_hits, bm25_hits):
+            for rank, (id, _) in enumerate(hits):
+                fused[id] = fused.get(id, 0.0) + 1 / (RRF_K + rank + 1)
+    elif method == 'blend':
+        for hits, weight in ((_normalized(vector_hits), FUSION_VECTOR_WEIGHT),
+                             (_normalized(bm25_hits, floor=0.0), 1 - FUSION_VECTOR_WEIGHT)):
+            for id, score in hits.items():
+                fused[id] = fused.get(id, 0.0) + weight * score
+    else:
+        raise ValueError(f'Unknown fusion method {method}, expected blend or rrf')
+    return sorted(fused.items(), key=lambda hit: hit[1], reverse=True)
+
+
+def cut(fused: Hits, min_candidates: int, max_candidates: int,
+        min_relative_score: float = FUSION_MIN_RELATIVE_SCORE) -> Hits:
+    """
+    Keeps the candidates the fused scores make worth reranking: the ones close enough to the best one,
+    but at least min_candidates and at most max_candidates.
+    """
+    if not fused:
+        return fused
+    threshold = fused[0][1] * min_relative_score
+    keep = sum(1 for _, score in fused if score >= threshold)
+    return fused[:min(max(keep, min_candidates), max_candidates)]
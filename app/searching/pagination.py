@@ -0,0 +1,90 @@
+import base64
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class CursorEntry:
+    query: str
+    lazy_answers: bool
+    # the reranked candidates, answers are extracted per page
+    candidates: List[Any]
+    created_at: float
+    # (offset, page size) => search results of the page, once hydrated
+    pages: Dict[Tuple[int, int], list] = field(default_factory=dict)
+
+
+class SearchCursors:
+    """
+    Keeps the reranked candidate list of a paginated search, so later pages are sliced from it
+    instead of running the search again.
+    Entries expire after TTL_SECONDS, the least recently used are evicted past MAX_ENTRIES.
+    Cursors are opaque to the client: the entry id and the offset of the next page, base64-encoded.
+    """
+    TTL_SECONDS = int(os.environ.get('SEARCH_CURSOR_TTL_SECONDS', 10 * 60))
+    MAX_ENTRIES = int(os.environ.get('SEARCH_CURSOR_MAX_ENTRIES', 256))
+
+    _lock = threading.Lock()
+    _entries: 'OrderedDict[str, CursorEntry]' = OrderedDict()
+    evictions = 0
+
+    @staticmethod
+    def encode_cursor(entry_id: str, offset: int) -> str:
+        raw = json.dumps({'id': entry_id, 'offset': offset}).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            decoded = json.loads(raw)
+            entry_id, offset = str(decoded['id']), int(decoded['offset'])
+        except (ValueError, KeyError, TypeError):
+            return None
+        # a negative offset would slice the candidates from the end
+        return (entry_id, offset) if offset >= 0 else None
+
+    @classmethod
+    def put(cls, entry: CursorEntry) -> str:
+        entry_id = secrets.token_urlsafe(12)
+        with cls._lock:
+            cls._expire()
+            cls._entries[entry_id] = entry
+            while len(cls._entries) > cls.MAX_ENTRIES:
+                cls._entries.popitem(last=False)
+                cls.evictions += 1
+        return entry_id
+
+    @classmethod
+    def get(cls, entry_id: str) -> Optional[CursorEntry]:
+        with cls._lock:
+            cls._expire()
+            entry = cls._entries.get(entry_id)
+            if entry is not None:
+                cls._entries.move_to_end(entry_id)
+            return entry
+
+    @classmethod
+    def _expire(cls):
+        now = time.time()
+        expired = [entry_id for entry_id, entry in cls._entries.items()
+                   if now - entry.created_at > cls.TTL_SECONDS]
+        for entry_id in expired:
+            del cls._entries[entry_id]
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            return {'entries': len(cls._entries), 'max_entries': cls.MAX_ENTRIES, 'ttl_seconds': cls.TTL_SECONDS,
+                    'evictions': cls.evictions}
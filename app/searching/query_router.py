@@ -0,0 +1,85 @@
+import os
+import re
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import List, Optional
+
+ROUTER_ENABLED = os.environ.get('QUERY_ROUTER_ENABLED', 'true').lower() in ('true', '1', 'yes')
+
+# e.g. PROJ-1234
+JIRA_KEY = re.compile(r'\b[A-Z][A-Z0-9]{1,9}-\d+\b')
+# e.g. group/project#12 (issue) or group/subgroup/project!34 (merge request)
+GITLAB_REFERENCE = re.compile(r'\b[\w.\-]+(?:/[\w.\-]+)+[#!]\d+\b')
+# e.g. https://gitlab.com/group/project/-/issues/12 (the host isn't part of the reference)
+GITLAB_URL_REFERENCE = re.compile(
+    r'(?:https?://)?[\w.\-]+(?::\d+)?/((?:[\w.\-]+/)*[\w.\-]+)/-/(issues|merge_requests)/(\d+)')
+URL = re.compile(r'^(?:https?://|www\.)\S+$', re.IGNORECASE)
+QUOTED = re.compile(r'^\s*["“](.+)["”]\s*$')
+# a single token that isn't a plain word: a hostname, an error code, a file name, a CamelCase exception...
+TECHNICAL_TOKEN = re.compile(r'^(?=.*[\d_.:/\\]|.*[a-z][A-Z]|[A-Z0-9_]{3,}$)\S+$')
+QUESTION_WORDS = {'how', 'what', 'why', 'when', 'where', 'who', 'which', 'can', 'does', 'is', 'should'}
+
+
+class QueryRoute(Enum):
+    # identifiers are looked up exactly (see LookupIndex), then completed with BM25
+    LOOKUP = "lookup"
+    # quoted phrases only match paragraphs containing the phrase, ranked by BM25
+    PHRASE = "phrase"
+    # single keywords are ranked by BM25 alone
+    KEYWORD = "keyword"
+    # anything else goes through the neural cascade
+    NEURAL = "neural"
+
+
+@dataclass
+class RoutedQuery:
+    route: QueryRoute
+    query: str
+    identifiers: List[str] = field(default_factory=list)
+    phrase: Optional[str] = None
+
+
+def normalize_url(url: str) -> str:
+    url = re.sub(r'^(?:https?://)?(?:www\.)?', '', url.strip().lower())
+    return url.split('#')[0].rstrip('/')
+
+
+def extract_identifiers(text: Optional[str]) -> List[str]:
+    """
+    The identifiers mentioned in a title, url or query, normalized to lower case.
+    """
+    if not text:
+        return []
+    identifiers = [key.lower() for key in JIRA_KEY.findall(text)]
+    identifiers += [reference.lower() for reference in GITLAB_REFERENCE.findall(text)]
+    for path, kind, number in GITLAB_URL_REFERENCE.findall(text):
+        identifiers.append(f"{path.lower()}{'#' if kind == 'issues' else '!'}{number}")
+    return list(dict.fromkeys(identifiers))
+
+
+def route_query(query: str) -> RoutedQuery:
+    """
+    Picks the cheapest way to answer the query that is still accurate for it.
+    Only natural-language queries need the bi-encoder, the cross-encoders and QA.
+    """
+    stripped = query.strip()
+    if not ROUTER_ENABLED or not stripped:
+        return RoutedQuery(route=QueryRoute.NEURAL, query=query)
+
+    if quoted := QUOTED.match(stripped):
+        return RoutedQuery(route=QueryRoute.PHRASE, query=quoted.group(1), phrase=quoted.group(1))
+
+    tokens = stripped.split()
+    if len(tokens) == 1 and URL.match(stripped):
+        return RoutedQuery(route=QueryRoute.LOOKUP, query=stripped,
+                           identifiers=[normalize_url(stripped)] + extract_identifiers(stripped))
+
+    identifiers = extract_identifiers(stripped)
+    # the query is nothing but identifiers, e.g. "PROJ-12 PROJ-13"
+    if identifiers and len(identifiers) == len(tokens):
+        return RoutedQuery(route=QueryRoute.LOOKUP, query=stripped, identifiers=identifiers)
+
+    if len(tokens) == 1 and (TECHNICAL_TOKEN.match(stripped) or stripped.lower() not in QUESTION_WORDS):
+        return RoutedQuery(route=QueryRoute.KEYWORD, query=stripped)
+
+    return RoutedQuery(route=QueryRoute.NEURAL, query=query)
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+import torch
+
+from indexing.faiss_index import MODEL_DIM
+from indexing.index_generation import IndexGeneration
+
+
+@dataclass
+class _SemanticCacheEntry:
+    query: str
+    top_k: int
+    variant: str
+    results: list
+    created_at: float
+
+
+class SemanticQueryCache:
+    """
+    Reuses the results of a recent query for near-duplicate queries.
+    The embeddings of recent queries are kept in a small in-memory FAISS index, a new query whose
+    embedding is within SIMILARITY_THRESHOLD (cosine) of a cached query gets that query's results.
+    Entries expire after TTL_SECONDS, the oldest entries are evicted past MAX_SIZE,
+    and everything is dropped when the index generation changes.
+    """
+    SIMILARITY_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.9))
+    TTL_SECONDS = int(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS', 60 * 60))
+    MAX_SIZE = int(os.environ.get('SEMANTIC_CACHE_MAX_SIZE', 1024))
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'SemanticQueryCache':
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: int = TTL_SECONDS,
+                 max_size: int = MAX_SIZE) -> None:
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._index = faiss.IndexIDMap(faiss.IndexFlatIP(MODEL_DIM))
+        self._entries: 'OrderedDict[int, _SemanticCacheEntry]' = OrderedDict()
+        self._next_id = 0
+        self._generation = IndexGeneration.get()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold <= 1.0 and self.max_size > 0
+
+    @staticmethod
+    def _to_vector(embedding: torch.Tensor) -> np.ndarray:
+        vector = embedding.detach().cpu().float().numpy().reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _clear(self):
+        self._index.reset()
+        self._entries.clear()
+
+    def _remove(self, ids: List[int]):
+        if not ids:
+            return
+        self._index.remove_ids(np.array(ids, dtype=np.int64))
+        for entry_id in ids:
+            del self._entries[entry_id]
+        self.evictions += len(ids)
+
+    def _evict(self):
+        generation = IndexGeneration.get()
+        if generation != self._generation:
+            self._generation = generation
+            self._clear()
+            return
+
+        # entries are ordered by creation time, so the expired ones are at the start
+        expire_before = time.monotonic() - self.ttl_seconds
+        expired = []
+        for entry_id, entry in self._entries.items():
+            if entry.created_at >= expire_before:
+                break
+            expired.append(entry_id)
+        self._remove(expired)
+
+        overflow = len(self._entries) - self.max_size
+        if overflow > 0:
+            self._remove(list(self._entries.keys())[:overflow])
+
+    def lookup(self, embedding: torch.Tensor, top_k: int, variant: str = '') -> Optional[list]:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._evict()
+            if self._index.ntotal == 0:
+                self.misses += 1
+                return None
+
+            similarities, ids = self._index.search(self._to_vector(embedding), 1)
+            entry = self._entries.get(int(ids[0][0]))
+            if entry is None or similarities[0][0] < self.threshold or entry.top_k < top_k or \
+                    entry.variant != variant:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry.results[:top_k]
+
+    def store(self, query: str, embedding: torch.Tensor, top_k: int, results: list, generation: int,
+              variant: str = ''):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._evict()
+            if generation != self._generation:
+                # the results were computed before the indices changed
+                return
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(self._to_vector(embedding), np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = _SemanticCacheEntry(query=query, top_k=top_k, variant=variant,
+                                                          results=results, created_at=time.monotonic())
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'threshold': self.threshold,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,74 @@
+import datetime
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from db_engine import Session
+from schemas import SlowQuery
+from searching.trace import SearchTrace
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_LENGTH = 512
+
+
+class SlowQueryLog:
+    """
+    Persists the searches that took longer than THRESHOLD_MS (a negative threshold disables the log),
+    with their candidate counts and stage timings, keeping the latest MAX_ROWS of them.
+    Rows are written on a background thread, so logging never adds to the latency of the search itself.
+    """
+    THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 2000))
+    MAX_ROWS = int(os.environ.get('SLOW_QUERY_LOG_MAX_ROWS', 10000))
+
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-log')
+
+    @classmethod
+    def record(cls, query: str, trace: SearchTrace, endpoint: str, mode: Optional[str] = None,
+               top_k: Optional[int] = None) -> bool:
+        """
+        Logs the search if it was slow, returns whether it did.
+        """
+        elapsed_ms = trace.elapsed_ms()
+        if cls.THRESHOLD_MS < 0 or elapsed_ms < cls.THRESHOLD_MS:
+            return False
+
+        trace_dict = trace.to_dict()
+        row = SlowQuery(query=query[:MAX_QUERY_LENGTH], endpoint=endpoint, mode=mode, top_k=top_k,
+                        elapsed_ms=trace_dict['elapsed_ms'], budget_ms=trace.budget_ms,
+                        candidates=json.dumps(trace_dict['candidates']),
+                        timings_ms=json.dumps(trace_dict['timings_ms']), skipped=json.dumps(trace_dict['skipped']),
+                        created_at=datetime.datetime.utcnow())
+        logger.warning(f'Slow search ({elapsed_ms:.0f} ms): {row.timings_ms}')
+        cls._executor.submit(cls._insert, row)
+        return True
+
+    @classmethod
+    def _insert(cls, row: SlowQuery):
+        try:
+            with Session() as session:
+                session.add(row)
+                session.commit()
+                if cls.MAX_ROWS > 0:
+                    session.query(SlowQuery).filter(SlowQuery.id <= row.id - cls.MAX_ROWS).delete()
+                    session.commit()
+        except Exception:
+            logger.exception('Failed to log a slow search')
+
+    @staticmethod
+    def worst(limit: int = 20, since: Optional[datetime.datetime] = None) -> List[dict]:
+        """
+        The slowest logged searches, slowest first.
+        """
+        with Session() as session:
+            query = session.query(SlowQuery)
+            if since is not None:
+                query = query.filter(SlowQuery.created_at >= since)
+            rows = query.order_by(SlowQuery.elapsed_ms.desc()).limit(limit).all()
+            return [{'query': row.query, 'endpoint': row.endpoint, 'mode': row.mode, 'top_k': row.top_k,
+                     'elapsed_ms': row.elapsed_ms, 'budget_ms': row.budget_ms,
+                     'candidates': json.loads(row.candidates), 'timings_ms': json.loads(row.timings_ms),
+                     'skipped': json.loads(row.skipped), 'created_at': row.created_at}
+                    for row in rows]
@@ -0,0 +1,65 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class SearchTrace:
+    """
+    Records what a single search request did: which stages of the cascade ran, which were skipped (and why),
+    how many candidates each stage processed and how long it took.
+    It also keeps the clock for the request's latency budget.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None) -> None:
+        self.started_at = time.monotonic()
+        self.budget_ms = budget_ms
+        self.stages: List[str] = []
+        self.skipped: Dict[str, str] = {}
+        self.candidates: Dict[str, int] = {}
+        # stage => milliseconds, summed if the stage ran more than once
+        self.timings_ms: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started_at) * 1000
+
+    def remaining_ms(self) -> Optional[float]:
+        if self.budget_ms is None:
+            return None
+        return self.budget_ms - self.elapsed_ms()
+
+    def ran(self, stage: str, candidates: int, elapsed_ms: Optional[float] = None):
+        self.stages.append(stage)
+        self.candidates[stage] = candidates
+        if elapsed_ms is not None:
+            self.add_time(stage, elapsed_ms)
+
+    def add_time(self, stage: str, elapsed_ms: float):
+        self.timings_ms[stage] = self.timings_ms.get(stage, 0.0) + elapsed_ms
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(stage, (time.monotonic() - started_at) * 1000)
+
+    def skip(self, stage: str, reason: str):
+        self.skipped[stage] = reason
+
+    @property
+    def degraded(self) -> bool:
+        """
+        Whether a stage was skipped or shrunk because of the budget, i.e. the results are worse than usual.
+        """
+        return any(reason.startswith('budget') for reason in self.skipped.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stages': self.stages,
+            'skipped': self.skipped,
+            'candidates': self.candidates,
+            'timings_ms': {stage: round(elapsed_ms, 2) for stage, elapsed_ms in self.timings_ms.items()},
+            'elapsed_ms': round(self.elapsed_ms(), 2),
+            'budget_ms': self.budget_ms
+        }
@@ -0,0 +1,65 @@
+import os
+import re
+from typing import List, Set, Tuple
+
+PASSAGE_WINDOWING = os.environ.get('PASSAGE_WINDOWING', 'true').lower() in ('true', '1', 'yes')
+# about 150 tokens, a third of what the cross-encoders would read otherwise
+PASSAGE_WINDOW_CHARS = int(os.environ.get('PASSAGE_WINDOW_CHARS', 600))
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+_WORD = re.compile(r'\w+')
+
+
+def _query_terms(query: str) -> Set[str]:
+    words = {word for word in _WORD.findall(query.lower())}
+    return {word for word in words if len(word) > 2} or words
+
+
+def _sentence_spans(text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """
+    The (start, end) offsets of the sentences, the ones longer than max_chars cut at a space.
+    """
+    spans = []
+    start = 0
+    separators = [(match.start(), match.end()) for match in _SENTENCE_END.finditer(text)]
+    for end, next_start in separators + [(len(text), len(text))]:
+        while end - start > max_chars:
+            cut = text.rfind(' ', start, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            spans.append((start, cut))
+            start = cut + 1 if text[cut] == ' ' else cut
+        if end > start:
+            spans.append((start, end))
+        start = next_start
+    return spans
+
+
+def best_window(text: str, query: str, max_chars: int = PASSAGE_WINDOW_CHARS) -> Tuple[int, int]:
+    """
+    The (start, end) offsets of the run of consecutive sentences of at most max_chars that shares
+    the most distinct words with the query, ties going to more occurrences, then to the run centering the matches
+    and then to the earlier run.
+    Text that already fits is returned whole, text sharing no word with the query is cut from the start.
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return 0, len(text)
+
+    query_terms = _query_terms(query)
+    spans = _sentence_spans(text, max_chars)
+    sentence_terms = [[word for word in _WORD.findall(text[start:end].lower()) if word in query_terms]
+                      for start, end in spans]
+
+    best, best_score = None, None
+    end = 0
+    for i in range(len(spans)):
+        end = max(end, i)
+        while end + 1 < len(spans) and spans[end + 1][1] - spans[i][0] <= max_chars:
+            end += 1
+        matched = [word for sentence in sentence_terms[i:end + 1] for word in sentence]
+        # keep the matching sentences in the middle of the window, with context on both sides
+        matching = [j for j in range(i, end + 1) if sentence_terms[j]]
+        margin = min(matching[0] - i, end - matching[-1]) if matching else 0
+        score = (len(set(matched)), len(matched), margin)
+        if best_score is None or score > best_score:
+            best, best_score = (spans[i][0], spans[end][1]), score
+    return best
@@ -0,0 +1,53 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.avatars import router
+from data_source.api.avatar_cache import AvatarCache
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+
+
+@pytest.fixture
+def client(avatars) -> TestClient:
+	app = FastAPI()
+	app.include_router(router)
+	return TestClient(app)
+
+
+@pytest.fixture
+def avatar_hash(avatars) -> str:
+	avatars.images['https://wiki/alice.png'] = ('image/png', PNG)
+	return AvatarCache.fetch('https://wiki/alice.png', session=avatars)
+
+
+def test_avatars_are_served_with_an_etag(client, avatar_hash):
+	response = client.get(f'/avatars/{avatar_hash}')
+
+	assert response.status_code == 200
+	assert response.content == PNG
+	assert response.headers['content-type'] == 'image/png'
+	assert response.headers['etag'] == f'"{avatar_hash}"'
+	assert response.headers['cache-control'] == 'private, max-age=86400'
+
+
+def test_a_matching_etag_gets_not_modified(client, avatar_hash):
+	response = client.get(f'/avatars/{avatar_hash}', headers={'If-None-Match': f'"{avatar_hash}"'})
+
+	assert response.status_code == 304
+	assert response.content == b''
+	assert response.headers['etag'] == f'"{avatar_hash}"'
+
+	response = client.get(f'/avatars/{avatar_hash}', headers={'If-None-Match': '"stale"'})
+	assert response.status_code == 200
+
+
+def test_avatars_can_not_run_scripts(client, avatar_hash):
+	response = client.get(f'/avatars/{avatar_hash}')
+
+	assert response.headers['x-content-type-options'] == 'nosniff'
+	assert response.headers['content-security-policy'] == "default-src 'none'; style-src 'unsafe-inline'"
+
+
+def test_unknown_avatars_are_not_found(client):
+	assert client.get(f'/avatars/{AvatarCache.avatar_hash("https://wiki/nobody.png")}').status_code == 404
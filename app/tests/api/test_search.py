@@ -0,0 +1,231 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+import search_logic
+from api.search import MAX_BATCH_QUERIES, router
+from indexing.bm25_index import Bm25Index
+from search_logic import search_documents
+from searching.cache import SearchCache
+from searching.semantic_cache import SemanticQueryCache
+from searching.slow_query_log import SlowQueryLog
+from telemetry import Posthog
+from tests.documents import document
+
+QUERIES = ['how do I reset the vpn', 'where is lunch served', 'when does the pipeline deploy']
+
+
+@pytest.fixture
+def client(search_engine, monkeypatch) -> TestClient:
+	monkeypatch.setattr(Posthog, 'increase_search_count', lambda uuid=None: None)
+	monkeypatch.setattr(SlowQueryLog, 'record', lambda *args, **kwargs: None)
+	search_engine.index([
+		document(1, ['To reset the VPN open the settings page. Then restart the client.']),
+		document(2, ['Lunch is served at noon in the kitchen.']),
+		document(3, ['The build pipeline deploys to staging every night.']),
+		document(4, ['Ask the IT desk when the VPN client fails to connect.']),
+	])
+	app = FastAPI()
+	app.include_router(router)
+	return TestClient(app)
+
+
+@pytest.fixture
+def searched(monkeypatch):
+	"""
+	The queries that reach the search cascade, past the caches.
+	"""
+	searched = []
+	search = search_logic._search_documents_batch
+
+	def search_documents_batch(queries, *args):
+		searched.append(list(queries))
+		return search(queries, *args)
+
+	monkeypatch.setattr(search_logic, '_search_documents_batch', search_documents_batch)
+	return searched
+
+
+def forget_searches():
+	SearchCache.clear()
+	SemanticQueryCache.get_instance().clear()
+
+
+def titles(results) -> list:
+	return [result['title'] for result in results]
+
+
+def server_sent_events(response) -> list:
+	events = []
+	for message in response.text.split('\n\n'):
+		if message:
+			event, data = message.split('\n')
+			events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+	return events
+
+
+def test_batch_results_are_in_the_order_of_the_queries(client):
+	expected = []
+	for query in QUERIES:
+		expected.append(jsonable_encoder(search_documents(query, 2)))
+		forget_searches()
+
+	response = client.post('/search/batch', json={'queries': QUERIES, 'top_k': 2})
+
+	assert response.status_code == 200
+	assert response.json() == expected
+	assert [titles(results)[0] for results in response.json()] == ['title 1', 'title 2', 'title 3']
+
+
+def test_batches_past_the_limit_are_rejected(client, searched):
+	response = client.post('/search/batch', json={'queries': ['vpn'] * (MAX_BATCH_QUERIES + 1)})
+
+	assert response.status_code == 400
+	assert searched == []
+
+	response = client.post('/search/batch', json={'queries': [QUERIES[0]] * MAX_BATCH_QUERIES})
+	assert response.status_code == 200
+	assert len(response.json()) == MAX_BATCH_QUERIES
+
+
+def test_empty_batches_and_blank_queries_match_nothing(client, searched):
+	assert client.post('/search/batch', json={'queries': []}).json() == []
+
+	response = client.post('/search/batch', json={'queries': ['', '   ', QUERIES[0]]})
+
+	assert response.status_code == 200
+	empty, blank, results = response.json()
+	assert empty == [] and blank == []
+	assert titles(results)[0] == 'title 1'
+	assert searched == [[QUERIES[0]]]
+
+
+def test_duplicate_queries_are_searched_once(client, searched):
+	response = client.post('/search/batch', json={'queries': [QUERIES[0], QUERIES[1], QUERIES[0] + '  ']})
+
+	assert response.status_code == 200
+	first, second, duplicate = response.json()
+	assert duplicate == first
+	assert titles(second)[0] == 'title 2'
+	assert searched == [[QUERIES[0], QUERIES[1]]]
+
+
+def test_batches_share_the_caches(client, search_engine, searched):
+	client.post('/search/batch', json={'queries': QUERIES[:2]})
+	encoded = len(search_engine.models.encoded)
+
+	# the same query, then a near-duplicate of a cached one and a new query
+	response = client.post('/search/batch', json={'queries': [QUERIES[0], 'Where is LUNCH served?', QUERIES[2]]})
+
+	assert response.status_code == 200
+	assert titles(response.json()[1])[0] == 'title 2'
+	assert searched == [QUERIES[:2], [QUERIES[2]]]
+	# only the queries missing from the result cache were encoded, for the semantic cache
+	assert search_engine.models.encoded[encoded:] == ['Where is LUNCH served?', QUERIES[2]]
+
+
+@pytest.mark.parametrize('query', QUERIES + ['vpn', ''])
+def test_the_async_endpoint_matches_the_sync_search(client, query):
+	expected = jsonable_encoder(search_documents(query, 3))
+	forget_searches()
+
+	response = client.get('/search', params={'query': query, 'top_k': 3})
+
+	assert response.status_code == 200
+	assert response.json() == expected
+
+
+def test_the_async_endpoint_runs_both_retrievers_and_logs_the_search(client, monkeypatch):
+	recorded = []
+	monkeypatch.setattr(SlowQueryLog, 'record', lambda query, trace, endpoint, **params: recorded.append(
+		(query, trace.stages, endpoint, params)))
+
+	response = client.get('/search', params={'query': QUERIES[0], 'top_k': 2, 'debug': True})
+
+	assert response.status_code == 200
+	assert titles(response.json()['results'])[0] == 'title 1'
+	timings = response.headers['Server-Timing']
+	assert 'bm25;dur=' in timings and 'faiss;dur=' in timings
+	[(query, stages, endpoint, params)] = recorded
+	assert (query, endpoint, params) == (QUERIES[0], 'search', {'mode': None, 'top_k': 2})
+	assert stages == response.json()['debug']['stages']
+
+
+def test_the_stream_refines_the_hits_until_the_results(client):
+	expected = jsonable_encoder(search_documents(QUERIES[0], 2))
+	forget_searches()
+
+	response = client.get('/search/stream', params={'query': QUERIES[0], 'top_k': 2})
+
+	assert response.status_code == 200
+	assert response.headers['content-type'].startswith('text/event-stream')
+	events = server_sent_events(response)
+	names = [event for event, _ in events]
+	assert names[0] == 'retrieval' and names[-2:] == ['results', 'done']
+	retrieval, results, done = events[0][1], events[-2][1], events[-1][1]
+	assert {hit['title'] for hit in retrieval} >= {'title 1', 'title 4'}
+	# one event per rerank stage that ran, in the order they ran
+	assert names[1:-2] == [stage for stage in done['stages'] if stage in names[1:-2]]
+	assert len(names) > 3
+	for _, hits in events[1:-2]:
+		assert hits[0]['title'] == 'title 1'
+	assert results == expected
+	assert done['stages'][:2] == ['retrieval', 'fusion']
+
+
+def test_a_semantic_cache_hit_skips_the_lexical_retrieval(client, monkeypatch):
+	client.get('/search/stream', params={'query': QUERIES[1]})
+
+	executor = ThreadPoolExecutor(1)
+	gate = threading.Event()
+	searched = []
+	search_lexical = search_logic._search_lexical
+
+	def _search_lexical(*args):
+		# holds the only retrieval thread, so the BM25 search queues behind it
+		executor.submit(gate.wait)
+		return search_lexical(*args)
+
+	monkeypatch.setattr(search_logic, 'RETRIEVAL_EXECUTOR', executor)
+	monkeypatch.setattr(search_logic, '_search_lexical', _search_lexical)
+	monkeypatch.setattr(Bm25Index.get(), 'search_with_scores', lambda *args: searched.append(args))
+
+	response = client.get('/search/stream', params={'query': 'Where is LUNCH served?'})
+	gate.set()
+	executor.shutdown(wait=True)
+
+	events = server_sent_events(response)
+	assert [event for event, _ in events] == ['results', 'done']
+	assert titles(events[0][1])[0] == 'title 2'
+	assert events[1][1]['stages'] == ['cache']
+	assert searched == []
+
+
+def test_answers_are_served_from_the_cache_until_reindexing(client, search_engine):
+	answered = search_engine.models.answered
+	params = {'query': QUERIES[0]}
+
+	first = client.get('/search/100/answer', params=params)
+
+	assert first.status_code == 200
+	assert {'content': 'To reset the VPN open the settings page.', 'bold': True} in first.json()['content']
+	assert len(answered) == 1
+
+	assert client.get('/search/100/answer', params=params).json() == first.json()
+	assert client.get('/search/100/answer', params={'query': QUERIES[0] + '  '}).json() == first.json()
+	assert len(answered) == 1
+
+	search_engine.index([document(5, ['Nothing to see here.'])])
+
+	assert client.get('/search/100/answer', params=params).json() == first.json()
+	assert len(answered) == 2
+
+
+def test_answers_of_unknown_paragraphs_are_not_found(client, search_engine):
+	assert client.get('/search/999/answer', params={'query': QUERIES[0]}).status_code == 404
+	assert search_engine.models.answered == []
@@ -0,0 +1,167 @@
+import re
+import zlib
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+import requests
+import torch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import search_logic
+from data_source.api import avatar_cache
+from data_source.api.avatar_cache import AvatarCache
+from indexing import bm25_index, faiss_index, paragraph_store
+from indexing.bm25_index import Bm25Index
+from indexing.facet_index import FacetIndex
+from indexing.faiss_index import MODEL_DIM, FaissIndex
+from indexing.index_generation import IndexGeneration
+from indexing.lookup_index import LookupIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore
+from indexing.suggestion_index import SuggestionIndex
+from schemas import Document
+from schemas.base import Base
+from searching.budget import StageCosts
+from searching.cache import LRUCache, SearchCache
+from searching.semantic_cache import SemanticQueryCache
+
+INDICES = (ParagraphStore, MetadataIndex, FacetIndex, SuggestionIndex, LookupIndex, Bm25Index, FaissIndex)
+
+
+@pytest.fixture
+def session(monkeypatch):
+	"""
+	An empty in-memory database, used by the indices that rebuild from the database.
+	"""
+	engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+	Base.metadata.create_all(engine)
+	session = sessionmaker(bind=engine)
+	for module in (paragraph_store, bm25_index):
+		monkeypatch.setattr(module, 'Session', session)
+	return session
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch, session):
+	"""
+	Moves the files of the indices to a temporary directory.
+	"""
+	monkeypatch.setattr(paragraph_store, 'PARAGRAPH_STORE_PATH', tmp_path / 'paragraph_store')
+	monkeypatch.setattr(bm25_index, 'BM25_INDEX_DIR', tmp_path / 'bm25')
+	monkeypatch.setattr(bm25_index, 'BM25_INDEX_PATH', str(tmp_path / 'bm25_index.bin'))
+	monkeypatch.setattr(faiss_index, 'FAISS_INDEX_PATH', str(tmp_path / 'faiss_index.bin'))
+	return tmp_path
+
+
+def words(text: str) -> List[str]:
+	return re.findall(r'\w+', text.lower())
+
+
+class FakeModels:
+	"""
+	Cheap stand-ins for the models, counting what they are asked:
+	the bi-encoder embeds the hashed bag of words, the cross-encoders score the query words found in the text
+	and QA answers with the first sentence of the context.
+	"""
+
+	def __init__(self) -> None:
+		self.encoded: List[str] = []
+		self.scored: List[tuple] = []
+		self.answered: List[tuple] = []
+
+	def encode(self, texts: List[str], convert_to_tensor: bool = True, show_progress_bar: bool = False):
+		self.encoded += texts
+		vectors = torch.zeros(len(texts), MODEL_DIM)
+		for row, text in enumerate(texts):
+			for word in words(text):
+				vectors[row, zlib.crc32(word.encode()) % MODEL_DIM] += 1
+		return torch.nn.functional.normalize(vectors, dim=1)
+
+	def score(self, cross_encoder, pairs: List[tuple]) -> List[float]:
+		self.scored += pairs
+		# shorter texts first among the same number of words, so the order is always the same
+		return [len(set(words(query)) & set(words(text))) - len(text) / 10000 for query, text in pairs]
+
+	def predict(self, pairs: List[tuple]) -> List[dict]:
+		self.answered += pairs
+		return [{'answer': re.split(r'(?<=[.!?])\s', context)[0], 'score': 0.5} for _, context in pairs]
+
+
+class SearchEngine:
+	"""
+	Indexes documents into empty indices like the Indexer does, and searches them with FakeModels.
+	"""
+
+	def __init__(self, models: FakeModels) -> None:
+		self.models = models
+
+	def index(self, documents: List[Document]):
+		for index in (ParagraphStore, MetadataIndex, FacetIndex, SuggestionIndex):
+			index.get().add_documents(documents)
+		paragraphs = [paragraph for document in documents for paragraph in document.paragraphs]
+		Bm25Index.get().add(paragraphs)
+		LookupIndex.get().add_documents(documents)
+		# like Indexer._add_metadata_for_indexing
+		embeddings = self.models.encode([f'{paragraph.content}; {paragraph.document.title}' for paragraph in paragraphs])
+		FaissIndex.get().update(np.array([paragraph.id for paragraph in paragraphs], dtype=np.int64), embeddings)
+		IndexGeneration.bump()
+
+
+@pytest.fixture
+def search_engine(storage, monkeypatch) -> SearchEngine:
+	for index in INDICES:
+		monkeypatch.setattr(index, 'instance', None)
+	for index in INDICES:
+		index.create()
+
+	models = FakeModels()
+	monkeypatch.setattr(search_logic, 'bi_encoder', SimpleNamespace(encode=models.encode))
+	monkeypatch.setattr(search_logic, 'cross_encoder_small',
+	                    SimpleNamespace(config=SimpleNamespace(name_or_path='small')))
+	monkeypatch.setattr(search_logic, 'cross_encoder_large',
+	                    SimpleNamespace(config=SimpleNamespace(name_or_path='large')))
+	monkeypatch.setattr(search_logic, '_predict_packed', models.score)
+	monkeypatch.setattr(search_logic, 'qa_scheduler', SimpleNamespace(predict=models.predict))
+
+	for cache in ('embeddings', 'scores', 'results', 'answers'):
+		monkeypatch.setattr(SearchCache, cache, LRUCache(getattr(SearchCache, cache).max_size))
+	monkeypatch.setattr(SemanticQueryCache, '_instance', None)
+	monkeypatch.setattr(StageCosts, 'record', classmethod(lambda cls, stage, items, elapsed_ms: None))
+	return SearchEngine(models)
+
+
+class ImageSession:
+	"""
+	Stands in for a connector's requests session, serving the images registered in images (url => (content type,
+	content)) and recording the urls requested.
+	"""
+
+	def __init__(self) -> None:
+		self.images: Dict[str, Tuple[str, bytes]] = {}
+		self.requested: List[str] = []
+
+	def get(self, url: str, timeout: float = None) -> requests.Response:
+		self.requested.append(url)
+		response = requests.Response()
+		response.url = url
+		response.status_code = 404
+		if url in self.images:
+			content_type, response._content = self.images[url]
+			response.headers['Content-Type'] = content_type
+			response.status_code = 200
+		return response
+
+
+@pytest.fixture
+def avatars(tmp_path, monkeypatch) -> ImageSession:
+	"""
+	An empty avatar cache in a temporary directory, returns the session to fetch the images with.
+	"""
+	monkeypatch.setattr(avatar_cache, 'AVATARS_PATH', tmp_path / 'avatars')
+	monkeypatch.setattr(AvatarCache, '_entries', None)
+	monkeypatch.setattr(AvatarCache, '_total_bytes', 0)
+	return ImageSession()
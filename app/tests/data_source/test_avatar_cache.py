@@ -0,0 +1,66 @@
+import os
+
+from data_source.api import avatar_cache
+from data_source.api.avatar_cache import AvatarCache
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+
+
+def test_fetched_images_are_served_under_their_hash(avatars):
+	avatars.images['https://wiki/alice.png'] = ('image/png; charset=binary', PNG)
+
+	avatar_hash = AvatarCache.fetch('https://wiki/alice.png', session=avatars)
+
+	assert avatar_hash == AvatarCache.avatar_hash('https://wiki/alice.png')
+	assert AvatarCache.url_for('https://wiki/alice.png') == f'/api/v1/avatars/{avatar_hash}'
+	path, content_type = AvatarCache.get(avatar_hash)
+	assert content_type == 'image/png'
+	with open(path, 'rb') as f:
+		assert f.read() == PNG
+
+	assert AvatarCache.fetch('https://wiki/alice.png', session=avatars) == avatar_hash
+	assert avatars.requested == ['https://wiki/alice.png']
+
+
+def test_svg_and_oversized_images_are_not_cached(avatars, monkeypatch):
+	monkeypatch.setattr(avatar_cache, 'MAX_AVATAR_BYTES', len(PNG) - 1)
+	avatars.images['https://wiki/alice.svg'] = ('image/svg+xml', b'<svg onload="alert(1)"/>')
+	avatars.images['https://wiki/bob.png'] = ('image/png', PNG)
+
+	assert AvatarCache.fetch('https://wiki/alice.svg', session=avatars) is None
+	assert AvatarCache.fetch('https://wiki/bob.png', session=avatars) is None
+	assert AvatarCache.fetch('https://wiki/missing.png', session=avatars) is None
+	assert AvatarCache.url_for('https://wiki/alice.svg') is None
+	assert AvatarCache.stats()['entries'] == 0
+	assert os.listdir(avatar_cache.AVATARS_PATH) == []
+
+
+def test_the_least_recently_used_images_are_evicted(avatars, monkeypatch):
+	monkeypatch.setattr(avatar_cache, 'AVATAR_CACHE_MAX_BYTES', 2 * len(PNG))
+	for name in ('alice', 'bob', 'carol'):
+		avatars.images[f'https://wiki/{name}.png'] = ('image/png', PNG)
+
+	alice = AvatarCache.fetch('https://wiki/alice.png', session=avatars)
+	bob = AvatarCache.fetch('https://wiki/bob.png', session=avatars)
+	# alice was shown since, so bob goes first
+	assert AvatarCache.get(alice) is not None
+	carol = AvatarCache.fetch('https://wiki/carol.png', session=avatars)
+
+	assert AvatarCache.get(bob) is None
+	assert AvatarCache.get(alice) is not None and AvatarCache.get(carol) is not None
+	assert sorted(os.listdir(avatar_cache.AVATARS_PATH)) == sorted([f'{alice}.png', f'{carol}.png'])
+	assert AvatarCache.stats()['bytes'] == 2 * len(PNG)
+
+
+def test_the_cache_is_reloaded_from_disk(avatars, monkeypatch):
+	avatars.images['https://wiki/alice.png'] = ('image/png', PNG)
+	alice = AvatarCache.fetch('https://wiki/alice.png', session=avatars)
+	# an svg cached before svg images were refused
+	(avatar_cache.AVATARS_PATH / f'{AvatarCache.avatar_hash("https://wiki/bob.svg")}.svg').write_bytes(b'<svg/>')
+
+	monkeypatch.setattr(AvatarCache, '_entries', None)
+	monkeypatch.setattr(AvatarCache, '_total_bytes', 0)
+
+	assert AvatarCache.url_for('https://wiki/alice.png') == f'/api/v1/avatars/{alice}'
+	assert AvatarCache.url_for('https://wiki/bob.svg') is None
+	assert AvatarCache.stats()['entries'] == 1
@@ -0,0 +1,76 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('atlassian')
+
+from data_source.api.avatar_cache import AvatarCache
+from data_source.sources.confluence import confluence
+from data_source.sources.confluence.confluence import ConfluenceDataSource
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+BASE_URL = 'https://wiki.example.com'
+
+
+def page(profile_picture: str) -> dict:
+	return {
+		'title': 'VPN guide',
+		'history': {'createdBy': {'displayName': 'Alice', 'profilePicture': {'path': profile_picture}}},
+		'body': {'storage': {'value': '<p>Restart the vpn client.</p>'}},
+		'_links': {'base': BASE_URL, 'webui': '/display/IT/VPN+guide'},
+	}
+
+
+@pytest.fixture
+def feed(avatars, monkeypatch):
+	"""
+	Feeds a Confluence page created by an author with the given profile picture, returns the indexed document.
+	"""
+	queued = []
+	monkeypatch.setattr(confluence.IndexQueue, 'get_instance',
+	                    staticmethod(lambda: SimpleNamespace(put_single=lambda doc: queued.append(doc))))
+
+	def feed(profile_picture: str):
+		data_source = ConfluenceDataSource.__new__(ConfluenceDataSource)
+		data_source._data_source_id = 1
+		data_source._confluence = SimpleNamespace(session=avatars,
+		                                          get_page_by_id=lambda doc_id, expand: page(profile_picture))
+		data_source._feed_doc({'lastModified': '2023-01-02T12:30:00.000Z', 'content': {'id': '42'},
+		                       'title': 'VPN guide', 'space_name': 'IT'})
+		return queued.pop()
+
+	return feed
+
+
+def test_the_author_image_is_cached_with_the_page(feed, avatars):
+	avatars.images[f'{BASE_URL}/download/attachments/1/alice.png'] = ('image/png', PNG)
+
+	doc = feed('/download/attachments/1/alice.png')
+
+	assert doc.author_image_url == f'{BASE_URL}/download/attachments/1/alice.png'
+	assert (doc.title, doc.author, doc.location) == ('VPN guide', 'Alice', 'IT')
+	assert doc.url == f'{BASE_URL}/display/IT/VPN+guide'
+	assert doc.timestamp == datetime.datetime(2023, 1, 2, 12, 30, tzinfo=datetime.timezone.utc)
+	avatar_hash = AvatarCache.avatar_hash(doc.author_image_url)
+	assert AvatarCache.url_for(doc.author_image_url) == f'/api/v1/avatars/{avatar_hash}'
+	assert AvatarCache.get(avatar_hash)[1] == 'image/png'
+
+
+def test_the_anonymous_avatar_is_fetched_as_png(feed, avatars):
+	avatars.images[f'{BASE_URL}/images/icons/profilepics/anonymous.png'] = ('image/png', PNG)
+
+	doc = feed('/images/icons/profilepics/anonymous.svg')
+
+	assert avatars.requested == [f'{BASE_URL}/images/icons/profilepics/anonymous.png']
+	assert AvatarCache.get(AvatarCache.avatar_hash(doc.author_image_url))[1] == 'image/png'
+
+
+def test_svg_author_images_are_not_cached(feed, avatars):
+	avatars.images[f'{BASE_URL}/download/attachments/1/alice.svg'] = ('image/svg+xml', b'<svg onload="alert(1)"/>')
+
+	doc = feed('/download/attachments/1/alice.svg')
+
+	# the page is still indexed, its results link the original image
+	assert doc.author_image_url == f'{BASE_URL}/download/attachments/1/alice.svg'
+	assert AvatarCache.url_for(doc.author_image_url) is None
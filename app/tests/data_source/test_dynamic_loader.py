@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from data_source.api import dynamic_loader
+from data_source.api.dynamic_loader import DynamicLoader
+
+SOURCES = {
+	'base.py': 'class BaseDataSource:\n    pass\n',
+	'slack.py': 'from base import BaseDataSource\n\n\nclass SlackDataSource(BaseDataSource):\n    pass\n',
+	'jira.py': 'class BaseDataSource:\n    pass\n\n\nclass JiraDataSource(BaseDataSource):\n    pass\n',
+}
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+	sources = tmp_path / 'sources'
+	sources.mkdir()
+	for name, source in SOURCES.items():
+		(sources / name).write_text(source)
+	monkeypatch.setattr(DynamicLoader, 'SOURCES_PATH', str(sources))
+	monkeypatch.setattr(dynamic_loader, 'CONNECTORS_MANIFEST_PATH', tmp_path / 'connectors_manifest.json')
+	monkeypatch.setattr(DynamicLoader, '_class_bases', None)
+	monkeypatch.setattr(DynamicLoader, '_loaded_classes', {})
+	return sources
+
+
+@pytest.fixture
+def parsed(monkeypatch) -> list:
+	"""
+	The files parsed for their classes.
+	"""
+	parsed = []
+	extract_class_bases = DynamicLoader.extract_class_bases
+
+	def extract(file_path: str):
+		parsed.append(file_path)
+		return extract_class_bases(file_path)
+
+	monkeypatch.setattr(DynamicLoader, 'extract_class_bases', staticmethod(extract))
+	return parsed
+
+
+def restart(monkeypatch):
+	monkeypatch.setattr(DynamicLoader, '_class_bases', None)
+	monkeypatch.setattr(DynamicLoader, '_loaded_classes', {})
+
+
+def test_data_sources_are_found_without_importing_them(sources, monkeypatch):
+	def load_module(*args):
+		raise AssertionError('a connector was imported')
+
+	monkeypatch.setattr(dynamic_loader.importlib.machinery.SourceFileLoader, 'load_module', load_module)
+
+	data_sources = DynamicLoader.find_data_sources()
+
+	assert {name: info.name for name, info in data_sources.items()} == {'slack': 'SlackDataSource',
+	                                                                     'jira': 'JiraDataSource'}
+	assert data_sources['jira'].file_path == str(sources / 'jira.py')
+
+
+def test_a_data_source_class_is_imported_once_on_demand(sources):
+	jira = DynamicLoader.get_data_source_class('jira')
+
+	assert jira.__name__ == 'JiraDataSource'
+	assert DynamicLoader.get_data_source_class('jira') is jira
+	assert list(DynamicLoader._loaded_classes) == [f'{sources / "jira.py"}:JiraDataSource']
+
+
+def test_the_manifest_spares_parsing_unchanged_files(sources, parsed, monkeypatch):
+	DynamicLoader.find_data_sources()
+	assert sorted(parsed) == sorted(str(sources / name) for name in SOURCES)
+	assert json.loads(dynamic_loader.CONNECTORS_MANIFEST_PATH.read_text())['version'] == DynamicLoader.MANIFEST_VERSION
+
+	restart(monkeypatch)
+	parsed.clear()
+	(sources / 'jira.py').write_text(SOURCES['jira.py'] + '\n\nclass JiraClient:\n    pass\n')
+
+	data_sources = DynamicLoader.find_data_sources()
+
+	assert parsed == [str(sources / 'jira.py')]
+	assert set(data_sources) == {'slack', 'jira'}
+	assert 'JiraClient' in DynamicLoader.get_class_bases()[str(sources / 'jira.py')]
+
+
+def test_a_manifest_of_another_version_is_ignored(sources, parsed, monkeypatch):
+	DynamicLoader.get_class_bases()
+	manifest = json.loads(dynamic_loader.CONNECTORS_MANIFEST_PATH.read_text())
+	manifest['version'] = DynamicLoader.MANIFEST_VERSION + 1
+	dynamic_loader.CONNECTORS_MANIFEST_PATH.write_text(json.dumps(manifest))
+
+	restart(monkeypatch)
+	parsed.clear()
+	DynamicLoader.get_class_bases()
+
+	assert len(parsed) == len(SOURCES)
+	assert json.loads(dynamic_loader.CONNECTORS_MANIFEST_PATH.read_text())['version'] == DynamicLoader.MANIFEST_VERSION
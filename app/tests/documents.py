@@ -0,0 +1,37 @@
+import datetime
+from typing import List, Optional
+
+from data_source.api.basic_document import BasicDocument, DocumentType
+from schemas import DataSource, DataSourceType, Document, Paragraph
+
+
+def data_source(id: int = 1, name: str = 'slack') -> DataSource:
+	return DataSource(id=id, type=DataSourceType(id=id, name=name, display_name=name.title(), config_fields='[]'))
+
+
+def document(id: int, contents: List[Optional[str]], parent_id: Optional[int] = None,
+             first_paragraph_id: Optional[int] = None, source: Optional[DataSource] = None, **fields) -> Document:
+	"""
+	A committed-looking document, its paragraphs get the ids id * 100, id * 100 + 1, ... unless told otherwise.
+	"""
+	first_paragraph_id = id * 100 if first_paragraph_id is None else first_paragraph_id
+	source = source if source is not None else data_source()
+	values = dict(id_in_data_source=f'source-{id}', type='message', title=f'title {id}', author='Ann',
+	              url=f'https://example.com/{id}', location='#general', is_active=True,
+	              timestamp=datetime.datetime(2023, 1, 1 + id % 28, 12, 30))
+	values.update(fields)
+	return Document(id=id, data_source_id=source.id, data_source=source, parent_id=parent_id,
+	                paragraphs=[Paragraph(id=first_paragraph_id + i, content=content)
+	                            for i, content in enumerate(contents)], **values)
+
+
+def basic_document(id: int, content: str, children: Optional[List[BasicDocument]] = None,
+                   **fields) -> BasicDocument:
+	"""
+	A document as a connector hands it to the Indexer, from the data source 1.
+	"""
+	values = dict(type=DocumentType.MESSAGE, title=f'title {id}', author='Ann', author_image_url=None,
+	              location='#general', url=f'https://example.com/{id}', is_active=True,
+	              timestamp=datetime.datetime(2023, 1, 1 + id % 28, 12, 30))
+	values.update(fields)
+	return BasicDocument(id=id, data_source_id=1, content=content, children=children, **values)
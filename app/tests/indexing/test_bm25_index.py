@@ -0,0 +1,216 @@
+import json
+import os
+import pickle
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from indexing import bm25_index
+from indexing.bm25_index import Bm25Index, _add_metadata_for_indexing, tokenize
+from indexing.bm25_segment import Bm25Segment
+from schemas import Paragraph
+from tests.documents import data_source, document
+
+source = data_source()
+words = [f'word{i}' for i in range(60)]
+# common and rare terms, repeated terms, a term of every paragraph (a negative idf) and an unknown one
+queries = ['word1', 'word2 word40', 'word3 word3 word59', 'Ann', 'slack word7', 'unknown word5', 'title']
+
+
+def paragraphs(ids: List[int], seed: int) -> List[Paragraph]:
+	rng = random.Random(seed)
+	# a few words are much more frequent than the others
+	contents = [' '.join(rng.choice(words[:rng.choice([8, 60])]) for _ in range(rng.randint(1, 30))) for _ in ids]
+	return [document(id, [content], first_paragraph_id=id, source=source).paragraphs[0]
+	        for id, content in zip(ids, contents)]
+
+
+def assert_parity(index: Bm25Index, corpus: Dict[int, Paragraph]):
+	"""
+	The index scores every live paragraph exactly like BM25Okapi over them.
+	"""
+	ids = sorted(corpus)
+	reference = BM25Okapi([tokenize(_add_metadata_for_indexing(corpus[id])) for id in ids])
+	assert len(index) == len(ids)
+	for query in queries:
+		expected = dict(zip(ids, reference.get_scores(tokenize(query))))
+		actual = dict(index.search_with_scores(query, len(ids)))
+		assert actual.keys() == expected.keys()
+		assert [actual[id] for id in ids] == pytest.approx([expected[id] for id in ids], rel=1e-9, abs=1e-12)
+
+		top = index.search_with_scores(query, 5)
+		assert [score for _, score in top] == pytest.approx(sorted(expected.values(), reverse=True)[:5],
+		                                                    rel=1e-9, abs=1e-12)
+
+
+def wait_for_merges(index: Bm25Index):
+	while True:
+		Bm25Index._merge_executor.submit(lambda: None).result()
+		with index._lock:
+			if not index._merging and not index._merge_candidates(index._view.segments):
+				return
+
+
+def referenced_files() -> set:
+	with open(bm25_index.BM25_INDEX_DIR / 'manifest.json') as f:
+		manifest = json.load(f)
+	files = {'manifest.json', 'vocabulary.txt'}
+	for entry in manifest['segments']:
+		files.add(entry['name'])
+		if entry['dead'] is not None:
+			files.add(entry['dead'])
+	return files
+
+
+@pytest.fixture
+def corpus(storage, monkeypatch) -> Dict[int, Paragraph]:
+	monkeypatch.setattr(bm25_index, 'MAX_SEGMENTS', 3)
+	return {paragraph.id: paragraph for paragraph in paragraphs(list(range(1, 101)), seed=0)}
+
+
+def test_add_remove_and_re_add_match_bm25_okapi(corpus):
+	index = Bm25Index()
+	assert len(index) == 0
+	assert index.search_with_scores('word1', 10) == []
+
+	live = {}
+	for batch in range(5):
+		added = [corpus[id] for id in range(batch * 20 + 1, batch * 20 + 21)]
+		index.add(added)
+		live.update({paragraph.id: paragraph for paragraph in added})
+	wait_for_merges(index)
+	assert_parity(index, live)
+
+	removed = list(range(1, 101, 3)) + [1000]
+	index.remove(removed)
+	for id in removed:
+		live.pop(id, None)
+	assert_parity(index, live)
+
+	# re-added paragraphs replace their previous version, wherever it is
+	re_added = paragraphs(list(range(1, 101, 4)), seed=1)
+	index.add(re_added)
+	live.update({paragraph.id: paragraph for paragraph in re_added})
+	assert_parity(index, live)
+
+	wait_for_merges(index)
+	assert_parity(index, live)
+	assert len(index._view.segments) <= bm25_index.MAX_SEGMENTS
+	assert set(os.listdir(bm25_index.BM25_INDEX_DIR)) == referenced_files()
+
+
+def test_allowed_ids_and_match_ids(corpus):
+	index = Bm25Index()
+	index.add(list(corpus.values()))
+	index.remove([2, 4])
+
+	allowed = np.array([1, 2, 3, 5, 8, 13], dtype=np.int64)
+	assert sorted(id for id, _ in index.search_with_scores('word1', 10, allowed)) == [1, 3, 5, 8, 13]
+	assert index.search('word1', 10, np.empty(0, dtype=np.int64)) == []
+
+	matching = {id for id, paragraph in corpus.items() if 'word1' in tokenize(paragraph.content)} - {2, 4}
+	assert set(index.match_ids('word1 unknown').tolist()) == matching
+
+
+def test_reopen_from_the_manifest(corpus):
+	index = Bm25Index()
+	index.add([corpus[id] for id in range(1, 51)])
+	index.add([corpus[id] for id in range(51, 101)])
+	index.remove([5, 60])
+	live = {id: paragraph for id, paragraph in corpus.items() if id not in (5, 60)}
+	wait_for_merges(index)
+
+	reopened = Bm25Index()
+	assert reopened._view.vocabulary == index._view.vocabulary
+	assert_parity(reopened, live)
+
+	# the vocabulary only gets the new terms appended
+	new = document(200, ['brand new terms'], first_paragraph_id=200, source=source).paragraphs[0]
+	reopened.add([new])
+	reopened.remove([6])
+	live[200] = new
+	del live[6]
+	wait_for_merges(reopened)
+	assert_parity(Bm25Index(), live)
+
+
+def test_clear(corpus):
+	index = Bm25Index()
+	index.add(list(corpus.values()))
+	index.clear()
+
+	assert len(index) == 0
+	assert index.search('word1', 10) == []
+	assert len(Bm25Index()) == 0
+	assert set(os.listdir(bm25_index.BM25_INDEX_DIR)) == referenced_files()
+
+
+def test_a_merge_keeps_the_paragraphs_removed_while_it_runs(corpus, monkeypatch):
+	index = Bm25Index()
+	merge = Bm25Segment.merge
+	removed = [3, 30, 45, 77]
+	merges = []
+
+	def merge_and_remove(name, segments):
+		merged = merge(name, segments)
+		if not merges:
+			# the merge has read the segments, the paragraphs are removed before it commits
+			index.remove(removed)
+		merges.append(name)
+		return merged
+
+	monkeypatch.setattr(Bm25Segment, 'merge', staticmethod(merge_and_remove))
+	for batch in range(5):
+		index.add([corpus[id] for id in range(batch * 20 + 1, batch * 20 + 21)])
+	wait_for_merges(index)
+
+	assert merges
+	live = {id: paragraph for id, paragraph in corpus.items() if id not in removed}
+	assert_parity(index, live)
+	assert not any(index.search_with_scores('word1', 100, np.array(removed, dtype=np.int64)))
+	assert_parity(Bm25Index(), live)
+	assert set(os.listdir(bm25_index.BM25_INDEX_DIR)) == referenced_files()
+
+
+def test_segments_with_many_dead_paragraphs_are_rewritten(corpus, monkeypatch):
+	monkeypatch.setattr(bm25_index, 'MAX_DEAD_RATIO', 0.3)
+	index = Bm25Index()
+	index.add(list(corpus.values()))
+	index.remove(list(range(1, 51)))
+	wait_for_merges(index)
+
+	[segment] = index._view.segments
+	assert len(segment) == segment.live_count == 50
+	assert_parity(index, {id: paragraph for id, paragraph in corpus.items() if id > 50})
+
+
+def test_migrate_a_pickled_index(corpus):
+	ids = sorted(corpus)
+	legacy = Bm25Index.__new__(Bm25Index)
+	legacy.index = BM25Okapi([tokenize(_add_metadata_for_indexing(corpus[id])) for id in ids])
+	legacy.id_map = ids
+	with open(bm25_index.BM25_INDEX_PATH, 'wb') as f:
+		pickle.dump(legacy, f)
+
+	index = Bm25Index()
+	assert not os.path.exists(bm25_index.BM25_INDEX_PATH)
+	assert_parity(index, corpus)
+	assert_parity(Bm25Index(), corpus)
+
+
+def test_an_unreadable_pickle_is_rebuilt_from_the_database(corpus, session):
+	# a new source, the shared one refers to every document built with it
+	database_source = data_source()
+	with session() as s:
+		s.add_all([document(id, [f'word{id} rebuilt'], source=database_source) for id in (1, 2, 3)])
+		s.commit()
+	with open(bm25_index.BM25_INDEX_PATH, 'wb') as f:
+		f.write(b'not a pickle')
+
+	index = Bm25Index()
+	assert not os.path.exists(bm25_index.BM25_INDEX_PATH)
+	assert len(index) == 3
+	assert index.search('word2', 1) == [200]
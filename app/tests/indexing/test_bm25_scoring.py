@@ -0,0 +1,264 @@
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from indexing import bm25_scoring
+from indexing.bm25_index import Bm25Index, _IndexView
+from indexing.bm25_scoring import EMPTY_STATS, _query, pruned_top_k, score_segment, top_k
+from indexing.bm25_segment import Bm25Segment
+
+
+class Corpus:
+	"""
+	Segments over tokenized paragraphs, and BM25Okapi over the live ones to compare with.
+	"""
+
+	def __init__(self, batches: List[Dict[int, List[str]]]):
+		self.vocabulary = {}
+		self.tokens = {}
+		segments = []
+		stats = EMPTY_STATS
+		for i, batch in enumerate(batches):
+			segment = Bm25Segment.build_from_tokens(f'segment.{i}', list(batch), list(batch.values()), self.vocabulary)
+			segments.append(segment)
+			stats = Bm25Index._with(stats, segment)
+			self.tokens.update(batch)
+		self.view = _IndexView(tuple(segments), stats, self.vocabulary)
+
+	def remove(self, ids: List[int]):
+		segments, _, stats = Bm25Index._without(self.view, np.array(ids, dtype=np.int64))
+		self.view = _IndexView(tuple(segments), stats, self.vocabulary)
+		for id in ids:
+			del self.tokens[id]
+
+	def term_ids(self, query: str) -> list:
+		return [self.vocabulary.get(term) for term in query.split()]
+
+	def expected(self, query: str) -> Dict[int, float]:
+		ids = sorted(self.tokens)
+		scores = BM25Okapi([self.tokens[id] for id in ids]).get_scores(query.split())
+		return dict(zip(ids, scores))
+
+	def search(self, search, query: str, k: int, allowed_ids=None) -> list:
+		return search(self.view.segments, self.view.stats, self.term_ids(query), k, allowed_ids)
+
+
+def skewed_batches(sizes: List[int], seed: int = 0) -> List[Dict[int, List[str]]]:
+	"""
+	Paragraphs of Zipf-distributed words: a few are in most paragraphs, most are rare.
+	"""
+	rng = random.Random(seed)
+	words = [f'w{i}' for i in range(500)]
+	weights = [1 / (i + 1) for i in range(len(words))]
+	batches, next_id = [], 1
+	for size in sizes:
+		batches.append({id: rng.choices(words, weights, k=rng.randint(1, 60)) for id in range(next_id, next_id + size)})
+		next_id += size
+	return batches
+
+
+queries = ['w0', 'w1 w2', 'w3 w3 w120', 'w250', 'w0 w1 w2 w3 w4', 'w7 unknown w499', 'unknown']
+
+
+def assert_scores(results: list, expected: Dict[int, float], k: int):
+	"""
+	The results are the k best of the expected scores, best first, each with its own score.
+	"""
+	assert len(results) == min(k, len(expected))
+	assert len({id for id, _ in results}) == len(results)
+	scores = [score for _, score in results]
+	assert scores == sorted(scores, reverse=True)
+	assert scores == pytest.approx(sorted(expected.values(), reverse=True)[:k], rel=1e-9, abs=1e-12)
+	assert [expected[id] for id, _ in results] == pytest.approx(scores, rel=1e-9, abs=1e-12)
+
+
+@pytest.fixture
+def corpus() -> Corpus:
+	return Corpus(skewed_batches([700, 40, 500, 300]))
+
+
+@pytest.mark.parametrize('ratio', [0.0, float('inf')], ids=['dense', 'sparse'])
+def test_score_segment_matches_bm25_okapi(corpus, monkeypatch, ratio):
+	monkeypatch.setattr(bm25_scoring, 'DENSE_POSTINGS_RATIO', ratio)
+	stats = corpus.view.stats
+	for query in queries:
+		expected = corpus.expected(query)
+		term_ids, idfs = _query(stats, corpus.term_ids(query))
+		for segment in corpus.view.segments:
+			positions, scores = score_segment(segment, term_ids, idfs, stats.total_length / stats.count)
+			if positions is None:
+				assert ratio == 0.0 and len(scores) == len(segment)
+				positions = np.arange(len(segment))
+			actual = dict(zip(segment.ids[positions].tolist(), scores))
+			# the paragraphs left out score 0
+			assert [actual.get(id, 0.0) for id in segment.ids.tolist()] == \
+			       pytest.approx([expected[id] for id in segment.ids.tolist()], rel=1e-9, abs=1e-12)
+
+
+def test_score_segment_counts_repeated_terms_again(corpus):
+	stats = corpus.view.stats
+	segment = corpus.view.segments[0]
+	once = score_segment(segment, *_query(stats, corpus.term_ids('w5 w9')), stats.total_length / stats.count)
+	twice = score_segment(segment, *_query(stats, corpus.term_ids('w5 w9 w5')), stats.total_length / stats.count)
+	w5 = score_segment(segment, *_query(stats, corpus.term_ids('w5')), stats.total_length / stats.count)
+
+	def dense(result):
+		scores = np.zeros(len(segment))
+		positions, values = result
+		scores[np.arange(len(segment)) if positions is None else positions] = values
+		return scores
+
+	assert dense(twice) == pytest.approx(dense(once) + dense(w5))
+
+
+@pytest.mark.parametrize('ratio', [0.0, float('inf')], ids=['dense', 'sparse'])
+def test_top_k_matches_bm25_okapi(corpus, monkeypatch, ratio):
+	monkeypatch.setattr(bm25_scoring, 'DENSE_POSTINGS_RATIO', ratio)
+	for query in queries:
+		expected = corpus.expected(query)
+		for k in (1, 10, 100):
+			assert_scores(corpus.search(top_k, query, k), expected, k)
+		# every paragraph, the ones without the terms filled in with 0
+		results = dict(corpus.search(top_k, query, len(expected) + 10))
+		assert results.keys() == expected.keys()
+		assert [results[id] for id in expected] == pytest.approx(list(expected.values()), rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize('ratio', [0.0, float('inf')], ids=['dense', 'sparse'])
+def test_top_k_zero_fill_respects_allowed_ids_and_dead_paragraphs(corpus, monkeypatch, ratio):
+	monkeypatch.setattr(bm25_scoring, 'DENSE_POSTINGS_RATIO', ratio)
+	corpus.remove(list(range(1, 1540, 7)))
+	allowed = np.array([id for id in range(0, 1600, 3) if id % 2 == 0], dtype=np.int64)
+	for query in ('w499', 'w250 w251', 'unknown'):
+		expected = corpus.expected(query)
+		allowed_expected = {id: score for id, score in expected.items() if id in set(allowed.tolist())}
+
+		results = dict(corpus.search(top_k, query, len(expected)))
+		assert results.keys() == expected.keys()
+		results = dict(corpus.search(top_k, query, len(expected), allowed))
+		assert results.keys() == allowed_expected.keys()
+		assert [results[id] for id in results] == pytest.approx([allowed_expected[id] for id in results])
+		assert_scores(corpus.search(top_k, query, 20, allowed), allowed_expected, 20)
+
+
+def test_empty_corpus_and_k():
+	corpus = Corpus([])
+	assert corpus.search(top_k, 'w0', 10) == []
+	assert corpus.search(pruned_top_k, 'w0', 10) == []
+
+	corpus = Corpus(skewed_batches([50]))
+	assert corpus.search(top_k, 'w0', 0) == []
+	assert corpus.search(pruned_top_k, 'w0', 0) == []
+
+
+@pytest.fixture
+def calls(monkeypatch) -> list:
+	"""
+	The queries pruned_top_k hands to top_k.
+	"""
+	calls = []
+
+	def counting_top_k(segments, stats, term_ids, k, allowed_ids=None):
+		calls.append(term_ids)
+		return top_k(segments, stats, term_ids, k, allowed_ids)
+
+	monkeypatch.setattr(bm25_scoring, 'top_k', counting_top_k)
+	return calls
+
+
+def test_pruned_top_k_matches_top_k_on_a_skewed_corpus(corpus, calls):
+	for query in queries:
+		expected = corpus.expected(query)
+		for k in (1, 5, 10, 50, 2000):
+			pruned = corpus.search(pruned_top_k, query, k)
+			assert_scores(pruned, expected, k)
+			assert [score for _, score in pruned] == \
+			       pytest.approx([score for _, score in corpus.search(top_k, query, k)], rel=1e-9, abs=1e-12)
+
+
+def test_pruned_top_k_prunes_selective_queries(corpus, calls, monkeypatch):
+	monkeypatch.setattr(bm25_scoring, 'FIRST_ROUND_BLOCKS', 1)
+	# a rare term is in a few blocks, a common one leaves the blocks bounded below the k-th score
+	for query in ('w250', 'w499 w0'):
+		assert_scores(corpus.search(pruned_top_k, query, 3), corpus.expected(query), 3)
+	assert calls == []
+
+
+@pytest.mark.parametrize('k', [1, 10, 100])
+def test_pruned_top_k_with_allowed_ids_and_dead_paragraphs(corpus, calls, k):
+	corpus.remove(sorted(set(range(1, 1540, 5)) | set(range(720, 730))))
+	allowed = np.array(sorted(random.Random(1).sample(range(1, 1541), 400)), dtype=np.int64)
+	for query in queries:
+		expected = corpus.expected(query)
+		allowed_expected = {id: score for id, score in expected.items() if id in set(allowed.tolist())}
+
+		assert_scores(corpus.search(pruned_top_k, query, k), expected, k)
+		assert_scores(corpus.search(pruned_top_k, query, k, allowed), allowed_expected, k)
+		assert corpus.search(pruned_top_k, query, k, np.empty(0, dtype=np.int64)) == []
+		# the dead paragraphs are never found, even when allowed
+		dead = np.array([1, 6, 721], dtype=np.int64)
+		assert corpus.search(pruned_top_k, query, k, dead) == []
+
+
+def test_pruned_top_k_fills_in_paragraphs_without_the_terms(corpus, calls):
+	corpus.remove(list(range(1, 1540, 3)))
+	expected = corpus.expected('w499')
+	matching = sum(1 for score in expected.values() if score > 0)
+
+	results = corpus.search(pruned_top_k, 'w499', matching + 20)
+	assert_scores(results, expected, matching + 20)
+	assert all(id in expected for id, _ in results)
+	assert sum(1 for _, score in results if score == 0) == 20
+
+
+def test_pruned_top_k_hands_unprunable_queries_to_top_k(corpus, calls, monkeypatch):
+	monkeypatch.setattr(bm25_scoring, 'FIRST_ROUND_BLOCKS', 1)
+	monkeypatch.setattr(bm25_scoring, 'EXHAUSTIVE_BLOCKS_RATIO', 0.0)
+	expected = corpus.expected('w0 w1')
+
+	assert_scores(corpus.search(pruned_top_k, 'w0 w1', 10), expected, 10)
+	assert len(calls) == 1
+
+	# without the fallback, every block gets scored
+	monkeypatch.setattr(bm25_scoring, 'EXHAUSTIVE_BLOCKS_RATIO', 1.0)
+	assert_scores(corpus.search(pruned_top_k, 'w0 w1', 10), expected, 10)
+	assert len(calls) == 1
+
+
+def test_pruned_top_k_hands_queries_without_terms_to_top_k(corpus, calls):
+	expected = corpus.expected('unknown')
+
+	assert_scores(corpus.search(pruned_top_k, 'unknown', 10), expected, 10)
+	assert len(calls) == 1
+
+
+def test_pruned_top_k_with_negative_idfs(calls):
+	# most terms are in every paragraph: the average idf and so the floored idfs are negative
+	common = ['a', 'b', 'c', 'd']
+	corpus = Corpus([{id: common + ['x'] * (id % 2 + 1) + (['y'] if id % 20 == 0 else []) for id in range(1, 101)},
+	                 {id: common + (['x'] if id % 3 else ['z', 'z']) for id in range(101, 301)}])
+	assert corpus.view.stats.average_idf < 0
+
+	for query in ('a', 'a y', 'x', 'y x x', 'b c', 'y', 'z y'):
+		expected = corpus.expected(query)
+		for k in (1, 10, 300):
+			assert_scores(corpus.search(pruned_top_k, query, k), expected, k)
+	assert calls
+
+
+def test_pruned_top_k_with_epsilon_floored_idfs(calls):
+	# terms in more than half the paragraphs get EPSILON times the (positive) average idf
+	corpus = Corpus([{id: ['common'] + [f'u{id}', f'v{id % 7}'] for id in range(1, 201)},
+	                 {id: (['common'] if id % 4 else []) + [f'u{id}'] for id in range(201, 401)}])
+	assert corpus.view.stats.average_idf > 0
+	stats = corpus.view.stats
+	assert stats.idf(corpus.vocabulary['common']) == pytest.approx(bm25_scoring.EPSILON * stats.average_idf)
+
+	for query in ('common', 'common v3', 'u250 common'):
+		expected = corpus.expected(query)
+		for k in (1, 10, 400):
+			assert_scores(corpus.search(pruned_top_k, query, k), expected, k)
+	assert calls == []
@@ -0,0 +1,139 @@
+import numpy as np
+
+from indexing import bm25_segment
+from indexing.bm25_segment import Bm25Segment, _decode_varints, _encode_varints
+
+edge_values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 31 - 1, 2 ** 31, 2 ** 32,
+               2 ** 35 + 5, 2 ** 56, 2 ** 62, 2 ** 63 - 1]
+
+
+def test_varint_round_trip():
+	values = np.array(edge_values + edge_values[::-1], dtype=np.int64)
+	data, ends = _encode_varints(values)
+
+	assert data.dtype == np.uint8
+	assert np.array_equal(_decode_varints(data), values)
+	# where every value ends, 7 bits a byte
+	sizes = np.diff(np.append(0, ends))
+	assert sizes[:4].tolist() == [1, 1, 1, 2]
+	assert sizes[edge_values.index(2 ** 31)] == 5
+	assert sizes[edge_values.index(2 ** 63 - 1)] == 9
+	# the high bit is set on all but the last byte of each value
+	assert np.array_equal(np.flatnonzero(data < 0x80), ends - 1)
+
+
+def test_varint_known_encodings():
+	assert _encode_varints(np.array([0, 127, 128, 300]))[0].tolist() == [0x00, 0x7f, 0x80, 0x01, 0xac, 0x02]
+
+
+def test_varint_random_round_trip():
+	rng = np.random.default_rng(0)
+	values = (rng.integers(0, 2 ** 62, 5000) >> rng.integers(0, 62, 5000)).astype(np.int64)
+	assert np.array_equal(_decode_varints(_encode_varints(values)[0]), values)
+
+
+def test_varint_empty_and_single_byte():
+	data, ends = _encode_varints(np.empty(0, dtype=np.int64))
+	assert len(data) == len(ends) == 0
+	assert len(_decode_varints(data)) == 0
+	assert _decode_varints(np.array([0, 5, 127], dtype=np.uint8)).tolist() == [0, 5, 127]
+
+
+def vocabulary() -> dict:
+	return {term: term_id for term_id, term in enumerate(['a', 'b', 'c0', 'c1', 'c2', 'c3', 'c4'])}
+
+
+def tokens(position: int) -> list:
+	# 'a' is in every paragraph, 'b' in some of them, more than once
+	return ['a'] + ['b'] * (position % 3) + [f'c{position % 5}']
+
+
+def segment(name: str = 'segment.0') -> Bm25Segment:
+	return Bm25Segment.build_from_tokens(name, list(range(1000, 1300)), [tokens(i) for i in range(300)],
+	                                     vocabulary())
+
+
+def assert_same(actual: Bm25Segment, expected: Bm25Segment):
+	for array in bm25_segment._ARRAYS + ('live', 'dead_frequencies'):
+		assert np.array_equal(getattr(actual, array), getattr(expected, array)), array
+	assert actual.live_count == expected.live_count
+	for row in range(len(expected.term_ids)):
+		for actual_postings, expected_postings in zip(actual.row_postings(row), expected.row_postings(row)):
+			assert np.array_equal(actual_postings, expected_postings)
+	assert [counts.tolist() for counts in actual.document_frequencies()] == \
+	       [counts.tolist() for counts in expected.document_frequencies()]
+
+
+def test_postings():
+	built = segment()
+	term_ids, counts = built.document_frequencies()
+	assert term_ids.tolist() == list(range(7))
+	# a, b, c0 ... c4
+	assert counts.tolist() == [300, 200, 60, 60, 60, 60, 60]
+
+	positions, frequencies = built.postings(1)
+	assert positions.tolist() == [i for i in range(300) if i % 3]
+	assert frequencies.tolist() == [i % 3 for i in range(300) if i % 3]
+	assert [len(postings) for postings in built.postings(99)] == [0, 0]
+
+
+def test_save_and_load(tmp_path):
+	built = segment()
+	built.save(tmp_path / built.name)
+	loaded = Bm25Segment.load(built.name, tmp_path / built.name)
+
+	assert isinstance(loaded.position_bytes, np.memmap)
+	assert_same(loaded, built)
+
+
+def test_dead_paragraphs_are_reloaded(tmp_path):
+	built = segment()
+	built.save(tmp_path / built.name)
+	dead = built.without(np.array([0, 1, 2, 150, 299])).without(np.array([2, 3]))
+	assert dead.live_count == 294
+	assert dead.dead_frequencies.tolist() == [6, 3, 2, 1, 1, 1, 1]
+	dead.save_dead(tmp_path / 'segment.0.dead.1.npz')
+
+	loaded = Bm25Segment.load(built.name, tmp_path / built.name, tmp_path / 'segment.0.dead.1.npz')
+	assert_same(loaded, dead)
+	assert np.array_equal(loaded.live_positions_of(np.array([1000, 1004, 1299])), [4])
+
+
+def test_merge_drops_the_dead_paragraphs():
+	first, second = segment('segment.0'), segment('segment.1')
+	second = Bm25Segment(**{**second.__dict__, 'ids': second.ids + 1000})
+	merged = Bm25Segment.merge('segment.2', [first.without(np.arange(0, 300, 2)), second.without(np.arange(100))])
+
+	assert merged.ids.tolist() == list(range(1001, 1300, 2)) + list(range(2100, 2300))
+	assert merged.live_count == len(merged)
+	expected = Bm25Segment.build_from_tokens(
+		'expected', merged.ids.tolist(), [tokens(i) for i in list(range(1, 300, 2)) + list(range(100, 300))],
+		vocabulary())
+	assert_same(merged, Bm25Segment(**{**expected.__dict__, 'name': 'segment.2'}))
+
+
+def test_marking_paragraphs_dead_only_decodes_their_terms(monkeypatch):
+	built = segment()
+
+	def decode_positions(*args):
+		raise AssertionError('the postings were decoded')
+
+	monkeypatch.setattr(Bm25Segment, '_decode_positions', decode_positions)
+	dead = built.without(np.arange(0, 300, 4))
+
+	assert dead.dead_frequencies.tolist() == [75, 50, 15, 15, 15, 15, 15]
+	# those are dead already
+	assert dead.without(np.arange(0, 300, 8)) is dead
+
+
+def test_term_rows():
+	built = Bm25Segment.build_from_tokens('segment.0', [1, 2, 3, 4], [tokens(7), [], ['c4', 'a'], tokens(2)],
+	                                      vocabulary())
+	# the rows of the segment's terms: a, b, c2, c4
+	assert built.term_ids.tolist() == [0, 1, 4, 6]
+	expected = [[], [0, 3], [0, 1, 2]]
+
+	assert built.term_rows(np.array([1, 2, 0])).tolist() == [row for rows in expected for row in rows]
+	assert built.term_rows(np.array([1])).tolist() == []
+	assert built.term_rows(np.array([], dtype=np.int64)).tolist() == []
+	assert built.without(np.array([1, 3])).dead_frequencies.tolist() == [1, 1, 1, 0]
@@ -0,0 +1,107 @@
+import pytest
+
+from indexing import facet_index
+from indexing.facet_index import FacetIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore
+from tests.documents import data_source, document
+
+slack = data_source(1, 'slack')
+jira = data_source(2, 'jira')
+
+
+def documents():
+	return [document(1, ['a', 'b', 'c'], source=slack, author='Ann'),
+	        document(2, ['d'], source=jira, type='issue', author='Bob', location='PROJ'),
+	        document(3, ['e', 'f'], parent_id=2, source=jira, type='comment', author='Ann', location='PROJ'),
+	        document(4, ['g'], source=slack, author=None, location=None, type=None),
+	        document(5, [], source=slack, author='Empty')]
+
+
+@pytest.fixture
+def indices(storage, monkeypatch):
+	for index in (ParagraphStore, MetadataIndex, FacetIndex):
+		monkeypatch.setattr(index, 'instance', None)
+		index.create()
+	indexed = documents()
+	for index in (ParagraphStore, MetadataIndex, FacetIndex):
+		index.get().add_documents(indexed)
+	return ParagraphStore.get(), MetadataIndex.get(), FacetIndex.get()
+
+
+all_paragraphs = [100, 101, 102, 200, 300, 301, 400]
+
+
+def test_counts(indices):
+	_, _, facets = indices
+	assert facets.counts(all_paragraphs) == {
+		'data_source': {'slack': 4, 'jira': 3},
+		'type': {'message': 3, 'comment': 2, 'issue': 1},
+		'location': {'#general': 3, 'PROJ': 3},
+		'author': {'Ann': 5, 'Bob': 1},
+	}
+	assert facets.counts([101, 300, 999]) == {'data_source': {'slack': 1, 'jira': 1},
+	                                          'type': {'message': 1, 'comment': 1},
+	                                          'location': {'#general': 1, 'PROJ': 1}, 'author': {'Ann': 2}}
+	assert facets.counts([]) == {'data_source': {}, 'type': {}, 'location': {}, 'author': {}}
+
+
+def test_counts_are_limited_to_the_top_values(indices):
+	_, _, facets = indices
+	counts = facets.counts(all_paragraphs, limit=1)
+	assert counts['data_source'] == {'slack': 4}
+	assert counts['type'] == {'message': 3}
+	assert counts['author'] == {'Ann': 5}
+	assert all(len(values) <= 1 for values in counts.values())
+
+
+def test_none_values_are_skipped(indices):
+	_, metadata, facets = indices
+	# paragraph 400 has no author, type or location
+	assert facets.counts([400]) == {'data_source': {'slack': 1}, 'type': {}, 'location': {}, 'author': {}}
+	authors = {value: ids.tolist() for value, ids in metadata.column_values('author')}
+	assert authors == {'Ann': [100, 101, 102, 300, 301], 'Bob': [200]}
+	# documents without paragraphs have nothing to count
+	assert 'Empty' not in facets.counts(all_paragraphs)['author']
+
+
+def test_rebuild_agrees_with_incremental_updates(indices):
+	store, metadata, facets = indices
+	store.remove_documents([2])
+	removed = metadata.remove_documents([2])
+	facets.remove_paragraphs(removed.tolist())
+	added = [document(6, ['h', 'i'], source=jira, type='issue', author='Cid')]
+	for index in (store, metadata, facets):
+		index.add_documents(added)
+
+	paragraphs = all_paragraphs + [600, 601]
+	incremental = facets.counts(paragraphs)
+	assert incremental['author'] == {'Ann': 3, 'Cid': 2}
+	facets.rebuild()
+	assert facets.counts(paragraphs) == incremental
+	assert FacetIndex().counts(paragraphs) == incremental
+
+
+def test_removing_the_last_paragraphs_drops_the_value(indices):
+	_, _, facets = indices
+	facets.remove_paragraphs([200])
+	facets.remove_paragraphs([])
+	assert 'issue' not in facets.counts(all_paragraphs)['type']
+	assert facets.counts(all_paragraphs)['author'] == {'Ann': 5}
+
+
+def test_facets_with_many_values_are_counted_from_the_metadata(indices, monkeypatch):
+	store, metadata, facets = indices
+	added = [document(10 + i, ['x', 'y'][:1 + i % 2], source=jira, author=f'author {i % 7}', location=f'#{i % 3}')
+	         for i in range(30)]
+	for index in (store, metadata, facets):
+		index.add_documents(added)
+	paragraph_sets = [all_paragraphs, [1000, 1101, 1200, 1900, 2901, 999], [id for id in range(100, 4000)], []]
+
+	intersected = [facets.counts(paragraphs) for paragraphs in paragraph_sets]
+	monkeypatch.setattr(facet_index, 'MAX_INTERSECTED_VALUES', 0)
+	counted = [facets.counts(paragraphs) for paragraphs in paragraph_sets]
+
+	assert counted == intersected
+	assert counted[1]['author'] == {'author 2': 2, 'author 0': 1, 'author 1': 1, 'author 5': 1}
+	assert counted[1]['location'] == {'#0': 2, '#1': 2, '#2': 1}
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from indexing import index_documents
+from indexing.bm25_index import Bm25Index
+from indexing.faiss_index import FaissIndex
+from indexing.index_documents import Indexer
+from indexing.paragraph_store import ParagraphStore
+from schemas import Document
+from tests.documents import basic_document, data_source
+
+
+@pytest.fixture
+def indexer(search_engine, session, monkeypatch):
+	monkeypatch.setattr(index_documents, 'Session', session)
+	monkeypatch.setattr(index_documents, 'bi_encoder', SimpleNamespace(encode=search_engine.models.encode))
+	with session() as db:
+		db.add(data_source())
+		db.commit()
+	return session
+
+
+def indexed_ids(index: FaissIndex) -> set:
+	return set(index.index.id_map.at(i) for i in range(index.index.ntotal))
+
+
+def test_removing_a_parent_removes_the_vectors_of_its_children(indexer):
+	Indexer.index_documents([
+		basic_document(1, 'The vpn guide.', children=[basic_document(2, 'Restart the vpn client.'),
+		                                              basic_document(3, 'Reset the vpn password.')]),
+		basic_document(4, 'Lunch is served at noon.'),
+	])
+	with indexer() as session:
+		documents = session.query(Document).all()
+		paragraph_ids = {document.title: [paragraph.id for paragraph in document.paragraphs]
+		                 for document in documents}
+		kept_ids = set(paragraph_ids['title 4'])
+		assert indexed_ids(FaissIndex.get()) == {id for ids in paragraph_ids.values() for id in ids}
+
+		Indexer.remove_documents([document for document in documents if document.title == 'title 1'], session)
+
+	assert indexed_ids(FaissIndex.get()) == kept_ids
+	assert Bm25Index.get().match_ids('vpn').tolist() == []
+	assert set(Bm25Index.get().match_ids('Lunch').tolist()) == kept_ids
+	all_ids = [id for ids in paragraph_ids.values() for id in ids]
+	assert set(ParagraphStore.get().paragraphs_by_id(all_ids)) == kept_ids
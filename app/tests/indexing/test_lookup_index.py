@@ -0,0 +1,97 @@
+import pytest
+
+from indexing.lookup_index import LookupIndex
+from indexing.paragraph_store import ParagraphStore
+from tests.documents import data_source, document
+
+source = data_source()
+
+
+def documents():
+	return [document(1, ['a', 'b'], source=source, id_in_data_source='C123', title='Reset the  VPN',
+	                 url='https://www.example.com/docs/VPN/'),
+	        document(2, ['c'], source=source, title='PROJ-12: login fails',
+	                 url='https://jira.example.com/browse/PROJ-12'),
+	        document(3, ['d'], parent_id=2, source=source, title='Re: PROJ-12'),
+	        document(4, ['e'], source=source, title='Deploy',
+	                 url='https://gitlab.example.com/group/project/-/merge_requests/7'),
+	        document(5, [], source=source, title='Empty')]
+
+
+@pytest.fixture
+def index(storage, monkeypatch):
+	monkeypatch.setattr(ParagraphStore, 'instance', None)
+	ParagraphStore.create()
+	index = LookupIndex()
+	index.add_documents(documents())
+	return index
+
+
+def test_lookup_by_id_url_title_and_identifiers(index):
+	assert index.lookup(['c123']) == [100, 101]
+	assert index.lookup(['example.com/docs/vpn']) == [100, 101]
+	assert index.lookup(['reset the vpn']) == [100, 101]
+	assert index.lookup(['proj-12']) == [200, 300]
+	assert index.lookup(['group/project!7']) == [400]
+	assert index.lookup(['unknown']) == []
+	# documents without paragraphs have nothing to look up
+	assert index.lookup(['empty']) == []
+
+
+def test_keys_are_normalized(index):
+	assert index.lookup(['C123']) == [100, 101]
+	assert index.lookup(['  Reset   THE vpn ']) == [100, 101]
+	assert index.lookup(['PROJ-12']) == [200, 300]
+
+
+def test_the_first_key_comes_first_without_duplicates(index):
+	assert index.lookup(['group/project!7', 'proj-12', 'PROJ-12', 'c123']) == [400, 200, 300, 100, 101]
+
+
+def test_re_adding_replaces_the_keys(index):
+	index.add_documents([document(1, ['a'], source=source, id_in_data_source='C123', title='Renamed')])
+
+	assert index.lookup(['reset the vpn']) == []
+	assert index.lookup(['renamed']) == [100]
+	assert index.lookup(['c123']) == [100]
+
+
+def test_remove_with_children(index):
+	index.remove_documents([2])
+
+	assert index.lookup(['proj-12']) == []
+	assert index.lookup(['re: proj-12']) == []
+	assert index.lookup(['c123']) == [100, 101]
+
+
+def test_removing_a_child_keeps_the_parent(index):
+	index.remove_documents([3])
+
+	assert index.lookup(['proj-12']) == [200]
+
+
+def test_shared_keys_are_kept_for_the_other_documents(index):
+	index.add_documents([document(6, ['f'], source=source, title='Reset the VPN')])
+	index.remove_documents([1])
+
+	assert index.lookup(['reset the vpn']) == [600]
+	assert index.lookup(['c123']) == []
+
+
+def test_rebuild_from_the_paragraph_store(index):
+	ParagraphStore.get().add_documents(documents())
+	rebuilt = LookupIndex()
+
+	for keys in (['c123'], ['proj-12'], ['group/project!7'], ['reset the vpn']):
+		assert rebuilt.lookup(keys) == index.lookup(keys)
+	assert len(rebuilt) == len(index)
+
+	# the children are known after a rebuild too
+	rebuilt.remove_documents([2])
+	assert rebuilt.lookup(['proj-12']) == []
+
+
+def test_clear(index):
+	index.clear()
+	assert len(index) == 0
+	assert index.lookup(['c123']) == []
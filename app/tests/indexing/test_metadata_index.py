@@ -0,0 +1,153 @@
+import datetime
+
+import numpy as np
+import pytest
+import torch
+
+from indexing.bm25_index import Bm25Index
+from indexing.faiss_index import MODEL_DIM, FaissIndex
+from indexing.metadata_index import MetadataIndex
+from indexing.paragraph_store import ParagraphStore
+from searching.filters import SearchFilter
+from tests.documents import data_source, document
+
+slack = data_source(1, 'slack')
+jira = data_source(2, 'jira')
+
+
+def documents():
+	return [document(1, ['vpn reset steps', 'more about the vpn'], source=slack),
+	        document(2, ['vpn outage in berlin'], source=jira, type='issue', location='PROJ', author='Bob',
+	                 is_active=False),
+	        document(3, ['the vpn is back'], parent_id=2, source=jira, type='comment', location='PROJ'),
+	        document(4, ['lunch menu'], source=slack, author='Cid', timestamp=None, is_active=None)]
+
+
+@pytest.fixture
+def store(storage, monkeypatch):
+	monkeypatch.setattr(ParagraphStore, 'instance', None)
+	ParagraphStore.create()
+	return ParagraphStore.get()
+
+
+@pytest.fixture
+def index(store):
+	index = MetadataIndex()
+	indexed = documents()
+	store.add_documents(indexed)
+	index.add_documents(indexed)
+	return index
+
+
+def matching(index: MetadataIndex, **fields) -> list:
+	return index.matching_ids(SearchFilter(**fields)).tolist()
+
+
+def test_each_field(index):
+	assert matching(index) == [100, 101, 200, 300, 400]
+	assert matching(index, data_sources=['jira']) == [200, 300]
+	assert matching(index, data_source_ids=[1]) == [100, 101, 400]
+	assert matching(index, types=['comment', 'issue']) == [200, 300]
+	assert matching(index, locations=['#general']) == [100, 101, 400]
+	assert matching(index, authors=['Ann']) == [100, 101, 300]
+	assert matching(index, is_active=False) == [200]
+	assert matching(index, is_active=True) == [100, 101, 300]
+	# values that were never indexed match nothing
+	assert matching(index, authors=['Nobody']) == []
+	assert matching(index, data_sources=['confluence'], authors=['Ann']) == []
+
+
+def test_fields_are_combined(index):
+	assert matching(index, data_sources=['jira'], authors=['Ann']) == [300]
+	assert matching(index, data_sources=['slack', 'jira'], authors=['Bob', 'Cid']) == [200, 400]
+	assert matching(index, data_source_ids=[1], locations=['#general'], is_active=True) == [100, 101]
+	assert matching(index, types=['message'], authors=['Bob']) == []
+
+
+def test_time_bounds(index):
+	# the documents are from the 2nd, 3rd and 4th of January 2023 at 12:30, the 4th has no timestamp
+	assert matching(index, from_time=datetime.datetime(2023, 1, 3, 12, 30)) == [200, 300]
+	assert matching(index, to_time=datetime.datetime(2023, 1, 3, 12, 30)) == [100, 101, 200]
+	assert matching(index, from_time=datetime.datetime(2023, 1, 3), to_time=datetime.datetime(2023, 1, 4)) == [200]
+	assert matching(index, from_time=datetime.datetime(2024, 1, 1)) == []
+	assert matching(index, from_time=datetime.datetime(1900, 1, 1)) == [100, 101, 200, 300]
+	aware = datetime.datetime(2023, 1, 3, 14, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+	assert matching(index, from_time=aware) == [200, 300]
+
+
+def test_remove_documents_with_children(index):
+	removed = index.remove_documents([2])
+
+	assert sorted(removed.tolist()) == [200, 300]
+	assert matching(index) == [100, 101, 400]
+	assert matching(index, data_sources=['jira']) == []
+	assert len(index) == 3
+
+
+def test_readded_document_replaces_its_rows(index):
+	index.add_documents([document(1, ['vpn reset steps', 'more about the vpn'], source=slack, author='Dan')])
+
+	assert matching(index, authors=['Ann']) == [300]
+	assert matching(index, authors=['Dan']) == [100, 101]
+	assert len(index) == 5
+
+
+def test_batches_are_merged_when_read(store):
+	index = MetadataIndex()
+	# out of id order, with a paragraph re-added in a later batch and within the same batch
+	for batch in ([document(3, ['c'], author='Cid')], [document(1, ['a']), document(2, ['b'])],
+	              [document(3, ['c'], author='Dan'), document(1, ['a'], author='Eve'), document(1, ['a'])]):
+		index.add_documents(batch)
+	assert len(index._rows) == 0
+
+	assert matching(index) == [100, 200, 300]
+	assert matching(index, authors=['Dan']) == [300]
+	assert matching(index, authors=['Ann']) == [100, 200]
+	assert index._pending == []
+
+	index.add_documents([document(2, ['b'], author='Cid'), document(4, ['d'])])
+	assert matching(index, authors=['Cid']) == [200]
+	assert index._rows['id'].tolist() == [100, 200, 300, 400]
+
+
+def test_rebuild_from_the_paragraph_store(index, store):
+	store.remove_documents([2])
+	index.remove_documents([2])
+	rebuilt = MetadataIndex()
+
+	for fields in ({}, {'authors': ['Ann']}, {'data_sources': ['slack']}, {'to_time': datetime.datetime(2023, 2, 1)},
+	               {'is_active': True}):
+		assert matching(rebuilt, **fields) == matching(index, **fields)
+
+
+def test_cache_key():
+	assert SearchFilter().is_empty
+	assert SearchFilter(authors=['b', 'a']).cache_key() == SearchFilter(authors=['a', 'b']).cache_key()
+	assert SearchFilter(authors=['a']).cache_key() != SearchFilter(locations=['a']).cache_key()
+	assert not SearchFilter(is_active=False).is_empty
+
+
+def test_faiss_returns_only_allowed_ids(storage):
+	index = FaissIndex()
+	embeddings = torch.nn.functional.normalize(torch.randn(50, MODEL_DIM, generator=torch.Generator().manual_seed(0)))
+	index.update(np.arange(1000, 1050, dtype=np.int64), embeddings)
+	allowed = np.array([1003, 1017, 1042], dtype=np.int64)
+
+	scores, ids = index.search_with_scores(embeddings[17], 10, allowed_ids=allowed)
+	assert ids[0][0] == 1017
+	assert set(ids[0][:3].tolist()) == set(allowed.tolist())
+	assert ids[0][3:].tolist() == [-1] * 7
+	_, ids = index.search_with_scores(embeddings[:2], 2, allowed_ids=np.empty(0, dtype=np.int64))
+	assert (ids == -1).all()
+
+
+def test_bm25_returns_only_allowed_ids(storage, index):
+	bm25 = Bm25Index()
+	bm25.add([paragraph for document in documents() for paragraph in document.paragraphs])
+
+	# paragraphs without the term fill the top k with a score of 0
+	assert {id for id, score in bm25.search_with_scores('vpn', 10) if score > 0} == {100, 101, 200, 300}
+	allowed = index.matching_ids(SearchFilter(authors=['Cid', 'Bob']))
+	assert {id for id, _ in bm25.search_with_scores('vpn', 10, allowed)} == {200, 400}
+	assert [id for id, _ in bm25.search_with_scores('vpn', 1, allowed)] == [200]
+	assert bm25.search_with_scores('vpn', 10, np.empty(0, dtype=np.int64)) == []
@@ -0,0 +1,159 @@
+import datetime
+import json
+
+import pytest
+
+from indexing import paragraph_store
+from indexing.paragraph_store import ParagraphStore
+from schemas import Document, Paragraph
+from tests.documents import data_source, document
+
+
+@pytest.fixture
+def store(storage):
+	return ParagraphStore()
+
+
+def contents(store: ParagraphStore, ids) -> dict:
+	return {id: paragraph.content for id, paragraph in store.paragraphs_by_id(ids).items()}
+
+
+def test_hydration(store):
+	store.add_documents([document(1, ['first paragraph', 'second paragraph ünïcode']),
+	                     Document(id=2, id_in_data_source='source-2', paragraphs=[Paragraph(id=200, content=None)])])
+
+	paragraphs = store.paragraphs_by_id([101, 100, 200, 999])
+	assert set(paragraphs) == {100, 101, 200}
+	assert paragraphs[101].content == 'second paragraph ünïcode'
+	assert paragraphs[200].content == ''
+	first = paragraphs[100].document
+	assert first.id == 1 and first.title == 'title 1' and first.author == 'Ann' and first.type == 'message'
+	assert first.timestamp == datetime.datetime(2023, 1, 2, 12, 30)
+	assert first.is_active is True and first.parent_id is None and first.parent is None
+	assert first.data_source_id == 1 and first.data_source_name == 'slack'
+	second = paragraphs[200].document
+	assert second.title is None and second.timestamp is None and second.is_active is None
+	assert second.data_source_id is None and second.data_source_name is None
+	assert store.get_paragraph(999) is None and store.get_document(3) is None
+	assert len(store) == 3
+
+
+def test_parent_join(store):
+	store.add_documents([document(1, ['the parent']), document(2, ['a reply'], parent_id=1)])
+
+	child = store.get_paragraph(200).document
+	assert child.parent_id == 1
+	assert child.parent.id == 1 and child.parent.title == 'title 1'
+	# documents enumerated for the other indices come without their parents
+	assert sorted(document.id for document in store.all_documents()) == [1, 2]
+
+
+def test_readded_document_replaces_its_records(store):
+	store.add_documents([document(1, ['old one', 'old two']), document(2, ['other'])])
+	store.add_documents([document(1, ['new one'], first_paragraph_id=150, title='renamed')])
+
+	assert contents(store, [100, 101, 150, 200]) == {150: 'new one', 200: 'other'}
+	assert store.get_document(1).title == 'renamed'
+	# the replaced strings are garbage now, to be dropped by the next compaction
+	assert store._manifest['garbage_size'] >= len('old one') + len('old two') + len('title 1')
+	paragraph_ids, document_ids = store.paragraph_document_ids()
+	assert paragraph_ids.tolist() == [150, 200] and document_ids.tolist() == [1, 2]
+	assert [document.title for document in store.all_documents() if document.id == 1] == ['renamed']
+
+
+def test_remove_documents_with_children(store):
+	store.add_documents([document(1, ['parent']), document(2, ['child'], parent_id=1), document(3, ['kept'])])
+	store.remove_documents([1, 42])
+
+	assert contents(store, [100, 200, 300]) == {300: 'kept'}
+	assert store.get_document(2) is None
+	assert [document.id for document in store.all_documents()] == [3]
+
+	# removed documents can come back
+	store.add_documents([document(1, ['parent again'])])
+	assert contents(store, [100, 200, 300]) == {100: 'parent again', 300: 'kept'}
+
+
+def test_child_that_moved_to_another_parent_is_kept(store):
+	store.add_documents([document(1, ['first parent']), document(2, ['second parent']),
+	                     document(3, ['child'], parent_id=1)])
+	store.add_documents([document(3, ['child'], parent_id=2)])
+	store.remove_documents([1])
+
+	assert contents(store, [100, 200, 300]) == {200: 'second parent', 300: 'child'}
+
+
+def test_updates_append_segments_and_merge_them(store):
+	for id in range(1, 65):
+		store.add_documents([document(id, [f'paragraph of {id}'])])
+		segments = store._manifest['segments']
+		# every segment is at least MERGE_RATIO times the size of the ones after it
+		assert len(segments) <= 7
+
+	oldest = store._manifest['segments'][0]
+	store.add_documents([document(100, ['one more'])])
+	assert store._manifest['segments'][0] == oldest
+	assert len(store) == 65
+	assert contents(store, [100, 6400, 10000]) == {100: 'paragraph of 1', 6400: 'paragraph of 64',
+	                                               10000: 'one more'}
+	# only the files of the manifest are left behind
+	files = {file_name for entry in store._manifest['segments'] for file_name in entry.values()}
+	assert {path.name for path in paragraph_store.PARAGRAPH_STORE_PATH.iterdir()} == \
+		files | {store._manifest['blob'], 'manifest.json'}
+
+
+def test_compaction_at_threshold(store):
+	store.add_documents([document(id, ['x' * 1000]) for id in range(1, 11)])
+	blob = store._manifest['blob']
+
+	store.remove_documents([1, 2])
+	assert store._manifest['blob'] == blob
+
+	store.remove_documents(list(range(3, 9)))
+	manifest = store._manifest
+	assert manifest['blob'] != blob
+	assert manifest['garbage_size'] == 0
+	assert len(manifest['segments']) == 1
+	assert manifest['blob_size'] < 2 * (1000 + 100)
+	assert contents(store, range(100, 1100, 100)) == {900: 'x' * 1000, 1000: 'x' * 1000}
+	assert store.get_document(10).url == 'https://example.com/10'
+
+
+def test_reopen(store):
+	store.add_documents([document(1, ['parent']), document(2, ['child'], parent_id=1)])
+	store.add_documents([document(3, ['another'])])
+	store.remove_documents([3])
+
+	reopened = ParagraphStore()
+	assert contents(reopened, [100, 200, 300]) == {100: 'parent', 200: 'child'}
+	assert reopened.get_paragraph(200).document.parent.id == 1
+
+
+def test_opens_a_store_written_without_segments(store):
+	store.add_documents([document(1, ['parent']), document(2, ['child'], parent_id=1)])
+	store._compact(list(store._view.segments))
+	path = paragraph_store.PARAGRAPH_STORE_PATH
+	manifest = json.loads((path / 'manifest.json').read_text())
+	entry = manifest.pop('segments')[0]
+	(path / entry['removed']).unlink()
+	manifest.update(paragraphs=entry['paragraphs'], documents=entry['documents'])
+	(path / 'manifest.json').write_text(json.dumps(manifest))
+
+	reopened = ParagraphStore()
+	assert contents(reopened, [100, 200]) == {100: 'parent', 200: 'child'}
+	reopened.add_documents([document(3, ['new'])])
+	assert contents(reopened, [100, 300]) == {100: 'parent', 300: 'new'}
+
+
+def test_rebuild_from_database(store, session):
+	source = data_source()
+	with session() as db:
+		db.add_all([document(1, ['from the database'], source=source),
+		            document(2, ['and its child'], parent_id=1, source=source)])
+		db.commit()
+	store.add_documents([document(3, ['not in the database'])])
+
+	store.rebuild()
+	assert contents(store, [100, 200, 300]) == {100: 'from the database', 200: 'and its child'}
+	store.clear()
+	assert len(store) == 0 and store.paragraphs_by_id([100]) == {}
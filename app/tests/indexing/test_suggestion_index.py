@@ -0,0 +1,139 @@
+import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.search import router
+from indexing.paragraph_store import ParagraphStore
+from indexing.suggestion_index import SuggestionIndex
+from tests.documents import data_source, document
+
+jira = data_source(2, 'jira')
+
+
+def days_ago(days: int) -> datetime.datetime:
+	return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+
+def documents():
+	return [document(1, ['a'], title='VPN setup guide', location='#it', author='Ann', timestamp=days_ago(40)),
+	        document(2, ['b'], title='Reset your VPN password', location='#it', author='Bob', timestamp=days_ago(1)),
+	        document(3, ['c'], title='Office lunch menu', location='#general', author='Vera', timestamp=days_ago(5)),
+	        document(4, ['d'], title='Lunch', parent_id=3, location='#general', author='Ann', timestamp=days_ago(2)),
+	        document(5, ['e'], title='Vacation policy', source=jira, type='issue', location='HR', author='Ann',
+	                 timestamp=None)]
+
+
+@pytest.fixture
+def store(storage, monkeypatch):
+	monkeypatch.setattr(ParagraphStore, 'instance', None)
+	ParagraphStore.create()
+	return ParagraphStore.get()
+
+
+@pytest.fixture
+def index(store):
+	index = SuggestionIndex()
+	index.add_documents(documents())
+	return index
+
+
+def texts(suggestions: list) -> list:
+	return [suggestion['text'] for suggestion in suggestions]
+
+
+def test_values_and_words_starting_with_the_prefix_are_suggested(index):
+	assert texts(index.suggest('vpn', kinds=['title'])) == ['VPN setup guide', 'Reset your VPN password']
+	assert texts(index.suggest('  PASS ')) == ['Reset your VPN password']
+	assert texts(index.suggest('#ge')) == ['#general']
+	assert index.suggest('xyz') == []
+
+
+def test_a_match_at_the_start_of_the_value_ranks_first(index):
+	# the newer title only matches on one of its words
+	assert texts(index.suggest('v', kinds=['title'])) == ['VPN setup guide', 'Vacation policy',
+	                                                       'Reset your VPN password']
+
+
+def test_popular_and_recent_values_rank_first(index):
+	# Ann wrote three documents, Vera only one
+	assert texts(index.suggest('a', kinds=['author'])) == ['Ann']
+	assert texts(index.suggest('', kinds=['author'])) == []
+	assert texts(index.suggest('#', kinds=['location'])) == ['#it', '#general']
+	assert [suggestion['documents'] for suggestion in index.suggest('#', kinds=['location'])] == [2, 2]
+	# among equally popular titles the latest one wins
+	assert texts(index.suggest('r')) == ['Reset your VPN password']
+
+
+def test_suggestions_are_limited_and_filtered_by_kind(index):
+	assert len(index.suggest('v', limit=2)) == 2
+	assert {suggestion['kind'] for suggestion in index.suggest('v')} == {'title', 'author'}
+	assert texts(index.suggest('v', kinds=['author'])) == ['Vera']
+
+
+def test_titles_link_their_latest_document(index):
+	[suggestion] = index.suggest('vacation')
+	assert suggestion == {'kind': 'title', 'text': 'Vacation policy', 'documents': 1,
+	                      'url': 'https://example.com/5', 'data_source': 'jira'}
+	# comments repeat the title of their parent, so only locations and authors count
+	assert index.suggest('lunch') == [{'kind': 'title', 'text': 'Office lunch menu', 'documents': 1,
+	                                   'url': 'https://example.com/3', 'data_source': 'slack'}]
+
+
+@pytest.mark.parametrize('prefix', ['', '   ', '\t\n'])
+def test_empty_prefixes_suggest_nothing(index, prefix):
+	assert index.suggest(prefix) == []
+
+
+def test_added_documents_are_suggested_right_away(index):
+	# short prefixes are cached until the next update
+	assert texts(index.suggest('w')) == []
+	index.add_documents([document(6, ['f'], title='Wifi passwords', author='Wes', timestamp=days_ago(0))])
+
+	assert sorted(texts(index.suggest('w'))) == ['Wes', 'Wifi passwords']
+	assert texts(index.suggest('pass', kinds=['title'])) == ['Wifi passwords', 'Reset your VPN password']
+
+
+def test_a_readded_document_replaces_its_values(index):
+	index.add_documents([document(1, ['a'], title='VPN troubleshooting', location='#it', author='Ann',
+	                              timestamp=days_ago(40))])
+
+	assert texts(index.suggest('vpn s')) == []
+	assert texts(index.suggest('vpn t')) == ['VPN troubleshooting']
+	assert index.suggest('ann')[0]['documents'] == 3
+
+
+def test_removed_documents_and_their_children_are_not_suggested(index):
+	assert texts(index.suggest('vera')) == ['Vera']
+	index.remove_documents([3])
+
+	assert index.suggest('vera') == []
+	assert index.suggest('#gen') == []
+	assert index.suggest('ann')[0]['documents'] == 2
+
+	index.remove_documents([1, 5])
+	assert index.suggest('ann') == []
+	assert texts(index.suggest('vpn')) == ['Reset your VPN password']
+	assert len(index) == 3
+
+
+def test_rebuild_agrees_with_incremental_updates(index, store):
+	store.add_documents(documents())
+	rebuilt = SuggestionIndex()
+
+	for prefix in ('v', 'vpn', 'a', '#', 'lunch', 'pass'):
+		assert rebuilt.suggest(prefix) == index.suggest(prefix)
+	assert len(rebuilt) == len(index)
+
+
+def test_the_endpoint_validates_the_kinds(index, monkeypatch):
+	monkeypatch.setattr(SuggestionIndex, 'instance', index)
+	app = FastAPI()
+	app.include_router(router)
+	client = TestClient(app)
+
+	assert texts(client.get('/search/suggest', params={'prefix': 'vpn', 'kind': 'title'}).json()) == \
+	       ['VPN setup guide', 'Reset your VPN password']
+	assert client.get('/search/suggest', params={'prefix': 'vpn', 'kind': 'tag'}).status_code == 400
+	assert client.get('/search/suggest', params={'prefix': ''}).json() == []
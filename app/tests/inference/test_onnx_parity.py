@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('onnxruntime')
+pytest.importorskip('optimum.onnxruntime')
+
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from transformers import pipeline
+
+from inference.onnx_backend import OnnxBiEncoder, OnnxCrossEncoder, onnx_qa_pipeline
+from searching.budget import SETTLED_SCORE_GAP
+
+query = 'how do I rotate the staging database credentials?'
+passages = [
+	'To rotate the staging database credentials, run the rotate-secrets job and restart the api pods.',
+	'The staging database is a managed postgres instance, backups run every night.',
+	'Lunch is served on the third floor every day at noon.',
+	'Credentials for third party services are stored in the vault under the team folder.',
+	'Release notes for version 2.3: faster search and a new slack connector.',
+]
+
+# int8 quantization moves the scores a little, but must never change what the search returns
+MAX_EMBEDDING_DRIFT = 0.05
+# cross-encoder logits span about +-10, so their drift is checked on the ranking, not on the raw values:
+# with 5 passages, two neighbours with nearly equal scores swapping gives 0.9, anything more falls below 0.85
+MIN_SCORE_RANK_CORRELATION = 0.85
+# the raw logits become the result scores and are compared against SETTLED_SCORE_GAP,
+# two scores drifting apart by at most twice this bound keep a settled order settled
+MAX_SCORE_DRIFT = SETTLED_SCORE_GAP / 6
+# the QA start/end logits only pick the span, the span itself must not change
+MAX_QA_LOGIT_DRIFT = 1.0
+MAX_QA_SCORE_DRIFT = 0.05
+
+
+def spearman(expected: np.ndarray, actual: np.ndarray) -> float:
+	expected_ranks = np.argsort(np.argsort(expected))
+	actual_ranks = np.argsort(np.argsort(actual))
+	return float(np.corrcoef(expected_ranks, actual_ranks)[0, 1])
+
+
+def test_bi_encoder_parity():
+	torch_model = SentenceTransformer('multi-qa-MiniLM-L6-cos-v1')
+	onnx_model = OnnxBiEncoder('sentence-transformers/multi-qa-MiniLM-L6-cos-v1')
+
+	expected = torch_model.encode([query] + passages)
+	actual = onnx_model.encode([query] + passages)
+	assert actual.shape == expected.shape
+
+	cosine = (expected * actual).sum(axis=1)
+	assert np.all(1 - cosine < MAX_EMBEDDING_DRIFT)
+
+	single = onnx_model.encode(query)
+	assert single.shape == (expected.shape[1],)
+
+	expected_ranking = np.argsort(-(expected[1:] @ expected[0]))
+	actual_ranking = np.argsort(-(actual[1:] @ actual[0]))
+	assert expected_ranking[0] == actual_ranking[0]
+
+
+@pytest.mark.parametrize('model_name', ['cross-encoder/ms-marco-TinyBERT-L-2-v2',
+                                        'cross-encoder/ms-marco-MiniLM-L-6-v2'])
+def test_cross_encoder_parity(model_name):
+	pairs = [(query, passage) for passage in passages]
+	expected = CrossEncoder(model_name).predict(pairs)
+	actual = OnnxCrossEncoder(model_name).predict(pairs)
+
+	assert actual.shape == expected.shape
+	assert spearman(expected, actual) >= MIN_SCORE_RANK_CORRELATION
+	assert np.argmax(expected) == np.argmax(actual)
+	assert np.max(np.abs(expected - actual)) < MAX_SCORE_DRIFT
+
+
+def test_qa_parity():
+	torch_model = pipeline('question-answering', model='deepset/roberta-base-squad2')
+	onnx_model = onnx_qa_pipeline('deepset/roberta-base-squad2')
+	contexts = passages[:2] + [' '.join(passages)]
+	questions = [query] * len(contexts)
+
+	expected = torch_model(question=questions, context=contexts)
+	actual = onnx_model(question=questions, context=contexts)
+	for expected_answer, actual_answer in zip(expected, actual):
+		assert actual_answer['answer'] == expected_answer['answer']
+		assert (actual_answer['start'], actual_answer['end']) == (expected_answer['start'], expected_answer['end'])
+		assert abs(actual_answer['score'] - expected_answer['score']) < MAX_QA_SCORE_DRIFT
+
+	features = torch_model.tokenizer(questions, contexts, padding=True, truncation='only_second', return_tensors='pt')
+	with torch.no_grad():
+		expected_logits = torch_model.model(**features)
+	actual_logits = onnx_model.model(**features)
+	tokens = features['attention_mask'].bool()
+	for logits in ('start_logits', 'end_logits'):
+		drift = (getattr(expected_logits, logits) - getattr(actual_logits, logits))[tokens].abs().max()
+		assert float(drift) < MAX_QA_LOGIT_DRIFT
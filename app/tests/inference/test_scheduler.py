@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from inference.scheduler import InferenceScheduler
+
+
+def test_concurrent_submits_are_coalesced_into_bounded_batches():
+	batches = []
+	first_batch_started = threading.Event()
+	release = threading.Event()
+
+	def predict(items: list) -> list:
+		batches.append(list(items))
+		first_batch_started.set()
+		release.wait(5)
+		return [item * 2 for item in items]
+
+	scheduler = InferenceScheduler('test', predict, length=lambda item: item, max_batch_size=4, max_wait_ms=50)
+	# keep the worker busy with a first request, so the next ones queue up and are collected together
+	first = scheduler.submit([100])
+	assert first_batch_started.wait(5)
+	futures = [scheduler.submit([i * 10, i * 10 + 1]) for i in range(2)] + [scheduler.submit([30, 31, 32])]
+	release.set()
+
+	assert first.result(5) == [200]
+	for future, items in zip(futures, [[0, 1], [10, 11], [30, 31, 32]]):
+		assert future.result(5) == [item * 2 for item in items]
+
+	# the two requests of two items fill one batch, the third request overflows into the next collection
+	assert batches == [[100], [0, 1, 10, 11], [30, 31, 32]]
+	stats = scheduler.stats()
+	assert stats['requests'] == 4
+	assert stats['items'] == 8
+	assert stats['batches'] == 3
+	assert stats['pending_items'] == 0
+
+
+def test_batches_never_exceed_max_batch_size():
+	batches = []
+
+	def predict(items: list) -> list:
+		batches.append(len(items))
+		return items
+
+	scheduler = InferenceScheduler('test', predict, length=lambda item: item, max_batch_size=4, max_wait_ms=20)
+	with ThreadPoolExecutor(8) as executor:
+		results = list(executor.map(lambda i: scheduler.predict(list(range(i, i + 3))), range(16)))
+
+	assert results == [list(range(i, i + 3)) for i in range(16)]
+	assert max(batches) <= 4
+	assert sum(batches) == 48
+
+
+def test_results_come_back_in_order_despite_length_sorting():
+	scheduler = InferenceScheduler('test', lambda items: [item.upper() for item in items], length=len,
+	                               max_batch_size=3, max_wait_ms=5)
+	items = ['ccc', 'a', 'bbbbb', 'dd', 'eeee', '']
+
+	with ThreadPoolExecutor(8) as executor:
+		results = list(executor.map(lambda i: scheduler.predict(items[i:] + items[:i]), range(len(items))))
+
+	for i, result in enumerate(results):
+		assert result == [item.upper() for item in items[i:] + items[:i]]
+
+
+def test_empty_submit_and_failing_model():
+	def predict(items: list) -> list:
+		raise RuntimeError('model failed')
+
+	scheduler = InferenceScheduler('test', predict, length=len, max_batch_size=4, max_wait_ms=1)
+	assert scheduler.predict([]) == []
+	with pytest.raises(RuntimeError):
+		scheduler.predict(['a'])
+	assert scheduler.stats()['pending_items'] == 0
@@ -0,0 +1,50 @@
+import pytest
+
+from searching.budget import SEARCH_PRESETS, SearchPreset, StageCosts, get_preset
+from searching.trace import SearchTrace
+
+default = SearchPreset(name='default', bm25_candidates=5, bi_encoder_candidates=5, small_cross_encoder_candidates=5)
+
+
+@pytest.fixture(autouse=True)
+def stage_costs(monkeypatch):
+	monkeypatch.setattr(StageCosts, '_ms_per_item', {'small_cross_encoder': 2.0, 'large_cross_encoder': 10.0})
+
+
+def test_get_preset():
+	assert get_preset(None, default) is default
+	assert get_preset('fast', default) is SEARCH_PRESETS['fast']
+	assert get_preset('accurate', default).budget_ms is None
+	with pytest.raises(ValueError):
+		get_preset('fastest', default)
+
+
+def test_budget_overrides_the_preset_without_changing_it():
+	preset = get_preset('fast', default, budget_ms=50)
+	assert preset.budget_ms == 50
+	assert preset.bm25_candidates == SEARCH_PRESETS['fast'].bm25_candidates
+	assert SEARCH_PRESETS['fast'].budget_ms == 400
+	assert get_preset(None, default, budget_ms=10).budget_ms == 10
+	assert default.budget_ms is None
+
+
+def test_stage_costs_moving_average():
+	StageCosts.record('large_cross_encoder', 10, 200)
+	assert StageCosts.get_stats()['large_cross_encoder'] == pytest.approx(10 + StageCosts.SMOOTHING * (20 - 10))
+
+	# unmeasured stages start from their first measurement, empty runs are ignored
+	StageCosts.record('answer_extraction', 4, 100)
+	StageCosts.record('answer_extraction', 0, 1000)
+	assert StageCosts.get_stats()['answer_extraction'] == 25
+
+
+def test_affordable_items():
+	assert StageCosts.affordable_items('large_cross_encoder', SearchTrace()) is None
+
+	trace = SearchTrace(budget_ms=100)
+	trace.started_at -= 0.05
+	assert StageCosts.affordable_items('large_cross_encoder', trace) in (4, 5)
+	assert StageCosts.affordable_items('small_cross_encoder', trace) in (23, 24, 25)
+
+	trace.started_at -= 1
+	assert StageCosts.affordable_items('large_cross_encoder', trace) == 0
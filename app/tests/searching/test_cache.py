@@ -0,0 +1,56 @@
+from indexing.index_generation import IndexGeneration
+from searching.cache import LRUCache, SearchCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+	cache = LRUCache(max_size=2)
+	cache.put('a', 1)
+	cache.put('b', 2)
+	assert cache.get('a') == 1
+	cache.put('c', 3)
+
+	assert cache.get('b') is None
+	assert cache.get('a') == 1
+	assert cache.get('c') == 3
+	assert len(cache) == 2
+	stats = cache.stats()
+	assert stats['evictions'] == 1
+	assert stats['hits'] == 3 and stats['misses'] == 1
+
+
+def test_lru_cache_put_refreshes_existing_key():
+	cache = LRUCache(max_size=2)
+	cache.put('a', 1)
+	cache.put('b', 2)
+	cache.put('a', 10)
+	cache.put('c', 3)
+
+	assert cache.get('a') == 10
+	assert cache.get('b', 'missing') == 'missing'
+
+
+def test_new_generation_drops_everything_but_embeddings():
+	SearchCache.clear()
+	generation = SearchCache.generation()
+	SearchCache.embeddings.put('query', 'embedding')
+	SearchCache.scores.put((generation, 'query', 1, 'small'), 0.5)
+	SearchCache.results.put((generation, 'query', 5, None), ['result'])
+	SearchCache.answers.put((generation, 'query', 1), 'answer')
+
+	assert SearchCache.generation() == generation
+	assert len(SearchCache.results) == 1
+
+	IndexGeneration.bump()
+	assert SearchCache.generation() == generation + 1
+	assert len(SearchCache.scores) == 0
+	assert len(SearchCache.results) == 0
+	assert len(SearchCache.answers) == 0
+	assert SearchCache.embeddings.get('query') == 'embedding'
+	SearchCache.clear()
+
+
+def test_query_normalization():
+	assert SearchCache.normalize_query('  How do I   reset\tthe VPN ') == 'how do i reset the vpn'
+	# answers come from the cased QA model, so their keys keep the case
+	assert SearchCache.normalize_cased_query('  How do I   reset\tthe VPN ') == 'How do I reset the VPN'
+	assert SearchCache.normalize_cased_query('who is Bob') != SearchCache.normalize_cased_query('who is bob')
@@ -0,0 +1,59 @@
+from search_logic import Candidate
+from searching.collapse import collapse
+from tests.test_search_logic import document
+
+
+def candidate(paragraph_id: int, document_id: int, parent_id: int = None) -> Candidate:
+	return Candidate(content=f'paragraph {paragraph_id}', document=document(document_id, parent_id),
+	                 paragraph_id=paragraph_id)
+
+
+def ids(candidates):
+	return [candidate.paragraph_id for candidate in candidates]
+
+
+def test_paragraphs_per_document():
+	candidates = [candidate(10, 1), candidate(20, 2), candidate(11, 1), candidate(12, 1), candidate(21, 2)]
+
+	assert ids(collapse(candidates, paragraphs_per_document=1, documents_per_thread=0)) == [10, 20]
+	assert ids(collapse(candidates, paragraphs_per_document=2, documents_per_thread=0)) == [10, 20, 11, 21]
+
+
+def test_zero_paragraphs_per_document_disables_collapsing():
+	candidates = [candidate(10, 1), candidate(11, 1), candidate(20, 2, parent_id=1), candidate(30, 3, parent_id=1)]
+
+	# the thread limit goes with it
+	assert ids(collapse(candidates, paragraphs_per_document=0, documents_per_thread=1)) == [10, 11, 20, 30]
+
+
+def test_documents_per_thread():
+	candidates = [candidate(20, 2, parent_id=1), candidate(10, 1), candidate(30, 3, parent_id=1),
+	              candidate(21, 2, parent_id=1), candidate(40, 4)]
+
+	assert ids(collapse(candidates, paragraphs_per_document=1, documents_per_thread=1)) == [20, 40]
+	assert ids(collapse(candidates, paragraphs_per_document=1, documents_per_thread=2)) == [20, 10, 40]
+	# a document already in the thread may bring more of its paragraphs
+	assert ids(collapse(candidates, paragraphs_per_document=2, documents_per_thread=2)) == [20, 10, 21, 40]
+
+
+def test_zero_documents_per_thread_is_unlimited():
+	candidates = [candidate(10, 1), candidate(20, 2, parent_id=1), candidate(30, 3, parent_id=1),
+	              candidate(11, 1)]
+
+	assert ids(collapse(candidates, paragraphs_per_document=1, documents_per_thread=0)) == [10, 20, 30]
+
+
+def test_a_parent_and_its_child_share_a_thread():
+	# whichever comes first
+	parent_first = [candidate(10, 1), candidate(20, 2, parent_id=1), candidate(30, 3)]
+	child_first = [candidate(20, 2, parent_id=1), candidate(10, 1), candidate(30, 3)]
+
+	assert ids(collapse(parent_first, paragraphs_per_document=1, documents_per_thread=1)) == [10, 30]
+	assert ids(collapse(child_first, paragraphs_per_document=1, documents_per_thread=1)) == [20, 30]
+	assert ids(collapse(child_first, paragraphs_per_document=1, documents_per_thread=2)) == [20, 10, 30]
+
+
+def test_order_is_kept():
+	candidates = [candidate(30, 3), candidate(10, 1), candidate(20, 2)]
+	assert collapse(candidates, paragraphs_per_document=1, documents_per_thread=1) == candidates
+	assert collapse([], paragraphs_per_document=1, documents_per_thread=1) == []
@@ -0,0 +1,97 @@
+import pytest
+
+from searching import fusion
+from searching.fusion import cut, fuse
+
+
+@pytest.fixture(autouse=True)
+def weights(monkeypatch):
+	monkeypatch.setattr(fusion, 'FUSION_VECTOR_WEIGHT', 0.5)
+	monkeypatch.setattr(fusion, 'RRF_K', 60)
+
+
+def ids(hits):
+	return [id for id, _ in hits]
+
+
+def test_blend_mixes_the_normalized_scores():
+	fused = dict(fuse([(1, 0.9), (2, 0.5), (3, 0.1)], [(4, 10.0), (2, 5.0)], method='blend'))
+
+	# vector scores are min-max normalized, BM25 ones from 0
+	assert fused == pytest.approx({1: 0.5, 2: 0.5 * 0.5 + 0.5 * 0.5, 3: 0.0, 4: 0.5})
+
+
+def test_blend_weights(monkeypatch):
+	monkeypatch.setattr(fusion, 'FUSION_VECTOR_WEIGHT', 0.8)
+	assert ids(fuse([(1, 0.9), (2, 0.1)], [(2, 3.0), (1, 1.0)], method='blend')) == [1, 2]
+
+	monkeypatch.setattr(fusion, 'FUSION_VECTOR_WEIGHT', 0.2)
+	assert ids(fuse([(1, 0.9), (2, 0.1)], [(2, 3.0), (1, 1.0)], method='blend')) == [2, 1]
+
+
+def test_bm25_is_normalized_from_zero():
+	# with a floor at the minimum, the weakest BM25 hit would get nothing
+	fused = dict(fuse([], [(1, 8.0), (2, 6.0)], method='blend'))
+	assert fused == pytest.approx({1: 0.5, 2: 0.5 * 6 / 8})
+
+
+def test_equal_scores_normalize_to_one():
+	assert dict(fuse([(1, 0.3), (2, 0.3)], [], method='blend')) == pytest.approx({1: 0.5, 2: 0.5})
+	assert dict(fuse([], [(1, 0.0)], method='blend')) == pytest.approx({1: 0.5})
+
+
+def test_rrf_only_looks_at_the_ranks():
+	fused = dict(fuse([(1, 100.0), (2, 0.1)], [(3, 50.0), (1, 49.0)], method='rrf'))
+
+	assert fused == pytest.approx({1: 1 / 61 + 1 / 62, 2: 1 / 62, 3: 1 / 61})
+	# the same ranks fuse the same whatever the scores
+	assert fuse([(1, 0.2), (2, 0.1)], [(3, 1.0), (1, 0.5)], method='rrf') == \
+	       fuse([(1, 100.0), (2, 0.1)], [(3, 50.0), (1, 49.0)], method='rrf')
+
+
+def test_blend_and_rrf_can_disagree():
+	# 2 is nearly as close as 1 to the query, 3 only matches its keywords
+	vector_hits = [(1, 0.9), (2, 0.89), (3, 0.1)]
+	bm25_hits = [(3, 20.0), (1, 19.0), (2, 1.0)]
+
+	assert ids(fuse(vector_hits, bm25_hits, method='blend')) == [1, 2, 3]
+	assert ids(fuse(vector_hits, bm25_hits, method='rrf')) == [1, 3, 2]
+
+
+@pytest.mark.parametrize('method', ['blend', 'rrf'])
+def test_a_paragraph_found_by_both_gets_credit_from_both(method):
+	fused = fuse([(1, 0.9), (2, 0.8), (4, 0.1)], [(2, 4.0), (3, 4.0)], method=method)
+
+	assert ids(fused)[0] == 2
+	assert sorted(ids(fused)) == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('method', ['blend', 'rrf'])
+def test_empty_hits(method):
+	assert fuse([], [], method=method) == []
+	assert ids(fuse([(1, 0.5)], [], method=method)) == [1]
+
+
+def test_unknown_method():
+	with pytest.raises(ValueError):
+		fuse([(1, 0.5)], [], method='max')
+
+
+def test_cut_keeps_the_candidates_close_to_the_best():
+	fused = [(1, 1.0), (2, 0.8), (3, 0.5), (4, 0.3), (5, 0.1)]
+
+	assert ids(cut(fused, 1, 10, min_relative_score=0.5)) == [1, 2, 3]
+	assert ids(cut(fused, 1, 10, min_relative_score=0.0)) == [1, 2, 3, 4, 5]
+	assert ids(cut(fused, 1, 10, min_relative_score=1.0)) == [1]
+
+
+def test_cut_bounds():
+	fused = [(1, 1.0), (2, 0.8), (3, 0.5), (4, 0.3), (5, 0.1)]
+
+	# at least min_candidates, even below the threshold
+	assert ids(cut(fused, 4, 10, min_relative_score=0.9)) == [1, 2, 3, 4]
+	# at most max_candidates, even above it
+	assert ids(cut(fused, 1, 2, min_relative_score=0.0)) == [1, 2]
+	# and never more than there are
+	assert ids(cut(fused, 8, 10, min_relative_score=0.9)) == [1, 2, 3, 4, 5]
+	assert cut([], 3, 10) == []
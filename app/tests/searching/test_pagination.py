@@ -0,0 +1,139 @@
+import base64
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import search_logic
+from api.search import router
+from search_logic import search_documents_page
+from searching.pagination import CursorEntry, SearchCursors
+from tests.test_search_logic import candidates
+
+
+@pytest.fixture(autouse=True)
+def cursors(monkeypatch):
+	monkeypatch.setattr(SearchCursors, '_entries', type(SearchCursors._entries)())
+	monkeypatch.setattr(SearchCursors, 'evictions', 0)
+
+
+@pytest.fixture
+def searches(monkeypatch):
+	"""
+	Ranks 25 candidates by paragraph id, a search result is the paragraph id of its candidate.
+	"""
+	calls = []
+
+	def rank_for_pagination(query, preset, trace, search_filter):
+		calls.append(query)
+		return candidates(25), False
+
+	monkeypatch.setattr(search_logic, '_rank_for_pagination', rank_for_pagination)
+	monkeypatch.setattr(search_logic, '_find_answers_in_candidates_batch', lambda queries, lists: lists)
+	monkeypatch.setattr(search_logic, '_to_search_results',
+	                    lambda lists: [[candidate.paragraph_id for candidate in page] for page in lists])
+	return calls
+
+
+def entry(created_at: float = 0.0) -> CursorEntry:
+	return CursorEntry(query='reset vpn', lazy_answers=True, candidates=[], created_at=created_at)
+
+
+def encoded(payload) -> str:
+	return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+	cursor = SearchCursors.encode_cursor('abc', 20)
+	assert '=' not in cursor
+	assert SearchCursors.decode_cursor(cursor) == ('abc', 20)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor!', '%%%%', encoded([1, 2]), encoded(None), encoded('abc'),
+                                    encoded({'id': 'abc'}), encoded({'offset': 3}),
+                                    encoded({'id': 'abc', 'offset': 'many'}), encoded({'id': 'abc', 'offset': -10}),
+                                    base64.urlsafe_b64encode(b'\xff\xfe').decode()])
+def test_garbage_cursors_decode_to_none(cursor):
+	assert SearchCursors.decode_cursor(cursor) is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr('searching.pagination.time.time', lambda: now[0])
+	monkeypatch.setattr(SearchCursors, 'TTL_SECONDS', 60)
+	entry_id = SearchCursors.put(entry(created_at=now[0]))
+
+	now[0] += 60
+	assert SearchCursors.get(entry_id) is not None
+	now[0] += 1
+	assert SearchCursors.get(entry_id) is None
+	assert SearchCursors.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+	monkeypatch.setattr('searching.pagination.time.time', lambda: 0.0)
+	monkeypatch.setattr(SearchCursors, 'MAX_ENTRIES', 3)
+	first, second, third = (SearchCursors.put(entry()) for _ in range(3))
+
+	# touching the first one makes the second the least recently used
+	assert SearchCursors.get(first) is not None
+	fourth = SearchCursors.put(entry())
+
+	assert SearchCursors.get(second) is None
+	assert all(SearchCursors.get(entry_id) is not None for entry_id in (first, third, fourth))
+	assert SearchCursors.stats()['evictions'] == 1
+	assert SearchCursors.stats()['entries'] == 3
+
+
+def test_pages_neither_overlap_nor_skip_results(searches):
+	page = search_documents_page('reset vpn', 10)
+	results = list(page.results)
+	while page.next_cursor is not None:
+		assert page.total == 25
+		page = search_documents_page('ignored', 10, cursor=page.next_cursor)
+		results += page.results
+
+	assert results == list(range(25))
+	# later pages are sliced from the kept candidates
+	assert searches == ['reset vpn']
+
+
+def test_a_page_is_served_again_from_its_cursor(searches):
+	first = search_documents_page('reset vpn', 10)
+	second = search_documents_page('reset vpn', 10, cursor=first.next_cursor)
+
+	assert search_documents_page('reset vpn', 10, cursor=first.next_cursor).results == second.results
+	assert second.results == list(range(10, 20))
+
+
+def test_unknown_or_expired_cursors_raise_key_error(searches):
+	with pytest.raises(KeyError):
+		search_documents_page('reset vpn', 10, cursor=SearchCursors.encode_cursor('unknown', 10))
+	with pytest.raises(KeyError):
+		search_documents_page('reset vpn', 10, cursor='garbage')
+
+	page = search_documents_page('reset vpn', 10)
+	SearchCursors.clear()
+	with pytest.raises(KeyError):
+		search_documents_page('reset vpn', 10, cursor=page.next_cursor)
+
+
+def test_negative_offsets_are_rejected(searches):
+	page = search_documents_page('reset vpn', 10)
+	entry_id, _ = SearchCursors.decode_cursor(page.next_cursor)
+
+	with pytest.raises(KeyError):
+		search_documents_page('reset vpn', 10, cursor=encoded({'id': entry_id, 'offset': -5}))
+
+
+def test_the_endpoint_returns_410_for_an_unknown_cursor(searches):
+	app = FastAPI()
+	app.include_router(router)
+	client = TestClient(app)
+
+	response = client.get('/search/paged', params={'cursor': SearchCursors.encode_cursor('unknown', 10)})
+	assert response.status_code == 410
+
+	response = client.get('/search/paged', params={'cursor': 'garbage'})
+	assert response.status_code == 410
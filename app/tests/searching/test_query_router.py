@@ -0,0 +1,79 @@
+import pytest
+
+from searching import query_router
+from searching.query_router import QueryRoute, extract_identifiers, normalize_url, route_query
+
+
+@pytest.mark.parametrize('query, identifiers', [
+	('PROJ-1234', ['proj-1234']),
+	('  ABC-1 ', ['abc-1']),
+	('PROJ-12 OPS-3', ['proj-12', 'ops-3']),
+	('group/project#12', ['group/project#12']),
+	('group/sub.group/my-project!34', ['group/sub.group/my-project!34']),
+])
+def test_identifiers_are_looked_up(query, identifiers):
+	routed = route_query(query)
+	assert routed.route == QueryRoute.LOOKUP
+	assert routed.identifiers == identifiers
+	assert routed.query == query.strip()
+
+
+def test_urls_are_looked_up_normalized():
+	routed = route_query('https://www.Example.com/Docs/VPN/#setup')
+	assert routed.route == QueryRoute.LOOKUP
+	assert routed.identifiers == ['example.com/docs/vpn']
+
+
+def test_gitlab_urls_are_looked_up_by_their_reference_too():
+	routed = route_query('https://gitlab.com/Group/project/-/merge_requests/7')
+	assert routed.route == QueryRoute.LOOKUP
+	assert routed.identifiers == ['gitlab.com/group/project/-/merge_requests/7', 'group/project!7']
+
+
+@pytest.mark.parametrize('query, phrase', [
+	('"reset the vpn"', 'reset the vpn'),
+	('  “reset the vpn”  ', 'reset the vpn'),
+	('"PROJ-12"', 'PROJ-12'),
+])
+def test_quoted_phrases(query, phrase):
+	routed = route_query(query)
+	assert routed.route == QueryRoute.PHRASE
+	assert routed.phrase == phrase
+	assert routed.query == phrase
+
+
+@pytest.mark.parametrize('query', ['vpn', 'Kubernetes', 'api.example.com', 'ERR_CONNECTION_RESET',
+                                   'NullPointerException', 'config.yaml', 'HTTP'])
+def test_single_keywords(query):
+	routed = route_query(query)
+	assert routed.route == QueryRoute.KEYWORD
+	assert routed.query == query
+
+
+@pytest.mark.parametrize('query', ['how', 'Why', 'how do I reset the vpn', 'vpn setup', 'PROJ-12 status',
+                                   'what is group/project#12 about', '', '   '])
+def test_everything_else_is_neural(query):
+	routed = route_query(query)
+	assert routed.route == QueryRoute.NEURAL
+	assert routed.query == query
+	assert routed.identifiers == []
+
+
+def test_a_disabled_router_sends_everything_to_neural(monkeypatch):
+	monkeypatch.setattr(query_router, 'ROUTER_ENABLED', False)
+	assert route_query('PROJ-12').route == QueryRoute.NEURAL
+	assert route_query('"reset the vpn"').route == QueryRoute.NEURAL
+
+
+def test_extract_identifiers():
+	assert extract_identifiers(None) == []
+	assert extract_identifiers('PROJ-1 fixes PROJ-2, see PROJ-1 and group/proj#5') == ['proj-1', 'proj-2',
+	                                                                                   'group/proj#5']
+	assert extract_identifiers('https://gitlab.com/group/proj/-/issues/5') == ['group/proj#5']
+	# lower case keys aren't Jira keys
+	assert extract_identifiers('proj-1 and A-1') == []
+
+
+def test_normalize_url():
+	assert normalize_url(' HTTP://www.example.com/path/ ') == 'example.com/path'
+	assert normalize_url('example.com/path#anchor') == 'example.com/path'
@@ -0,0 +1,82 @@
+import torch
+
+from indexing.faiss_index import MODEL_DIM
+from indexing.index_generation import IndexGeneration
+from searching import semantic_cache
+from searching.semantic_cache import SemanticQueryCache
+
+
+def embedding(seed: int, noise: float = 0.0, noise_seed: int = 1000) -> torch.Tensor:
+	vector = torch.randn(MODEL_DIM, generator=torch.Generator().manual_seed(seed))
+	if noise:
+		vector += noise * torch.randn(MODEL_DIM, generator=torch.Generator().manual_seed(noise_seed))
+	return vector
+
+
+def test_near_duplicate_hits_and_different_query_misses():
+	cache = SemanticQueryCache(threshold=0.9, ttl_seconds=60, max_size=10)
+	cache.store('how to reset the vpn', embedding(0), 5, ['a', 'b', 'c', 'd', 'e'], IndexGeneration.get())
+
+	assert cache.lookup(embedding(0, noise=0.1), 5) == ['a', 'b', 'c', 'd', 'e']
+	assert cache.lookup(embedding(0), 2) == ['a', 'b']
+	# far below the threshold
+	assert cache.lookup(embedding(1), 5) is None
+	# similar, but not similar enough
+	assert cache.lookup(embedding(0, noise=1.0), 5) is None
+	assert cache.hits == 2 and cache.misses == 2
+
+
+def test_more_results_or_another_variant_miss():
+	cache = SemanticQueryCache(threshold=0.9, ttl_seconds=60, max_size=10)
+	cache.store('query', embedding(0), 5, list(range(5)), IndexGeneration.get(), variant='fast')
+
+	assert cache.lookup(embedding(0), 10, variant='fast') is None
+	assert cache.lookup(embedding(0), 5, variant='accurate') is None
+	assert cache.lookup(embedding(0), 5, variant='fast') == list(range(5))
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(semantic_cache.time, 'monotonic', lambda: now[0])
+	cache = SemanticQueryCache(threshold=0.9, ttl_seconds=60, max_size=10)
+	cache.store('old', embedding(0), 5, ['old'], IndexGeneration.get())
+	now[0] += 30
+	cache.store('new', embedding(1), 5, ['new'], IndexGeneration.get())
+
+	now[0] += 31
+	assert cache.lookup(embedding(0), 1) is None
+	assert cache.lookup(embedding(1), 1) == ['new']
+	assert cache.stats()['size'] == 1
+
+
+def test_oldest_entries_are_evicted_past_max_size():
+	cache = SemanticQueryCache(threshold=0.9, ttl_seconds=60, max_size=2)
+	for seed in range(3):
+		cache.store(f'query {seed}', embedding(seed), 5, [seed], IndexGeneration.get())
+
+	assert cache.lookup(embedding(0), 1) is None
+	assert cache.lookup(embedding(1), 1) == [1]
+	assert cache.lookup(embedding(2), 1) == [2]
+	assert cache.evictions == 1
+
+
+def test_new_generation_drops_entries_and_stale_stores():
+	cache = SemanticQueryCache(threshold=0.9, ttl_seconds=60, max_size=10)
+	generation = IndexGeneration.get()
+	cache.store('query', embedding(0), 5, ['result'], generation)
+
+	IndexGeneration.bump()
+	assert cache.lookup(embedding(0), 1) is None
+	# results computed before the bump are not stored
+	cache.store('query', embedding(0), 5, ['stale'], generation)
+	assert cache.lookup(embedding(0), 1) is None
+	cache.store('query', embedding(0), 5, ['fresh'], IndexGeneration.get())
+	assert cache.lookup(embedding(0), 1) == ['fresh']
+
+
+def test_disabled_cache_never_stores():
+	cache = SemanticQueryCache(threshold=1.1, ttl_seconds=60, max_size=10)
+	cache.store('query', embedding(0), 5, ['result'], IndexGeneration.get())
+	assert not cache.enabled
+	assert cache.lookup(embedding(0), 1) is None
+	assert cache.stats()['size'] == 0
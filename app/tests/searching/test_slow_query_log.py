@@ -0,0 +1,114 @@
+import datetime
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from schemas import SlowQuery
+from schemas.base import Base
+from searching import slow_query_log
+from searching.slow_query_log import SlowQueryLog
+from searching.trace import SearchTrace
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+	"""
+	Logs to a temporary database, a file so the background thread sees the same rows.
+	"""
+	engine = create_engine(f'sqlite:///{tmp_path / "slow_queries.db"}')
+	Base.metadata.create_all(engine)
+	session = sessionmaker(bind=engine)
+	monkeypatch.setattr(slow_query_log, 'Session', session)
+	monkeypatch.setattr(SlowQueryLog, 'THRESHOLD_MS', 100.0)
+	monkeypatch.setattr(SlowQueryLog, 'MAX_ROWS', 10000)
+	return session
+
+
+def trace(elapsed_ms: float) -> SearchTrace:
+	trace = SearchTrace(budget_ms=500)
+	trace.started_at = time.monotonic() - elapsed_ms / 1000
+	trace.ran('bm25', 40)
+	trace.add_time('bm25', elapsed_ms / 2)
+	trace.skip('answer_rescore', 'budget')
+	return trace
+
+
+def record(query: str, elapsed_ms: float, **kwargs) -> bool:
+	logged = SlowQueryLog.record(query, trace(elapsed_ms), 'search', **kwargs)
+	# the single writer thread runs the inserts in order
+	SlowQueryLog._executor.submit(lambda: None).result()
+	return logged
+
+
+def count(session) -> int:
+	with session() as s:
+		return s.query(SlowQuery).count()
+
+
+def test_only_searches_over_the_threshold_are_logged(log):
+	assert not record('fast', 50)
+	assert record('slow', 150, mode='fast', top_k=5)
+	assert count(log) == 1
+
+	[row] = SlowQueryLog.worst()
+	assert row['query'] == 'slow'
+	assert row['endpoint'] == 'search'
+	assert (row['mode'], row['top_k'], row['budget_ms']) == ('fast', 5, 500)
+	assert row['elapsed_ms'] >= 150
+	assert row['candidates'] == {'bm25': 40}
+	assert row['timings_ms'] == {'bm25': 75}
+	assert row['skipped'] == {'answer_rescore': 'budget'}
+
+
+def test_a_negative_threshold_disables_the_log(log, monkeypatch):
+	monkeypatch.setattr(SlowQueryLog, 'THRESHOLD_MS', -1.0)
+	assert not record('slow', 10000)
+	assert count(log) == 0
+
+
+def test_a_zero_threshold_logs_every_search(log, monkeypatch):
+	monkeypatch.setattr(SlowQueryLog, 'THRESHOLD_MS', 0.0)
+	assert record('instant', 0)
+	assert count(log) == 1
+
+
+def test_long_queries_are_truncated(log):
+	record('q' * 1000, 150)
+	assert SlowQueryLog.worst()[0]['query'] == 'q' * slow_query_log.MAX_QUERY_LENGTH
+
+
+def test_only_the_latest_max_rows_are_kept(log, monkeypatch):
+	monkeypatch.setattr(SlowQueryLog, 'MAX_ROWS', 3)
+	for i in range(7):
+		record(f'query {i}', 1000 - i)
+
+	assert count(log) == 3
+	assert sorted(row['query'] for row in SlowQueryLog.worst()) == ['query 4', 'query 5', 'query 6']
+
+
+def test_max_rows_zero_keeps_everything(log, monkeypatch):
+	monkeypatch.setattr(SlowQueryLog, 'MAX_ROWS', 0)
+	for i in range(5):
+		record(f'query {i}', 150)
+	assert count(log) == 5
+
+
+def test_worst_orders_slowest_first(log):
+	for query, elapsed_ms in [('medium', 400), ('slowest', 900), ('fast', 150), ('slow', 600)]:
+		record(query, elapsed_ms)
+
+	assert [row['query'] for row in SlowQueryLog.worst()] == ['slowest', 'slow', 'medium', 'fast']
+	assert [row['query'] for row in SlowQueryLog.worst(limit=2)] == ['slowest', 'slow']
+
+
+def test_worst_since(log):
+	record('old', 900)
+	with log() as s:
+		s.query(SlowQuery).update({SlowQuery.created_at: datetime.datetime(2020, 1, 1)})
+		s.commit()
+	record('new', 200)
+
+	assert [row['query'] for row in SlowQueryLog.worst(since=datetime.datetime(2021, 1, 1))] == ['new']
+	assert [row['query'] for row in SlowQueryLog.worst()] == ['old', 'new']
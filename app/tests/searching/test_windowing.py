@@ -0,0 +1,81 @@
+from searching.windowing import _sentence_spans, best_window
+
+filler = [f'Filler sentence number {i} talks about lunch.' for i in range(20)]
+
+
+def window(text: str, query: str, max_chars: int) -> str:
+	start, end = best_window(text, query, max_chars)
+	assert 0 <= start <= end <= len(text)
+	assert end - start <= max_chars or max_chars <= 0
+	return text[start:end]
+
+
+def test_text_that_fits_is_returned_whole():
+	text = 'Reset the VPN. Then log in again.'
+	assert best_window(text, 'vpn', max_chars=len(text)) == (0, len(text))
+	assert best_window(text, 'vpn', max_chars=1000) == (0, len(text))
+	assert best_window('', 'vpn', max_chars=10) == (0, 0)
+
+
+def test_a_non_positive_max_chars_disables_windowing():
+	text = ' '.join(filler)
+	assert best_window(text, 'lunch', max_chars=0) == (0, len(text))
+
+
+def test_sentences():
+	text = 'First one. Second one!\nThird one?  Fourth'
+	assert [text[start:end] for start, end in _sentence_spans(text, 100)] == \
+	       ['First one.', 'Second one!', 'Third one?', 'Fourth']
+
+
+def test_a_sentence_longer_than_max_chars_is_cut_at_spaces():
+	text = ' '.join(['word'] * 50)
+	spans = _sentence_spans(text, 22)
+
+	assert all(end - start <= 22 for start, end in spans)
+	assert all(text[start:end] == 'word word word word' for start, end in spans[:-1])
+	assert ' '.join(text[start:end] for start, end in spans) == text
+	assert window(text, 'word', 22) == 'word word word word'
+
+
+def test_a_word_longer_than_max_chars_is_cut_anywhere():
+	text = 'x' * 25 + ' vpn'
+	assert [text[start:end] for start, end in _sentence_spans(text, 10)] == ['x' * 10, 'x' * 10, 'x' * 5 + ' vpn']
+	assert window(text, 'vpn', 10) == 'x' * 5 + ' vpn'
+
+
+def test_without_query_overlap_the_window_starts_at_the_beginning():
+	text = ' '.join(filler)
+	result = window(text, 'kubernetes deployment', 120)
+
+	assert text.startswith(result)
+	assert result == ' '.join(filler[:2])
+
+
+def test_the_window_covers_the_most_distinct_query_words():
+	text = ' '.join(filler[:5] + ['The VPN drops.', 'Reset the VPN.'] + filler[5:8] +
+	                ['Reset the VPN client, then restart the router.'] + filler[8:])
+	result = window(text, 'how to reset the vpn router', 120)
+
+	assert 'restart the router' in result
+
+
+def test_the_window_centers_the_matches():
+	text = ' '.join(filler[:6] + ['Reset the VPN.'] + filler[6:])
+	result = window(text, 'reset vpn', 120)
+
+	assert 'Reset the VPN.' in result
+	sentences = result.split('. ')
+	match = next(i for i, sentence in enumerate(sentences) if sentence.startswith('Reset the VPN'))
+	# with context on both sides
+	assert 0 < match < len(sentences) - 1
+
+
+def test_ties_go_to_more_occurrences():
+	text = ' '.join(filler[:4] + ['The VPN.'] + filler[4:10] + ['The VPN, the VPN and the VPN.'] + filler[10:])
+	assert 'The VPN, the VPN and the VPN.' in window(text, 'vpn', 100)
+
+
+def test_short_query_words_are_used_when_there_is_nothing_else():
+	text = ' '.join(filler[:6] + ['Go to it.'] + filler[6:])
+	assert 'Go to it.' in window(text, 'go to', 100)
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+pytest.importorskip('fastapi_restful')
+
+from fastapi.testclient import TestClient
+
+import main
+import models
+from models import LazyModel
+
+INDEXES = (main.FaissIndex, main.Bm25Index, main.ParagraphStore, main.MetadataIndex, main.FacetIndex,
+           main.SuggestionIndex, main.LookupIndex)
+
+
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+	for index in INDEXES:
+		monkeypatch.setattr(index, 'instance', object())
+	monkeypatch.setattr(models, 'ALL_MODELS', [LazyModel('bi_encoder', object), LazyModel('qa_model', object)])
+	monkeypatch.setattr(models, '_ready', threading.Event())
+	monkeypatch.setattr(models, '_warm_up_thread', None)
+	# without the context manager, so the startup event doesn't load the real indexes and models
+	return TestClient(main.app)
+
+
+def test_the_app_is_ready_once_the_models_are_warm(client):
+	response = client.get('/api/v1/ready')
+
+	assert response.status_code == 503
+	assert response.json() == {'ready': False, 'indexes_loaded': True,
+	                           'models': {'bi_encoder': False, 'qa_model': False}}
+
+	models.warm_up()
+	assert models.wait_until_ready(5)
+
+	response = client.get('/api/v1/ready')
+	assert response.status_code == 200
+	assert response.json() == {'ready': True, 'indexes_loaded': True,
+	                           'models': {'bi_encoder': True, 'qa_model': True}}
+
+
+def test_the_app_is_not_ready_without_its_indexes(client, monkeypatch):
+	models.warm_up()
+	assert models.wait_until_ready(5)
+	monkeypatch.setattr(main.LookupIndex, 'instance', None)
+
+	response = client.get('/api/v1/ready')
+
+	assert response.status_code == 503
+	assert response.json()['indexes_loaded'] is False
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+import models
+from models import LazyModel
+
+
+@pytest.fixture
+def loads(monkeypatch) -> list:
+	"""
+	Replaces the models with stand-ins recording the order they are loaded in.
+	"""
+	loads = []
+
+	def model(name: str) -> LazyModel:
+		return LazyModel(name, lambda: loads.append(name) or name.upper())
+
+	monkeypatch.setattr(models, 'ALL_MODELS', [model('bi_encoder'), model('cross_encoder'), model('qa_model')])
+	monkeypatch.setattr(models, '_ready', threading.Event())
+	monkeypatch.setattr(models, '_warm_up_thread', None)
+	return loads
+
+
+def test_models_load_on_first_use():
+	calls = []
+	model = LazyModel('model', lambda: calls.append(1) or 'hello')
+
+	assert not model.loaded and calls == []
+	assert model.upper() == 'HELLO'
+	assert model.loaded
+	assert model.get() == 'hello'
+	assert calls == [1]
+
+
+def test_warm_up_loads_every_model_in_order(loads):
+	assert not models.is_ready()
+	assert models.get_status() == {'bi_encoder': False, 'cross_encoder': False, 'qa_model': False}
+
+	models.warm_up()
+	models.warm_up()
+
+	assert models.wait_until_ready(5)
+	assert loads == ['bi_encoder', 'cross_encoder', 'qa_model']
+	assert models.get_status() == {'bi_encoder': True, 'cross_encoder': True, 'qa_model': True}
+
+
+def test_a_model_failing_to_load_keeps_the_app_unready(loads):
+	def fail():
+		raise OSError('no space left on device')
+
+	models.ALL_MODELS[1] = LazyModel('cross_encoder', fail)
+
+	models.warm_up()
+	models._warm_up_thread.join(5)
+
+	assert not models.is_ready()
+	assert models.get_status() == {'bi_encoder': True, 'cross_encoder': False, 'qa_model': False}
@@ -0,0 +1,163 @@
+from typing import List
+
+import pytest
+
+import search_logic
+from indexing.bm25_index import Bm25Index
+from indexing.lookup_index import LookupIndex
+from indexing.paragraph_store import ParagraphStore, StoredDocument
+from search_logic import LOOKUP_SCORE, Candidate, _lexical_candidates, _rerank_batch
+from searching.budget import SETTLED_SCORE_GAP, SearchPreset, StageCosts
+from searching.query_router import route_query
+from searching.trace import SearchTrace
+from tests import documents
+
+preset = SearchPreset(name='test', bm25_candidates=20, bi_encoder_candidates=20, small_cross_encoder_candidates=15)
+early_exit = SearchPreset(name='test', bm25_candidates=20, bi_encoder_candidates=20, small_cross_encoder_candidates=15,
+                          early_exit=True)
+
+
+def document(id: int, parent_id: int = None) -> StoredDocument:
+	return StoredDocument(id=id, id_in_data_source=str(id), data_source_id=1, data_source_name='slack', type='message',
+	                      file_type=None, status=None, is_active=None, title=f'title {id}', author='author',
+	                      author_image_url=None, url=f'https://example.com/{id}', location='#general', timestamp=None,
+	                      parent_id=parent_id)
+
+
+def candidates(count: int) -> List[Candidate]:
+	return [Candidate(content=f'Paragraph {i} about resetting the VPN. Nothing else here.', document=document(i),
+	                  paragraph_id=i) for i in range(count)]
+
+
+@pytest.fixture
+def models(monkeypatch):
+	"""
+	Replaces the cross-encoders and QA: every stage scores a candidate by its paragraph id, spaced by score_gap.
+	"""
+	calls = []
+	score_gap = [1.0]
+
+	def cross_encode(cross_encoder, queries, candidate_lists, top_k, **kwargs):
+		calls.append(('cross_encoder', sum(len(candidates) for candidates in candidate_lists)))
+		for candidates in candidate_lists:
+			for candidate in candidates:
+				candidate.score = -candidate.paragraph_id * score_gap[0]
+			candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+		return [candidates[:top_k] for candidates in candidate_lists]
+
+	def find_answers(queries, candidate_lists):
+		calls.append(('qa', sum(len(candidates) for candidates in candidate_lists)))
+		for candidates in candidate_lists:
+			for candidate in candidates:
+				candidate.answer_start, candidate.answer_end = 0, 5
+		return candidate_lists
+
+	monkeypatch.setattr(search_logic, '_cross_encode_batch', cross_encode)
+	monkeypatch.setattr(search_logic, '_find_answers_in_candidates_batch', find_answers)
+	monkeypatch.setattr(StageCosts, '_ms_per_item', {'small_cross_encoder': 0.001, 'large_cross_encoder': 0.001,
+	                                                 'answer_extraction': 0.001, 'answer_rescore': 0.001})
+	monkeypatch.setattr(StageCosts, 'record', classmethod(lambda cls, stage, items, elapsed_ms: None))
+	return calls, score_gap
+
+
+def test_all_stages_run_without_budget_or_early_exit(models):
+	calls, _ = models
+	trace = SearchTrace()
+	results = _rerank_batch(['reset vpn'], [candidates(20)], 3, preset, trace)
+
+	assert [candidate.paragraph_id for candidate in results[0]] == [0, 1, 2]
+	assert trace.stages == ['small_cross_encoder', 'collapse', 'large_cross_encoder', 'answer_extraction',
+	                        'answer_rescore']
+	assert trace.skipped == {}
+	assert trace.candidates['large_cross_encoder'] == 15
+	assert calls == [('cross_encoder', 20), ('cross_encoder', 15), ('qa', 3), ('cross_encoder', 3)]
+
+
+def test_settled_ranking_skips_the_large_cross_encoder_and_the_rescore(models):
+	calls, score_gap = models
+	score_gap[0] = SETTLED_SCORE_GAP + 1
+	trace = SearchTrace()
+	results = _rerank_batch(['reset vpn'], [candidates(20)], 3, early_exit, trace)
+
+	assert [candidate.paragraph_id for candidate in results[0]] == [0, 1, 2]
+	assert trace.skipped == {'large_cross_encoder': 'settled', 'answer_rescore': 'settled'}
+	assert 'large_cross_encoder' not in trace.stages
+	assert not trace.degraded
+	assert calls == [('cross_encoder', 20), ('qa', 3)]
+
+
+def test_close_scores_are_not_settled(models):
+	_, score_gap = models
+	score_gap[0] = SETTLED_SCORE_GAP / 2
+	trace = SearchTrace()
+	_rerank_batch(['reset vpn'], [candidates(20)], 3, early_exit, trace)
+
+	assert trace.skipped == {}
+	assert 'large_cross_encoder' in trace.stages
+
+
+def test_exhausted_budget_skips_every_expensive_stage(models):
+	calls, _ = models
+	trace = SearchTrace(budget_ms=1)
+	trace.started_at -= 1
+	results = _rerank_batch(['reset vpn'], [candidates(20)], 3, preset, trace)
+
+	assert [candidate.paragraph_id for candidate in results[0]] == [0, 1, 2]
+	assert trace.skipped == {'large_cross_encoder': 'budget', 'answer_extraction': 'budget',
+	                         'answer_rescore': 'budget'}
+	assert trace.degraded
+	assert calls == [('cross_encoder', 20)]
+	# the answers are highlighted lexically instead
+	assert all(candidate.answer_end > candidate.answer_start for candidate in results[0])
+
+
+def test_tight_budget_shrinks_the_large_cross_encoder(models, monkeypatch):
+	calls, _ = models
+	# about 9 candidates fit into what is left of the budget, out of the 15 that reach the stage
+	monkeypatch.setitem(StageCosts._ms_per_item, 'large_cross_encoder', 10_000 / 9.5)
+	monkeypatch.setitem(StageCosts._ms_per_item, 'answer_extraction', 10_000)
+	trace = SearchTrace(budget_ms=10_000)
+	_rerank_batch(['reset vpn'], [candidates(20)], 3, preset, trace)
+
+	assert trace.candidates['large_cross_encoder'] == 9
+	assert trace.skipped == {'large_cross_encoder_tail': 'budget', 'answer_extraction': 'budget',
+	                         'answer_rescore': 'budget'}
+
+
+def test_lazy_answers_skip_qa(models):
+	calls, _ = models
+	trace = SearchTrace()
+	_rerank_batch(['reset vpn'], [candidates(5)], 3, preset, trace, lazy_answers=True)
+
+	assert trace.skipped == {'answer_extraction': 'lazy', 'answer_rescore': 'lazy'}
+	assert all(call[0] == 'cross_encoder' for call in calls)
+
+
+@pytest.fixture
+def lexical(storage, monkeypatch):
+	for index in (ParagraphStore, Bm25Index, LookupIndex):
+		monkeypatch.setattr(index, 'instance', None)
+		index.create()
+	source = documents.data_source()
+	return [documents.document(1, ['The VPN drops every hour.'], source=source, title='PROJ-12: VPN drops'),
+	        documents.document(2, ['Reset the VPN with PROJ-12 in mind.'], source=source),
+	        documents.document(3, ['Unrelated.'], source=source)]
+
+
+def test_lookups_rank_first_then_bm25(lexical):
+	ParagraphStore.get().add_documents(lexical)
+	Bm25Index.get().add([paragraph for document in lexical for paragraph in document.paragraphs])
+	LookupIndex.get().add_documents(lexical)
+
+	results = _lexical_candidates(route_query('PROJ-12'), 10, None, SearchTrace())
+
+	assert [candidate.paragraph_id for candidate in results] == [100, 200]
+	assert results[0].score >= LOOKUP_SCORE >= results[1].score
+
+
+def test_lookups_missing_from_bm25_are_skipped(lexical):
+	# a document being indexed (or removed) may be in the lookups and not in BM25
+	ParagraphStore.get().add_documents(lexical)
+	LookupIndex.get().add_documents(lexical)
+
+	assert _lexical_candidates(route_query('PROJ-12'), 10, None, SearchTrace()) == []